@@ -0,0 +1,134 @@
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.setting import settings
+
+logger = logging.getLogger(__name__)
+
+# written last by StorageContext.persist, its mtime moves on every reindex
+DOCSTORE_FNAME = "docstore.json"
+
+
+def index_version(persist_dir: str) -> float:
+    """Version of a persisted index, 0 when it has not been built yet"""
+    try:
+        return os.path.getmtime(os.path.join(persist_dir, DOCSTORE_FNAME))
+    except OSError:
+        return 0.0
+
+
+def context_digest(*parts: Optional[str]) -> str:
+    """Digest of the texts besides the question that shape an answer"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def source_set_version(persist_dirs: Dict[str, str]) -> str:
+    """
+    Version of a set of sources
+    Args:
+        persist_dirs: source id -> index directory
+    Returns: digest changing whenever any of the sources is reindexed, added or removed
+    """
+    digest = hashlib.sha1()
+    for source_id in sorted(persist_dirs):
+        digest.update(f"{source_id}:{index_version(persist_dirs[source_id])};".encode("utf-8"))
+    return digest.hexdigest()
+
+
+@dataclass
+class AnswerCacheKey:
+    """
+    Everything an answer depends on besides the exact question wording
+    """
+    embedding: List[float]
+    version: str
+    model_id: str
+    language: str
+    source_ids: List[str] = field(default_factory=list)
+    # digest of the instructions the answer was written under, e.g. the system prompt
+    context: str = ""
+
+
+@dataclass
+class CachedAnswer:
+    key: AnswerCacheKey
+    question: str
+    answer: str
+    sources: List[Dict] = field(default_factory=list)
+
+
+class AnswerCache:
+    """
+    Bounded LRU of final answers matched by question embedding similarity
+
+    A lookup only considers entries with the same source-set version, model, language and context,
+    so reindexing a source changes the version and its old answers can no longer match.
+    """
+
+    def __init__(self, max_size: int = 512, threshold: float = 0.95):
+        self.max_size = max_size
+        self.threshold = threshold
+        self._items: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def lookup(self, key: AnswerCacheKey) -> Optional[CachedAnswer]:
+        """Most similar cached answer above the threshold, None on a miss"""
+        query = self._unit(key.embedding)
+        best_id, best_score = None, self.threshold
+        with self._lock:
+            for entry_id, entry in self._items.items():
+                if entry.key.version != key.version \
+                        or entry.key.model_id != key.model_id \
+                        or entry.key.language != key.language \
+                        or entry.key.context != key.context:
+                    continue
+                score = float(self._vectors[entry_id] @ query)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                return None
+            self._items.move_to_end(best_id)
+            logger.info(f"Answer cache hit with similarity {best_score:.3f}")
+            return self._items[best_id]
+
+    def put(self, key: AnswerCacheKey, question: str, answer: str, sources: List[Dict] = None) -> None:
+        entry_id = str(uuid.uuid4())
+        with self._lock:
+            self._items[entry_id] = CachedAnswer(key=key, question=question, answer=answer, sources=sources or [])
+            self._vectors[entry_id] = self._unit(key.embedding)
+            while len(self._items) > self.max_size:
+                evicted, _ = self._items.popitem(last=False)
+                del self._vectors[evicted]
+
+    def invalidate_sources(self, source_ids: Iterable[str]) -> int:
+        """Drop every answer built on one of the sources, returns the number of dropped entries"""
+        source_ids = set(source_ids)
+        with self._lock:
+            stale = [i for i, entry in self._items.items() if source_ids.intersection(entry.key.source_ids)]
+            for entry_id in stale:
+                del self._items[entry_id]
+                del self._vectors[entry_id]
+        if stale:
+            logger.info(f"Invalidated {len(stale)} cached answers of sources {sorted(source_ids)}")
+        return len(stale)
+
+
+answer_cache = AnswerCache(max_size=settings.answer_cache_size, threshold=settings.answer_cache_threshold)
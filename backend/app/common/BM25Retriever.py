@@ -0,0 +1,149 @@
+import heapq
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import BaseNode, NodeWithScore, QueryBundle
+from llama_index.core.storage.docstore.types import BaseDocumentStore
+
+logger = logging.getLogger(__name__)
+
+BM25_INDEX_FNAME = "bm25_index.json"
+
+_WORD_PATTERN = re.compile(r"[0-9a-z_\u00c0-\u024f]+(?:[\-./:][0-9a-z_\u00c0-\u024f]+)*")
+_CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tokenize text for the sparse index
+    Compound identifiers such as ERR-1042 or v1.2.3 are kept whole and also split into their parts,
+    CJK runs are indexed as unigrams and bigrams since they carry no whitespace.
+    """
+    text = text.lower()
+    tokens = []
+    for word in _WORD_PATTERN.findall(text):
+        tokens.append(word)
+        parts = re.split(r"[\-./:]", word)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p)
+    for run in _CJK_PATTERN.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    Persistent BM25 inverted index over the leaf nodes of one source
+    """
+
+    def __init__(
+            self,
+            postings: Optional[Dict[str, Dict[str, int]]] = None,
+            doc_len: Optional[Dict[str, int]] = None,
+            k1: float = 1.5,
+            b: float = 0.75
+    ):
+        self.postings = postings or {}
+        self.doc_len = doc_len or {}
+        self.k1 = k1
+        self.b = b
+        self.avgdl = sum(self.doc_len.values()) / len(self.doc_len) if self.doc_len else 0.0
+
+    @classmethod
+    def from_nodes(cls, nodes: Sequence[BaseNode]) -> "BM25Index":
+        postings: Dict[str, Dict[str, int]] = {}
+        doc_len = {}
+        for node in nodes:
+            counts = Counter(tokenize(node.get_content()))
+            doc_len[node.node_id] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, {})[node.node_id] = tf
+        return cls(postings=postings, doc_len=doc_len)
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str) -> "BM25Index":
+        with open(persist_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(postings=data["postings"], doc_len=data["doc_len"], k1=data["k1"], b=data["b"])
+
+    def persist(self, persist_path: str) -> None:
+        with open(persist_path, "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "doc_len": self.doc_len, "postings": self.postings}, f)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """
+        Score the documents containing at least one query term
+        Args:
+            query: query text
+            top_k: number of results
+        Returns: (node id, bm25 score) pairs, best first
+        """
+        n_docs = len(self.doc_len)
+        if n_docs == 0:
+            return []
+
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            for node_id, tf in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[node_id] / self.avgdl)
+                scores[node_id] = scores.get(node_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+
+def load_or_build_bm25_index(
+        persist_dir: str,
+        docstore: BaseDocumentStore,
+        node_ids: Sequence[str]
+) -> BM25Index:
+    """
+    Load the sparse index of a persisted source, building it from the docstore for indexes created before it existed
+    Args:
+        persist_dir: index directory
+        docstore: docstore of the loaded index
+        node_ids: ids of the leaf nodes that are embedded in the vector store
+    Returns: BM25Index
+    """
+    persist_path = os.path.join(persist_dir, BM25_INDEX_FNAME)
+    if os.path.exists(persist_path):
+        return BM25Index.from_persist_path(persist_path)
+
+    bm25_index = BM25Index.from_nodes(docstore.get_nodes(list(node_ids)))
+    bm25_index.persist(persist_path)
+    logger.info(f"Built missing BM25 index for {persist_dir}: {len(bm25_index.doc_len)} nodes")
+    return bm25_index
+
+
+class BM25Retriever(BaseRetriever):
+    """
+    Sparse keyword retriever answering from a BM25Index and the docstore of the same source
+    """
+
+    def __init__(
+            self,
+            bm25_index: BM25Index,
+            docstore: BaseDocumentStore,
+            similarity_top_k: int = 6
+    ):
+        self._bm25_index = bm25_index
+        self._docstore = docstore
+        self._similarity_top_k = similarity_top_k
+        super().__init__()
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        results = self._bm25_index.search(query_bundle.query_str, self._similarity_top_k)
+        return [
+            NodeWithScore(node=self._docstore.get_node(node_id), score=score)
+            for node_id, score in results
+        ]
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Optional
+
+from starlette.requests import Request
+
+from app.setting import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ClientDisconnected(Exception):
+    """The client closed the connection before the answer was ready"""
+    pass
+
+
+class DisconnectWatch:
+    """
+    Throttled disconnect check for streaming loops, asks the server at most once per poll interval
+    """
+
+    def __init__(self, request: Optional[Request], poll_interval: Optional[float] = None):
+        self.request = request if isinstance(request, Request) else None
+        self.poll_interval = poll_interval if poll_interval is not None else settings.disconnect_poll_interval
+        self._last_check = 0.0
+
+    async def disconnected(self) -> bool:
+        if self.request is None:
+            return False
+        now = time.monotonic()
+        if now - self._last_check < self.poll_interval:
+            return False
+        self._last_check = now
+        return await self.request.is_disconnected()
+
+    async def wait(self) -> None:
+        """Return once the client has disconnected"""
+        while self.request is not None:
+            if await self.request.is_disconnected():
+                return
+            await asyncio.sleep(self.poll_interval)
+        await asyncio.Event().wait()
+
+
+async def cancel_on_disconnect(request: Optional[Request], awaitable: Awaitable) -> Any:
+    """
+    Await a retrieval or LLM call, cancelling it when the client disconnects first
+    Args:
+        request: incoming request, the awaitable runs unwatched when it is not a Request
+        awaitable: work done before the response starts streaming
+    Returns: result of the awaitable
+    Raises: ClientDisconnected
+    """
+    task = asyncio.ensure_future(awaitable)
+    if not isinstance(request, Request):
+        return await task
+
+    watcher = asyncio.ensure_future(DisconnectWatch(request).wait())
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if task.done():
+        return task.result()
+
+    task.cancel()
+    logger.info("Client disconnected, cancelled in-flight retrieval")
+    raise ClientDisconnected()
+
+
+async def close_stream(stream: Any) -> None:
+    """Close a token generator so the LLM request behind it is aborted"""
+    try:
+        if hasattr(stream, "aclose"):
+            await stream.aclose()
+        elif hasattr(stream, "close"):
+            stream.close()
+    except Exception as e:
+        logger.error(f"Failed to close LLM stream: {str(e)}")
@@ -0,0 +1,114 @@
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from llama_index.core.utils import get_tokenizer
+
+logger = logging.getLogger(__name__)
+
+
+class ContextPacker(BaseNodePostprocessor):
+    """
+    Pack retrieved nodes into a token budget before synthesis
+
+    Nodes are ranked by score, auto-merged parents swallow the children they contain, and the
+    best nodes are kept while they fit the budget. Fewer prompt tokens means shorter prefill
+    on local models, so the first token arrives sooner.
+    """
+
+    token_budget: int = Field(description="Maximum tokens of retrieved context passed to the LLM")
+    _tokenizer: Callable = PrivateAttr()
+    _last_stats: Dict[str, int] = PrivateAttr(default_factory=dict)
+
+    def __init__(self, token_budget: int, tokenizer: Optional[Callable] = None, **kwargs: Any):
+        super().__init__(token_budget=token_budget, **kwargs)
+        self._tokenizer = tokenizer or get_tokenizer()
+
+    @classmethod
+    def from_llm(cls, llm: Any, budget_ratio: float = 0.6, max_tokens: int = 0) -> "ContextPacker":
+        """
+        Derive the budget from the context window of the active model
+        Args:
+            llm: llama index LLM, its metadata provides context_window and num_output
+            budget_ratio: share of the window left after the answer that may hold context
+            max_tokens: hard cap on the budget, 0 for none
+        Returns: ContextPacker
+        """
+        context_window = llm.metadata.context_window
+        num_output = max(llm.metadata.num_output, 0)
+        budget = int((context_window - num_output) * budget_ratio)
+        if max_tokens > 0:
+            budget = min(budget, max_tokens)
+        return cls(token_budget=max(budget, 256))
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextPacker"
+
+    @property
+    def last_stats(self) -> Dict[str, int]:
+        return self._last_stats
+
+    def _count(self, node: NodeWithScore) -> int:
+        return len(self._tokenizer(node.node.get_content(metadata_mode=MetadataMode.LLM)))
+
+    @staticmethod
+    def _dedupe(nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        """Drop repeated nodes and children already covered by a kept parent, best score first"""
+        ranked = sorted(nodes, key=lambda n: n.score or 0.0, reverse=True)
+        kept: List[NodeWithScore] = []
+        for candidate in ranked:
+            node = candidate.node
+            text = node.get_content()
+            if any(k.node.node_id == node.node_id for k in kept):
+                continue
+            parent = node.parent_node
+            if parent is not None and any(k.node.node_id == parent.node_id for k in kept):
+                continue
+            if any(text in k.node.get_content() for k in kept):
+                continue
+            # a parent ranked below one of its children replaces them at the child's rank
+            covered = [i for i, k in enumerate(kept) if k.node.get_content() in text]
+            if covered:
+                candidate.score = kept[covered[0]].score
+                kept[covered[0]] = candidate
+                for i in reversed(covered[1:]):
+                    del kept[i]
+                continue
+            kept.append(candidate)
+        return kept
+
+    def _postprocess_nodes(
+            self,
+            nodes: List[NodeWithScore],
+            query_bundle: Optional[QueryBundle] = None
+    ) -> List[NodeWithScore]:
+        if not nodes:
+            return nodes
+
+        tokens_in = sum(self._count(n) for n in nodes)
+        packed = []
+        used = 0
+        for node in self._dedupe(nodes):
+            tokens = self._count(node)
+            # always answer from the best node, even when it alone exceeds the budget
+            if packed and used + tokens > self.token_budget:
+                continue
+            packed.append(node)
+            used += tokens
+
+        self._last_stats = {
+            "nodes_in": len(nodes),
+            "nodes_out": len(packed),
+            "tokens_in": tokens_in,
+            "tokens_out": used,
+            "tokens_saved": tokens_in - used,
+            "token_budget": self.token_budget
+        }
+        logger.info(
+            f"Packed context: {len(packed)}/{len(nodes)} nodes, {used}/{self.token_budget} tokens, "
+            f"saved {tokens_in - used} tokens"
+        )
+        return packed
@@ -0,0 +1,84 @@
+import logging
+from typing import Dict, Optional, Sequence
+
+from sqlalchemy import column, func, literal_column, table, text
+
+logger = logging.getLogger(__name__)
+
+# Preferred first. trigram matches any substring of three or more characters, like the ilike
+# search it replaces and whatever the script, CJK included. unicode61 matches whole words on
+# SQLite builds older than 3.34.
+FTS_TOKENIZERS = ("trigram case_sensitive 0", "unicode61 remove_diacritics 2")
+
+# shorter keywords have no trigram and are searched with ilike
+FTS_MIN_KEYWORD_LENGTH = 3
+
+SNIPPET_OPEN = "<mark>"
+SNIPPET_CLOSE = "</mark>"
+
+_available: Dict[str, bool] = {}
+
+
+def fts_match_expression(keyword: Optional[str]) -> Optional[str]:
+    """
+    FTS5 query matching the keyword as a literal phrase, None when it should go through ilike
+    Args:
+        keyword: search keyword typed by the user
+    Returns: MATCH expression or None
+    """
+    keyword = (keyword or "").strip()
+    if len(keyword) < FTS_MIN_KEYWORD_LENGTH:
+        return None
+    # a quoted string is a phrase, operators and column filters inside it are plain text
+    return '"' + keyword.replace('"', '""') + '"'
+
+
+async def fts_available(session, fts_table: str) -> bool:
+    """Whether the migration created the index, it is skipped when SQLite lacks FTS5"""
+    if fts_table not in _available:
+        result = await session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": fts_table}
+        )
+        _available[fts_table] = result.first() is not None
+    return _available[fts_table]
+
+
+class FtsMatch:
+    """
+    MATCH of a keyword against the FTS5 index of a table, joined into the caller's query on rowid
+    so its filters apply before the LIMIT
+    """
+
+    def __init__(self, fts_table: str, expression: str, weights: Sequence[float] = ()):
+        bm25_args = "".join(f", {float(weight)}" for weight in weights)
+        # join on table.c.rowid == <indexed table>.rowid
+        self.table = table(fts_table, column("rowid"))
+        self.condition = text(f"{fts_table} MATCH :fts_expression").bindparams(fts_expression=expression)
+        # lower is better. bm25() and snippet() are not allowed inside aggregates, best_rank is, with all weights 1.0
+        self.rank = literal_column(f"bm25({fts_table}{bm25_args})")
+        self.best_rank = func.min(literal_column(f"{fts_table}.rank"))
+        self.snippet = func.snippet(literal_column(fts_table), -1, SNIPPET_OPEN, SNIPPET_CLOSE, "…", 32)
+
+
+async def full_text_match(
+        session,
+        table_name: str,
+        keyword: Optional[str],
+        weights: Sequence[float] = ()
+) -> Optional[FtsMatch]:
+    """
+    Full-text match of the keyword against the FTS5 index of a table
+    Args:
+        session: database session
+        table_name: indexed table, its index is <table>_fts
+        keyword: search keyword
+        weights: bm25 weight of each indexed column, all 1.0 when empty
+    Returns: FtsMatch whose snippet wraps the hits in <mark>,
+        None when the keyword or the database cannot use the index and the caller should fall back to ilike
+    """
+    fts_table = f"{table_name}_fts"
+    expression = fts_match_expression(keyword)
+    if expression is None or not await fts_available(session, fts_table):
+        return None
+    return FtsMatch(fts_table, expression, weights)
@@ -0,0 +1,53 @@
+import importlib.util
+import logging
+from typing import Dict
+
+import httpx
+
+from app.setting import settings
+
+logger = logging.getLogger(__name__)
+
+# one pool per upstream so a slow host cannot exhaust the connections of another
+SUPABASE = "supabase"
+LLAMA_CLOUD = "llama_cloud"
+OLLAMA = "ollama"
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _http2_enabled() -> bool:
+    # httpx negotiates HTTP/2 only when the optional h2 package is installed
+    return settings.http2 and importlib.util.find_spec("h2") is not None
+
+
+def get_async_client(name: str = SUPABASE) -> httpx.AsyncClient:
+    """
+    Application scoped keep-alive client of an upstream, created on first use
+    Args:
+        name: upstream pool name
+    Returns: httpx.AsyncClient shared by every request to that upstream
+    """
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=_http2_enabled(),
+            limits=httpx.Limits(
+                max_connections=settings.http_max_connections,
+                max_keepalive_connections=settings.http_max_keepalive_connections,
+                keepalive_expiry=settings.http_keepalive_expiry
+            ),
+            timeout=httpx.Timeout(settings.http_timeout, connect=settings.http_connect_timeout)
+        )
+        _clients[name] = client
+    return client
+
+
+async def close_async_clients() -> None:
+    """Close every pooled client, registered as a shutdown handler"""
+    for name, client in list(_clients.items()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.error(f"Failed to close http client {name}: {str(e)}")
+    _clients.clear()
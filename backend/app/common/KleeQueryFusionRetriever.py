@@ -0,0 +1,207 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from llama_index.core.retrievers import QueryFusionRetriever
+from llama_index.core.retrievers.fusion_retriever import FUSION_MODES
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from app.common.LlamaEnum import LlmPriority, RetrievalMode
+from app.common.LlmScheduler import llm_scheduler
+from app.common.QueryExpansion import expand_query, is_keyword_query, normalize_query
+from app.common.RetrievalCoordinator import RetrievalCoordinator, RetrievalReport
+from app.setting import settings
+
+logger = logging.getLogger(__name__)
+
+
+class GeneratedQueryCache:
+    """
+    Bounded LRU of LLM generated sub-queries keyed by (conversation id, normalized question)
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._items: "OrderedDict[Tuple[str, str], List[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id: Optional[str], query: str) -> Optional[List[str]]:
+        key = (conversation_id or "", normalize_query(query))
+        with self._lock:
+            queries = self._items.get(key)
+            if queries is not None:
+                self._items.move_to_end(key)
+            return queries
+
+    def put(self, conversation_id: Optional[str], query: str, queries: List[str]) -> None:
+        key = (conversation_id or "", normalize_query(query))
+        with self._lock:
+            self._items[key] = queries
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+generated_query_cache = GeneratedQueryCache(max_size=settings.query_cache_size)
+
+
+class KleeQueryFusionRetriever(QueryFusionRetriever):
+    """
+    QueryFusionRetriever whose sub-query generation depends on the conversation retrieval mode
+
+    none:      only the original query, no generation at all
+    expand:    keyword/identifier variants computed locally, no LLM round trip
+    cached:    LLM generated queries, cached per (question, conversation)
+
+    With sparse (BM25) retrievers the dense and sparse results are fused by reciprocal rank,
+    and keyword-heavy queries are answered from the sparse retrievers alone when they have hits.
+
+    Every (query, retriever) pair runs concurrently on the retrieval thread pool, sources missing the
+    deadline are left out of the fusion and listed in `last_report.timed_out`.
+    """
+
+    def __init__(
+            self,
+            retrievers: List[Any],
+            retrieval_mode: str = RetrievalMode.EXPAND.value,
+            conversation_id: Optional[str] = None,
+            num_queries: int = 4,
+            sparse_retrievers: Optional[List[Any]] = None,
+            keyword_top_k: int = 6,
+            source_ids: Optional[List[str]] = None,
+            sparse_source_ids: Optional[List[str]] = None,
+            source_deadline: Optional[float] = None,
+            **kwargs: Any
+    ):
+        self.retrieval_mode = retrieval_mode
+        self.conversation_id = conversation_id
+        self.keyword_top_k = keyword_top_k
+        self._sparse_retrievers = sparse_retrievers or []
+        dense_ids = source_ids or [str(i) for i in range(len(retrievers))]
+        sparse_ids = sparse_source_ids or [f"sparse-{i}" for i in range(len(self._sparse_retrievers))]
+        self._source_ids = list(dense_ids) + list(sparse_ids)
+        self._coordinator = RetrievalCoordinator(deadline=source_deadline)
+        self.last_report = RetrievalReport()
+        if retrieval_mode == RetrievalMode.NONE.value:
+            num_queries = 1
+        if self._sparse_retrievers:
+            kwargs.setdefault("mode", FUSION_MODES.RECIPROCAL_RANK)
+        super().__init__(list(retrievers) + self._sparse_retrievers, num_queries=num_queries, **kwargs)
+
+    def _local_queries(self, original_query: str) -> Optional[List[QueryBundle]]:
+        """Queries that can be produced without the LLM, None when the LLM has to be asked"""
+        if self.retrieval_mode == RetrievalMode.EXPAND.value:
+            return [QueryBundle(q) for q in expand_query(original_query, self.num_queries - 1)]
+        if self.retrieval_mode == RetrievalMode.CACHED.value:
+            cached = generated_query_cache.get(self.conversation_id, original_query)
+            if cached is not None:
+                logger.debug(f"Generated query cache hit for conversation {self.conversation_id}")
+                return [QueryBundle(q) for q in cached]
+        return None
+
+    def _get_queries(self, original_query: str) -> List[QueryBundle]:
+        queries = self._local_queries(original_query)
+        if queries is None:
+            queries = super()._get_queries(original_query)
+            generated_query_cache.put(self.conversation_id, original_query, [q.query_str for q in queries])
+        return queries
+
+    async def _agenerate_queries(self, original_query: str) -> List[QueryBundle]:
+        """_get_queries without blocking the event loop on the LLM round trip"""
+        queries = self._local_queries(original_query)
+        if queries is None:
+            prompt_str = self.query_gen_prompt.format(num_queries=self.num_queries - 1, query=original_query)
+            async with llm_scheduler.slot(self._llm, LlmPriority.QUERY_GEN):
+                response = await self._llm.acomplete(prompt_str)
+            # one query per line, the LLM often returns more than asked for
+            lines = [line.strip() for line in response.text.split("\n") if line.strip()]
+            queries = [QueryBundle(line) for line in lines[:self.num_queries - 1]]
+            generated_query_cache.put(self.conversation_id, original_query, [q.query_str for q in queries])
+        return queries
+
+    def _fan_out_tasks(self, queries: List[QueryBundle]):
+        return [
+            ((query.query_str, i), self._source_ids[i], retriever, query)
+            for query in queries
+            for i, retriever in enumerate(self._retrievers)
+        ]
+
+    def _keyword_tasks(self, query_bundle: QueryBundle):
+        offset = len(self._retrievers) - len(self._sparse_retrievers)
+        return [
+            (i, self._source_ids[offset + i], retriever, query_bundle)
+            for i, retriever in enumerate(self._sparse_retrievers)
+        ]
+
+    def _record(self, report: RetrievalReport) -> Dict:
+        self.last_report = report
+        return report.results
+
+    def _run_sync_queries(self, queries: List[QueryBundle]) -> Dict[Tuple[str, int], List[NodeWithScore]]:
+        return self._record(self._coordinator.run(self._fan_out_tasks(queries)))
+
+    def _run_nested_async_queries(self, queries: List[QueryBundle]) -> Dict[Tuple[str, int], List[NodeWithScore]]:
+        # retrievers are synchronous underneath, threads give real parallelism without nesting event loops
+        return self._record(self._coordinator.run(self._fan_out_tasks(queries)))
+
+    async def _run_async_queries(self, queries: List[QueryBundle]) -> Dict[Tuple[str, int], List[NodeWithScore]]:
+        return self._record(await self._coordinator.arun(self._fan_out_tasks(queries)))
+
+    def _merge_keyword_results(self, results: List[List[NodeWithScore]]) -> Optional[List[NodeWithScore]]:
+        best = {}
+        for nodes in results:
+            for node in nodes:
+                if node.node.node_id not in best or node.score > best[node.node.node_id].score:
+                    best[node.node.node_id] = node
+        if not best:
+            return None
+        return sorted(best.values(), key=lambda n: n.score, reverse=True)[:self.keyword_top_k]
+
+    @staticmethod
+    def _search_bundle(query_bundle: QueryBundle) -> QueryBundle:
+        """
+        The user's own question to retrieve with
+        Callers append answer instructions to the prompt and pass the bare question as its embedding
+        string, so the instructions never reach the indexes or the keyword classification.
+        """
+        if query_bundle.custom_embedding_strs:
+            return QueryBundle(query_str=query_bundle.custom_embedding_strs[0], embedding=query_bundle.embedding)
+        return query_bundle
+
+    def _use_keyword_path(self, query_bundle: QueryBundle) -> bool:
+        return len(self._sparse_retrievers) > 0 and is_keyword_query(query_bundle.query_str)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        query_bundle = self._search_bundle(query_bundle)
+        if self._use_keyword_path(query_bundle):
+            results = self._record(self._coordinator.run(self._keyword_tasks(query_bundle)))
+            nodes = self._merge_keyword_results(list(results.values()))
+            if nodes is not None:
+                return nodes
+        return super()._retrieve(query_bundle)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        query_bundle = self._search_bundle(query_bundle)
+        if self._use_keyword_path(query_bundle):
+            results = self._record(await self._coordinator.arun(self._keyword_tasks(query_bundle)))
+            nodes = self._merge_keyword_results(list(results.values()))
+            if nodes is not None:
+                return nodes
+
+        queries: List[QueryBundle] = [query_bundle]
+        if self.num_queries > 1:
+            queries.extend(await self._agenerate_queries(query_bundle.query_str))
+        return self._fuse(await self._run_async_queries(queries))
+
+    def _fuse(self, results: Dict[Tuple[str, int], List[NodeWithScore]]) -> List[NodeWithScore]:
+        if self.mode == FUSION_MODES.RECIPROCAL_RANK:
+            return self._reciprocal_rerank_fusion(results)[:self.similarity_top_k]
+        elif self.mode == FUSION_MODES.RELATIVE_SCORE:
+            return self._relative_score_fusion(results)[:self.similarity_top_k]
+        elif self.mode == FUSION_MODES.DIST_BASED_SCORE:
+            return self._relative_score_fusion(results, dist_based=True)[:self.similarity_top_k]
+        elif self.mode == FUSION_MODES.SIMPLE:
+            return self._simple_fusion(results)[:self.similarity_top_k]
+        else:
+            raise ValueError(f"Invalid fusion mode: {self.mode}")
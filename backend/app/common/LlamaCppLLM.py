@@ -0,0 +1,330 @@
+import asyncio
+import hashlib
+import logging
+import os
+import platform
+import subprocess
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+    MessageRole,
+)
+from llama_index.core.bridge.pydantic import ConfigDict, Field, PrivateAttr
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+from llama_index.core.llms.custom import CustomLLM
+
+from app.common.PromptCache import LlamaCppStateCache
+from app.setting import settings
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+def _prompt_cache_root() -> str:
+    return settings.prompt_cache_dir or os.path.join(os.path.expanduser("~"), ".cache", "klee", "prompt_cache")
+
+
+def physical_core_count() -> int:
+    """
+    Cores worth a token generation thread: physical (performance cores on Apple silicon), not hyperthreads
+    Falls back to half the logical CPUs, llama.cpp's own default, when the topology is unknown.
+    """
+    system = platform.system().lower()
+    try:
+        if system == "darwin":
+            for key in ("hw.perflevel0.physicalcpu", "hw.physicalcpu"):
+                result = subprocess.run(["sysctl", "-n", key], capture_output=True, text=True, timeout=2)
+                if result.returncode == 0 and result.stdout.strip().isdigit():
+                    return max(1, int(result.stdout.strip()))
+        elif system == "linux":
+            cores = set()
+            physical_id = core_id = None
+            with open("/proc/cpuinfo") as f:
+                for line in f:
+                    if line.startswith("physical id"):
+                        physical_id = line.split(":", 1)[1].strip()
+                    elif line.startswith("core id"):
+                        core_id = line.split(":", 1)[1].strip()
+                    elif not line.strip():
+                        if core_id is not None:
+                            cores.add((physical_id, core_id))
+                        physical_id = core_id = None
+            if core_id is not None:
+                cores.add((physical_id, core_id))
+            if cores:
+                return len(cores)
+    except (OSError, ValueError, subprocess.SubprocessError):
+        pass
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+async def _stream_in_thread(produce: Callable[[], Iterator[Any]]) -> AsyncIterator[Any]:
+    """
+    Pull a blocking generator on a worker thread and hand its items to the event loop
+    Closing the async iterator stops the generator at its next item.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def put(item: Any, error: Optional[BaseException] = None) -> None:
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+        except RuntimeError:
+            # the loop is gone, nobody is listening any more
+            stop.set()
+
+    def run() -> None:
+        generator = produce()
+        try:
+            for item in generator:
+                if stop.is_set():
+                    break
+                put(item)
+        except BaseException as e:
+            put(_DONE, e)
+            return
+        finally:
+            generator.close()
+        put(_DONE)
+
+    loop.run_in_executor(None, run)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+class LlamaCppLLM(CustomLLM):
+    """
+    GGUF model running in process on llama.cpp
+
+    The weights are memory mapped, token generation uses one thread per physical core and prompt
+    processing every logical one, in batches of n_batch tokens. Chat prompts use the chat template
+    embedded in the GGUF file. Async calls run generation on a worker thread and stream tokens back.
+    Prompt states are saved on disk so a follow-up turn only prefills the tokens it adds.
+    Closing an instance that is still generating frees the model when its last generation ends.
+    """
+
+    model_config = ConfigDict(protected_namespaces=())
+
+    model_path: str = Field(description="Path of the GGUF model file")
+    context_window: int = Field(default=4096, description="Token context window")
+    max_new_tokens: int = Field(default=1024, description="Tokens generated at most per answer")
+    temperature: float = Field(default=0.5)
+    n_threads: int = Field(default=0, description="Generation threads, 0 for one per physical core")
+    n_threads_batch: int = Field(default=0, description="Prompt processing threads, 0 for every logical core")
+    n_batch: int = Field(default=512, description="Prompt tokens evaluated per batch")
+    n_gpu_layers: int = Field(default=0, description="Layers offloaded to the GPU, -1 for all")
+    use_mlock: bool = Field(default=False, description="Pin the mapped weights in RAM")
+
+    _model: Any = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+    _state_lock: threading.Lock = PrivateAttr()
+    _users: int = PrivateAttr()
+    _retired: bool = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        if not os.path.exists(self.model_path):
+            raise ValueError(f"Model file not found: {self.model_path}")
+
+        # a llama.cpp context serves one generation at a time
+        self._lock = threading.Lock()
+        # guards the model handle and the count of generations using it, never held while generating
+        self._state_lock = threading.Lock()
+        self._users = 0
+        self._retired = False
+        self._model = self._load()
+
+    def _load(self) -> Any:
+        from llama_cpp import Llama
+
+        n_threads = self.n_threads or physical_core_count()
+        n_threads_batch = self.n_threads_batch or os.cpu_count() or n_threads
+        model = Llama(
+            model_path=self.model_path,
+            n_ctx=self.context_window,
+            n_threads=n_threads,
+            n_threads_batch=n_threads_batch,
+            n_batch=self.n_batch,
+            n_gpu_layers=self.n_gpu_layers,
+            use_mmap=True,
+            use_mlock=self.use_mlock,
+            verbose=False
+        )
+        if settings.llamacpp_prompt_cache_gb > 0:
+            model.set_cache(LlamaCppStateCache(
+                cache_dir=os.path.join(_prompt_cache_root(), hashlib.sha1(self.model_path.encode("utf-8")).hexdigest()[:16]),
+                capacity_bytes=int(settings.llamacpp_prompt_cache_gb * 1024 ** 3),
+                min_prefix=settings.llamacpp_prompt_cache_min_prefix,
+                min_prefix_ratio=settings.llamacpp_prompt_cache_min_prefix_ratio
+            ))
+        logger.info(
+            f"Loaded {self.model_path} with {n_threads} generation and {n_threads_batch} prompt threads, "
+            f"batch {self.n_batch}"
+        )
+        return model
+
+    @classmethod
+    def from_settings(cls, model_path: str) -> "LlamaCppLLM":
+        return cls(
+            model_path=model_path,
+            context_window=settings.llamacpp_context_window,
+            max_new_tokens=settings.llamacpp_max_new_tokens,
+            n_threads=settings.llamacpp_n_threads,
+            n_threads_batch=settings.llamacpp_n_threads_batch,
+            n_batch=settings.llamacpp_n_batch,
+            n_gpu_layers=settings.llamacpp_n_gpu_layers,
+            use_mlock=settings.llamacpp_use_mlock
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LlamaCppLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(
+            context_window=self.context_window,
+            num_output=self.max_new_tokens,
+            model_name=self.model_path,
+            is_chat_model=True
+        )
+
+    def close(self) -> None:
+        """
+        Free the weights mapping and the KV cache once no generation uses them
+        Never waits for a running answer: the last generation to finish frees the model. A request
+        holding this instance from before the close loads the model again for its generation.
+        """
+        with self._state_lock:
+            self._retired = True
+            if self._users == 0:
+                self._free()
+
+    def _free(self) -> None:
+        if self._model is not None:
+            self._model.close()
+            self._model = None
+            logger.info(f"Freed {self.model_path}")
+
+    def _acquire(self) -> Any:
+        with self._state_lock:
+            self._users += 1
+            if self._model is None:
+                try:
+                    self._model = self._load()
+                except BaseException:
+                    self._users -= 1
+                    raise
+            return self._model
+
+    def _release(self) -> None:
+        with self._state_lock:
+            self._users -= 1
+            if self._users == 0 and self._retired:
+                self._free()
+
+    def _generation_kwargs(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "max_tokens": kwargs.get("max_tokens", self.max_new_tokens),
+            "temperature": kwargs.get("temperature", self.temperature)
+        }
+
+    @staticmethod
+    def _to_llama_messages(messages: Sequence[ChatMessage]) -> List[Dict[str, str]]:
+        return [{"role": message.role.value, "content": message.content or ""} for message in messages]
+
+    def _chat_stream(self, messages: Sequence[ChatMessage], **kwargs: Any) -> Iterator[ChatResponse]:
+        model = self._acquire()
+        try:
+            with self._lock:
+                chunks = model.create_chat_completion(
+                    messages=self._to_llama_messages(messages),
+                    stream=True,
+                    **self._generation_kwargs(kwargs)
+                )
+                content = ""
+                for chunk in chunks:
+                    delta = chunk["choices"][0]["delta"].get("content") or ""
+                    content += delta
+                    yield ChatResponse(
+                        message=ChatMessage(role=MessageRole.ASSISTANT, content=content),
+                        delta=delta,
+                        raw=chunk
+                    )
+        finally:
+            self._release()
+
+    def _complete_stream(self, prompt: str, **kwargs: Any) -> Iterator[CompletionResponse]:
+        model = self._acquire()
+        try:
+            with self._lock:
+                chunks = model.create_completion(prompt=prompt, stream=True, **self._generation_kwargs(kwargs))
+                text = ""
+                for chunk in chunks:
+                    delta = chunk["choices"][0]["text"] or ""
+                    text += delta
+                    yield CompletionResponse(text=text, delta=delta, raw=chunk)
+        finally:
+            self._release()
+
+    @llm_chat_callback()
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        response = None
+        for response in self._chat_stream(messages, **kwargs):
+            pass
+        return response or ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=""))
+
+    @llm_chat_callback()
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        return self._chat_stream(messages, **kwargs)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        response = None
+        for response in self._complete_stream(prompt, **kwargs):
+            pass
+        return response or CompletionResponse(text="")
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        return self._complete_stream(prompt, **kwargs)
+
+    @llm_chat_callback()
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return await asyncio.to_thread(self.chat, messages, **kwargs)
+
+    @llm_chat_callback()
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        return _stream_in_thread(lambda: self._chat_stream(messages, **kwargs))
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return await asyncio.to_thread(self.complete, prompt, formatted, **kwargs)
+
+    @llm_completion_callback()
+    async def astream_complete(
+            self,
+            prompt: str,
+            formatted: bool = False,
+            **kwargs: Any
+    ) -> CompletionResponseAsyncGen:
+        return _stream_in_thread(lambda: self._complete_stream(prompt, **kwargs))
@@ -1,6 +1,6 @@
 import os
 
-from enum import Enum
+from enum import Enum, IntEnum
 
 user_home = os.path.expanduser("~")
 
@@ -47,6 +47,24 @@ class SystemTypeDiffModelType(Enum):
     KLEE = "klee"
 
 
+class RetrievalMode(Enum):
+    """
+        How sub-queries are produced before retrieval
+    """
+    NONE = "none"
+    EXPAND = "expand"
+    CACHED = "cached"
+
+
+class LlmPriority(IntEnum):
+    """
+        Scheduling priority of LLM requests, lower runs first
+    """
+    INTERACTIVE = 0
+    QUERY_GEN = 1
+    BACKGROUND = 2
+
+
 class SystemTiktokenUrl(Enum):
     WIN_PATH = "C:/Users/Administrator/AppData/Local/com/signer_labs/klee/tiktoken_encode/"
     MAC_PATH = os.path.join(user_home, "Library/Application Support/com.signerlabs.klee/tiktoken_encode/")
@@ -0,0 +1,123 @@
+import gc
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.setting import settings
+
+logger = logging.getLogger(__name__)
+
+
+def credentials_hash(api_key: Optional[str]) -> str:
+    """Digest identifying a credential without keeping it in cache keys or logs"""
+    if not api_key:
+        return ""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass(frozen=True)
+class LlmKey:
+    provider_id: str
+    model_name: str
+    base_url: str = ""
+    credentials: str = ""
+
+
+class LlmInstanceCache:
+    """
+    Bounded LRU of constructed llama index LLM clients
+
+    Switching between models reuses their clients instead of building new ones. Entries leave
+    the cache when the LRU is full or on explicit eviction, e.g. when a provider changes or a
+    local model is unloaded, and only then is memory collected.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[LlmKey, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._create_lock = threading.Lock()
+
+    def get_or_create(self, key: LlmKey, factory: Callable[[], Any]) -> Any:
+        """
+        Cached LLM for the key, created by the factory on a miss
+        Args:
+            key: LlmKey of the client
+            factory: builds the LLM, may return None when the provider is not supported
+        Returns: LLM instance or None
+        """
+        llm = self._get(key)
+        if llm is not None:
+            return llm
+
+        # one creation at a time, so concurrent requests never load the same model twice
+        with self._create_lock:
+            llm = self._get(key)
+            if llm is not None:
+                return llm
+            llm = factory()
+            if llm is None or self.max_size <= 0:
+                return llm
+
+            evicted = []
+            with self._lock:
+                self._items[key] = llm
+                self._items.move_to_end(key)
+                while len(self._items) > self.max_size:
+                    evicted.append(self._items.popitem(last=False))
+        if evicted:
+            self._release(evicted)
+        return llm
+
+    def _get(self, key: LlmKey) -> Optional[Any]:
+        with self._lock:
+            llm = self._items.get(key)
+            if llm is not None:
+                self._items.move_to_end(key)
+            return llm
+
+    def evict(self, predicate: Callable[[LlmKey], bool], keep: int = 0) -> List[LlmKey]:
+        """
+        Drop the cached clients whose key matches the predicate
+        Args:
+            predicate: selects the keys to evict
+            keep: most recently used matching clients left in the cache
+        Returns: evicted keys
+        """
+        with self._lock:
+            matching = [key for key in self._items if predicate(key)]
+            evicted = [(key, self._items.pop(key)) for key in matching[:max(0, len(matching) - keep)]]
+        if evicted:
+            self._release(evicted)
+        return [key for key, _ in evicted]
+
+    def evict_provider(self, provider_id: str) -> List[LlmKey]:
+        return self.evict(lambda key: key.provider_id == provider_id)
+
+    def evict_model(self, model_name: str) -> List[LlmKey]:
+        return self.evict(lambda key: key.model_name == model_name)
+
+    def _release(self, evicted: List[Tuple[LlmKey, Any]]) -> None:
+        logger.info(f"Evicted LLM clients: {[f'{k.provider_id}:{k.model_name}' for k, _ in evicted]}")
+        for key, llm in evicted:
+            # in-process models free their weights and KV cache once their running answers finish
+            close = getattr(llm, "close", None)
+            if callable(close):
+                try:
+                    close()
+                except Exception as e:
+                    logger.error(f"Failed to close LLM {key.provider_id}:{key.model_name}: {str(e)}")
+        gc.collect()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "cached": [f"{k.provider_id}:{k.model_name}" for k in self._items]
+            }
+
+
+llm_cache = LlmInstanceCache(max_size=settings.llm_cache_size)
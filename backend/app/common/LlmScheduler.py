@@ -0,0 +1,154 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from app.common.LlamaEnum import LlmPriority
+from app.setting import settings
+
+logger = logging.getLogger(__name__)
+
+# llama index LLM classes running inside this process, they share one llama.cpp runtime
+_IN_PROCESS_BACKENDS = ("llamacpp", "llamacppllm")
+_LOCAL_BACKENDS = ("ollama", "llamacpp")
+
+
+def backend_of(llm: Any) -> str:
+    """
+    Scheduling backend of an LLM instance, the server or provider its requests compete for
+    Args:
+        llm: llama index LLM
+    Returns: "llamacpp" for every in-process model, "ollama:<base url>" per Ollama server,
+        "<client class>:<api base>" per cloud provider endpoint
+    """
+    if llm is None:
+        return "none"
+    name = type(llm).__name__.lower()
+    if name in _IN_PROCESS_BACKENDS:
+        # models loaded in this process share its CPU/GPU whatever their weights
+        return "llamacpp"
+    # one Ollama server runs all of its models on the same hardware, a cloud provider rate limits per account
+    base_url = getattr(llm, "base_url", None) or getattr(llm, "api_base", None)
+    return f"{name}:{base_url}" if base_url else name
+
+
+class _WaitStats:
+    def __init__(self):
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float) -> None:
+        self.requests += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "requests": self.requests,
+            "avg_wait_ms": round(self.total_wait / self.requests * 1000, 1) if self.requests else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 1)
+        }
+
+
+class _Backend:
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.active = 0
+        # (priority, arrival order, future), the future resolves when a slot is handed over
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self.stats: Dict[LlmPriority, _WaitStats] = {p: _WaitStats() for p in LlmPriority}
+
+
+class LlmScheduler:
+    """
+    Priority admission of LLM requests per backend
+
+    Each backend runs at most `limit` requests at once. When it is full, requests wait in a
+    priority queue: interactive answers, then query generation, then titles and background work,
+    first come first served within a class. A running request is never preempted.
+    """
+
+    def __init__(self):
+        self._backends: Dict[str, _Backend] = {}
+        self._order = itertools.count()
+
+    def _backend(self, name: str) -> _Backend:
+        backend = self._backends.get(name)
+        if backend is None:
+            limit = settings.llm_local_concurrency if _is_local(name) else settings.llm_cloud_concurrency
+            backend = self._backends[name] = _Backend(limit)
+        return backend
+
+    def _hand_over(self, backend: _Backend) -> None:
+        while backend.waiters and backend.active < backend.limit:
+            _, _, waiter = heapq.heappop(backend.waiters)
+            if waiter.done():
+                # cancelled while queued
+                continue
+            backend.active += 1
+            waiter.set_result(None)
+
+    async def acquire(self, name: str, priority: LlmPriority) -> None:
+        backend = self._backend(name)
+        started = time.perf_counter()
+        if backend.active < backend.limit and not backend.waiters:
+            backend.active += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(backend.waiters, (int(priority), next(self._order), waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # the slot was handed over just as we were cancelled
+                    self.release(name)
+                raise
+        wait = time.perf_counter() - started
+        backend.stats[priority].record(wait)
+        if wait > 1.0:
+            logger.info(f"{priority.name} request waited {wait:.2f}s for {name}")
+
+    def release(self, name: str) -> None:
+        backend = self._backend(name)
+        backend.active = max(0, backend.active - 1)
+        self._hand_over(backend)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, llm: Any, priority: LlmPriority) -> AsyncIterator[None]:
+        """
+        Hold a slot of the LLM's backend for the duration of the block
+        Args:
+            llm: llama index LLM the request goes to
+            priority: LlmPriority of the request
+        """
+        name = backend_of(llm)
+        await self.acquire(name, priority)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    async def scheduled_stream(self, llm: Any, priority: LlmPriority, stream: Any) -> AsyncIterator[Any]:
+        """Iterate an async token stream while holding a slot, the request starts on the first token pulled"""
+        async with self.slot(llm, priority):
+            async for item in stream:
+                yield item
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Concurrency, queue depth and queue wait per backend and priority"""
+        return {
+            name: {
+                "limit": backend.limit,
+                "active": backend.active,
+                "queued": sum(1 for _, _, w in backend.waiters if not w.done()),
+                "wait": {p.name.lower(): s.as_dict() for p, s in backend.stats.items()}
+            }
+            for name, backend in self._backends.items()
+        }
+
+
+llm_scheduler = LlmScheduler()
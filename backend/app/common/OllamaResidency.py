@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.common.HttpClients import OLLAMA, get_async_client
+from app.common.LlmCache import llm_cache
+from app.setting import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _physical_memory_bytes() -> Optional[int]:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _memory_budget_bytes() -> Optional[int]:
+    """Configured budget, or half the physical memory, None when it cannot be determined"""
+    if settings.ollama_memory_budget_gb > 0:
+        return int(settings.ollama_memory_budget_gb * 1024 ** 3)
+    physical = _physical_memory_bytes()
+    return physical // 2 if physical else None
+
+
+class OllamaResidencyManager:
+    """
+    Keeps the models of active conversations loaded in Ollama, within a memory budget
+
+    Models are tracked in least recently used order. Loading one that pushes the resident total
+    over the budget unloads the least recently used others; nothing is unloaded otherwise, so
+    opening or switching conversations never forces a reload.
+    """
+
+    def __init__(self, base_url: Optional[str] = None):
+        self.base_url = base_url or settings.ollama_base_url
+        self._resident: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    def mark_used(self, model: str) -> None:
+        """Move a model to the most recently used end without any request"""
+        if model in self._resident:
+            self._resident.move_to_end(model)
+
+    async def _refresh(self) -> None:
+        response = await get_async_client(OLLAMA).get(f"{self.base_url}/api/ps")
+        response.raise_for_status()
+        running = {m["name"]: int(m.get("size", 0)) for m in response.json().get("models", [])}
+        # keep our recency order for known models, models loaded by others count as least recent
+        resident = OrderedDict((name, running[name]) for name in running if name not in self._resident)
+        for name in self._resident:
+            if name in running:
+                resident[name] = running[name]
+        self._resident = resident
+
+    async def _unload(self, model: str) -> None:
+        response = await get_async_client(OLLAMA).post(
+            f"{self.base_url}/api/generate",
+            json={"model": model, "keep_alive": 0}
+        )
+        response.raise_for_status()
+        self._resident.pop(model, None)
+        llm_cache.evict_model(model)
+        logger.info(f"Unloaded Ollama model {model} to stay within the memory budget")
+
+    async def ensure_resident(self, model: str) -> None:
+        """
+        Load a model with keep_alive and make it the most recently used one
+        Args:
+            model: Ollama model name
+        """
+        async with self._lock:
+            response = await get_async_client(OLLAMA).post(
+                f"{self.base_url}/api/generate",
+                json={"model": model, "keep_alive": settings.ollama_keep_alive}
+            )
+            response.raise_for_status()
+            await self._refresh()
+            self.mark_used(model)
+
+            budget = _memory_budget_bytes()
+            if budget is None:
+                return
+            for name in list(self._resident):
+                if sum(self._resident.values()) <= budget:
+                    break
+                if name != model:
+                    await self._unload(name)
+
+    def ensure_resident_in_background(self, model: Optional[str]) -> None:
+        """Fire and forget ensure_resident, for request handlers that must not wait on a model load"""
+        if not model:
+            return
+
+        async def run():
+            try:
+                await self.ensure_resident(model)
+            except Exception as e:
+                logger.error(f"Failed to keep Ollama model {model} resident: {str(e)}")
+
+        task = asyncio.create_task(run())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "budget_bytes": _memory_budget_bytes(),
+            "resident": [{"model": name, "size": size} for name, size in self._resident.items()]
+        }
+
+
+_background_tasks = set()
+
+ollama_residency = OllamaResidencyManager()
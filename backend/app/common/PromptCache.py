@@ -0,0 +1,119 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Sequence, Tuple
+
+from app.setting import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _common_prefix_length(a: Sequence[int], b: Sequence[int]) -> int:
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+class LlamaCppStateCache:
+    """
+    On-disk LRU of llama.cpp states keyed by the tokens they hold, plugged in with Llama.set_cache
+
+    Llama restores the state sharing the longest prefix with a prompt and only evaluates the rest,
+    then saves the state of prompt and answer. A conversation's next prompt extends that key, so
+    follow-up turns only prefill their new tokens. Saving a state drops the shorter ones it
+    extends, which leaves about one entry per conversation.
+
+    Restoring a state reads all of it from disk, so a state is only used when the shared prefix is
+    at least min_prefix tokens and min_prefix_ratio of the state. Otherwise the prompt is prefilled.
+    """
+
+    def __init__(self, cache_dir: str, capacity_bytes: int, min_prefix: int = 0, min_prefix_ratio: float = 0.0):
+        import diskcache
+
+        self.capacity_bytes = capacity_bytes
+        self.min_prefix = max(1, min_prefix)
+        self.min_prefix_ratio = min_prefix_ratio
+        self.cache = diskcache.Cache(
+            cache_dir,
+            size_limit=capacity_bytes,
+            eviction_policy="least-recently-used"
+        )
+
+    @property
+    def cache_size(self) -> int:
+        return int(self.cache.volume())
+
+    def _find_longest_prefix_key(self, key: Tuple[int, ...]) -> Optional[Tuple[int, ...]]:
+        longest, longest_key = 0, None
+        for cached_key in self.cache.iterkeys():
+            length = _common_prefix_length(cached_key, key)
+            if length < self.min_prefix or length < self.min_prefix_ratio * len(cached_key):
+                # reading the whole state back would cost more than prefilling the few tokens it saves
+                continue
+            if length > longest:
+                longest, longest_key = length, cached_key
+        return longest_key
+
+    def __getitem__(self, key: Sequence[int]) -> Any:
+        cached_key = self._find_longest_prefix_key(tuple(key))
+        state = self.cache.get(cached_key) if cached_key is not None else None
+        if state is None:
+            raise KeyError("No cached state shares a prefix with the prompt")
+        return state
+
+    def __contains__(self, key: Sequence[int]) -> bool:
+        return self._find_longest_prefix_key(tuple(key)) is not None
+
+    def __setitem__(self, key: Sequence[int], state: Any) -> None:
+        key = tuple(key)
+        for cached_key in list(self.cache.iterkeys()):
+            if len(cached_key) < len(key) and key[:len(cached_key)] == cached_key:
+                self.cache.delete(cached_key)
+        self.cache.set(key, state)
+
+
+def _answer_digest(answer: str) -> str:
+    return hashlib.sha1(answer.encode("utf-8")).hexdigest()
+
+
+class OllamaContextCache:
+    """
+    Bounded LRU of Ollama context token arrays by conversation
+
+    The context returned with an answer encodes the whole exchange so far. It is only reused when
+    the latest message of the conversation is still that answer, so an edited, deleted or
+    cancelled answer falls back to sending the history.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[str, Tuple[str, List[int]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id: str, previous_answer: str) -> Optional[List[int]]:
+        with self._lock:
+            item = self._items.get(conversation_id)
+            if item is None or item[0] != _answer_digest(previous_answer):
+                return None
+            self._items.move_to_end(conversation_id)
+            return item[1]
+
+    def put(self, conversation_id: str, answer: str, context: List[int]) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[conversation_id] = (_answer_digest(answer), context)
+            self._items.move_to_end(conversation_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, conversation_id: str) -> None:
+        with self._lock:
+            self._items.pop(conversation_id, None)
+
+
+ollama_context_cache = OllamaContextCache(max_size=settings.ollama_context_cache_size)
@@ -0,0 +1,341 @@
+import json
+import logging
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.simple import SimpleVectorStoreData
+from llama_index.core.vector_stores.types import (
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult
+)
+
+logger = logging.getLogger(__name__)
+
+# file written by StorageContext.persist for the default vector store namespace
+SIMPLE_VECTOR_STORE_FNAME = "default__vector_store.json"
+QUANTIZED_META_FNAME = "vector_store.quantized.json"
+
+# rows scored per block in the approximate pass, bounds the float32 scratch buffer
+_SCORE_BLOCK_ROWS = 8192
+
+# vector_store.f32.<version>.npy and vector_store.<precision>.<version>.npz, older builds had no version
+_SIDECAR_PATTERN = re.compile(r"^vector_store\.(f32|float16|int8)(\.\w+)?\.np[yz]$")
+
+
+def _sidecar_version(source_mtime: float) -> str:
+    return f"{int(source_mtime * 1e6):x}"
+
+
+def _full_vectors_fname(version: str) -> str:
+    return f"vector_store.f32.{version}.npy"
+
+
+def _quantized_codes_fname(precision: str, version: str) -> str:
+    return f"vector_store.{precision}.{version}.npz"
+
+
+class QuantizedVectorStore(SimpleVectorStore):
+    """SimpleVectorStore keeping float16 or int8 vectors in RAM.
+
+    The float32 vectors stay on disk as a memory-mapped ``.npy`` file. A query
+    scores every vector with the compact codes, then rescores the best
+    ``top_k * rescore_factor`` candidates exactly against the float32 rows.
+
+    Only the default query mode without filters takes the compact path, any
+    other query falls back to the exact SimpleVectorStore implementation.
+
+    The sidecar files are named after the mtime of the JSON store they were
+    built from, so rebuilding them never rewrites a file another loaded store
+    still maps. ``get``, ``add``, ``delete`` and fallback queries restore the
+    float32 dict; it is released again by the next ``persist`` to a local
+    directory, which rebuilds the sidecar from the new JSON store.
+    """
+
+    _precision: str = PrivateAttr(default="float16")
+    _rescore_factor: int = PrivateAttr(default=4)
+    _ids: List[str] = PrivateAttr(default_factory=list)
+    _codes: Any = PrivateAttr(default=None)
+    _scales: Any = PrivateAttr(default=None)
+    _full: Any = PrivateAttr(default=None)
+    _materialized: bool = PrivateAttr(default=False)
+
+    @classmethod
+    def from_persist_dir(
+            cls,
+            persist_dir: str,
+            precision: str = "float16",
+            rescore_factor: int = 4,
+            **kwargs: Any
+    ) -> "QuantizedVectorStore":
+        """Load the compact vectors of a persisted index, building them on first use
+
+        Args:
+            persist_dir: index directory written by StorageContext.persist
+            precision: float16 or int8
+            rescore_factor: candidates rescored exactly per requested result
+        Returns:
+            QuantizedVectorStore
+        """
+        if precision not in ("float16", "int8"):
+            raise ValueError(f"Unsupported vector precision: {precision}")
+
+        meta = cls._current_sidecar(persist_dir, precision)
+        if meta is None or precision not in meta.get("recall", {}):
+            meta = cls._build_sidecar(persist_dir, precision, meta)
+
+        store = cls(
+            data=SimpleVectorStoreData(
+                text_id_to_ref_doc_id=meta["text_id_to_ref_doc_id"],
+                metadata_dict=meta["metadata_dict"]
+            )
+        )
+        store._precision = precision
+        store._rescore_factor = max(1, rescore_factor)
+        store._load_sidecar(persist_dir, meta)
+
+        stats = store.memory_stats()
+        logger.info(
+            f"Loaded {precision} vectors from {persist_dir}: {stats['vectors']} x {stats['dim']}, "
+            f"{stats['full_bytes'] / 1048576:.1f}MB -> {stats['compact_bytes'] / 1048576:.1f}MB resident "
+            f"({stats['ratio']:.1f}x), sampled recall@10 {meta['recall'][precision]:.3f}"
+        )
+        return store
+
+    @staticmethod
+    def _current_sidecar(persist_dir: str, precision: str) -> Optional[Dict]:
+        """Sidecar metadata when it was built from the JSON store now on disk, None otherwise"""
+        meta_path = os.path.join(persist_dir, QUANTIZED_META_FNAME)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        source_mtime = os.path.getmtime(os.path.join(persist_dir, SIMPLE_VECTOR_STORE_FNAME))
+        version = meta.get("version")
+        if meta.get("source_mtime") != source_mtime or version != _sidecar_version(source_mtime):
+            return None
+        if not os.path.exists(os.path.join(persist_dir, _full_vectors_fname(version))):
+            return None
+        if not os.path.exists(os.path.join(persist_dir, _quantized_codes_fname(precision, version))):
+            meta.get("recall", {}).pop(precision, None)
+        return meta
+
+    def _load_sidecar(self, persist_dir: str, meta: Dict) -> None:
+        """Point the store at the compact codes and the mapped float32 matrix of a sidecar"""
+        version = meta["version"]
+        with np.load(os.path.join(persist_dir, _quantized_codes_fname(self._precision, version))) as codes:
+            self._codes = codes["codes"]
+            self._scales = codes["scales"] if self._precision == "int8" else None
+        self._ids = meta["ids"]
+        self._full = np.load(os.path.join(persist_dir, _full_vectors_fname(version)), mmap_mode="r")
+        self.data.embedding_dict = {}
+        self._materialized = False
+
+    @classmethod
+    def _build_sidecar(
+            cls,
+            persist_dir: str,
+            precision: str,
+            meta: Optional[Dict] = None
+    ) -> Dict:
+        """Write the float32 matrix, compact codes and metadata next to the JSON vector store"""
+        source_path = os.path.join(persist_dir, SIMPLE_VECTOR_STORE_FNAME)
+        source_mtime = os.path.getmtime(source_path)
+        version = _sidecar_version(source_mtime)
+        simple_store = SimpleVectorStore.from_persist_path(source_path)
+        data = simple_store.data
+
+        ids = list(data.embedding_dict.keys())
+        if ids:
+            full = np.asarray([data.embedding_dict[i] for i in ids], dtype=np.float32)
+        else:
+            full = np.zeros((0, 0), dtype=np.float32)
+        # another precision of the same version may be mapping this file, it holds the same rows
+        full_path = os.path.join(persist_dir, _full_vectors_fname(version))
+        if not os.path.exists(full_path):
+            cls._write_replace(full_path, lambda f: np.save(f, full))
+
+        codes, scales = cls._quantize(full, precision)
+        cls._write_replace(
+            os.path.join(persist_dir, _quantized_codes_fname(precision, version)),
+            lambda f: np.savez(f, codes=codes, scales=scales)
+        )
+
+        recall = {} if meta is None or meta.get("version") != version else meta.get("recall", {})
+        recall[precision] = cls._sample_recall(full, codes, scales)
+
+        meta = {
+            "source_mtime": source_mtime,
+            "version": version,
+            "ids": ids,
+            "text_id_to_ref_doc_id": data.text_id_to_ref_doc_id,
+            "metadata_dict": data.metadata_dict,
+            "recall": recall
+        }
+        cls._write_replace(
+            os.path.join(persist_dir, QUANTIZED_META_FNAME),
+            lambda f: f.write(json.dumps(meta).encode("utf-8"))
+        )
+        cls._remove_stale_sidecars(persist_dir, version)
+
+        return meta
+
+    @staticmethod
+    def _write_replace(path: str, write: Callable[[Any], Any]) -> None:
+        """Write to a temp file and rename it over the target, readers never see a partial file"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _remove_stale_sidecars(persist_dir: str, version: str) -> None:
+        """Best effort, a file still mapped by a store in use cannot be removed on Windows"""
+        for fname in os.listdir(persist_dir):
+            match = _SIDECAR_PATTERN.match(fname)
+            if match is None or match.group(2) == f".{version}":
+                continue
+            try:
+                os.remove(os.path.join(persist_dir, fname))
+            except OSError as e:
+                logger.debug(f"Stale vector sidecar {fname} left in place: {e}")
+
+    @staticmethod
+    def _quantize(full: np.ndarray, precision: str):
+        """Quantize unit-normalized rows, int8 uses one symmetric scale per row"""
+        norms = np.linalg.norm(full, axis=1, keepdims=True) if full.size else np.ones((0, 1), dtype=np.float32)
+        unit = full / np.maximum(norms, 1e-12)
+        if precision == "float16":
+            return unit.astype(np.float16), np.ones(len(unit), dtype=np.float32)
+
+        scales = np.abs(unit).max(axis=1) / 127.0 if unit.size else np.zeros(0, dtype=np.float32)
+        scales = np.maximum(scales, 1e-12).astype(np.float32)
+        codes = np.clip(np.rint(unit / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales
+
+    @staticmethod
+    def _approx_scores(codes: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray) -> np.ndarray:
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _SCORE_BLOCK_ROWS):
+            block = codes[start:start + _SCORE_BLOCK_ROWS].astype(np.float32)
+            scores[start:start + _SCORE_BLOCK_ROWS] = block @ query
+        if scales is not None:
+            scores *= scales
+        return scores
+
+    @staticmethod
+    def _exact_scores(rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.float32)
+        norms = np.linalg.norm(rows, axis=1) * max(float(np.linalg.norm(query)), 1e-12)
+        return (rows @ query) / np.maximum(norms, 1e-12)
+
+    @classmethod
+    def _sample_recall(
+            cls,
+            full: np.ndarray,
+            codes: np.ndarray,
+            scales: np.ndarray,
+            sample_size: int = 32,
+            top_k: int = 10
+    ) -> float:
+        """Recall@k of the compact first pass alone, using stored vectors as queries"""
+        if len(full) <= top_k:
+            return 1.0
+        rng = np.random.default_rng(0)
+        sample = rng.choice(len(full), size=min(sample_size, len(full)), replace=False)
+        int8_scales = scales if codes.dtype == np.int8 else None
+        hits = 0
+        for row in sample:
+            query = full[row] / max(float(np.linalg.norm(full[row])), 1e-12)
+            exact = np.argpartition(-cls._exact_scores(full, query), top_k)[:top_k]
+            approx = np.argpartition(-cls._approx_scores(codes, int8_scales, query), top_k)[:top_k]
+            hits += len(np.intersect1d(exact, approx))
+        return hits / (len(sample) * top_k)
+
+    def memory_stats(self) -> Dict[str, Any]:
+        """Resident size of the compact vectors against the float32 equivalent"""
+        vectors = len(self._ids)
+        dim = int(self._full.shape[1]) if self._full is not None and self._full.ndim == 2 else 0
+        full_bytes = vectors * dim * 4
+        compact_bytes = 0
+        if self._codes is not None:
+            compact_bytes = self._codes.nbytes + (self._scales.nbytes if self._scales is not None else 0)
+        return {
+            "precision": self._precision,
+            "vectors": vectors,
+            "dim": dim,
+            "full_bytes": full_bytes,
+            "compact_bytes": compact_bytes,
+            "ratio": full_bytes / compact_bytes if compact_bytes else 1.0
+        }
+
+    def _materialize(self) -> None:
+        """Restore the float32 embedding dict so the SimpleVectorStore code paths work"""
+        if self._materialized:
+            return
+        for i, node_id in enumerate(self._ids):
+            self.data.embedding_dict[node_id] = self._full[i].tolist()
+        self._materialized = True
+
+    def get(self, text_id: str) -> List[float]:
+        self._materialize()
+        return super().get(text_id)
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        self._materialize()
+        return super().add(nodes, **add_kwargs)
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self._materialize()
+        super().delete(ref_doc_id, **delete_kwargs)
+
+    def persist(self, persist_path: str = None, fs: Any = None) -> None:
+        """Write the JSON store, then rebuild the sidecar from it and release the float32 dict again"""
+        self._materialize()
+        if persist_path is None:
+            super().persist(fs=fs)
+            return
+        super().persist(persist_path, fs=fs)
+        if fs is not None or os.path.basename(persist_path) != SIMPLE_VECTOR_STORE_FNAME:
+            return
+        persist_dir = os.path.dirname(persist_path)
+        meta = self._build_sidecar(persist_dir, self._precision)
+        self._load_sidecar(persist_dir, meta)
+
+    def query(
+            self,
+            query: VectorStoreQuery,
+            **kwargs: Any
+    ) -> VectorStoreQueryResult:
+        if self._materialized \
+                or query.mode != VectorStoreQueryMode.DEFAULT \
+                or query.filters is not None \
+                or query.node_ids \
+                or query.doc_ids:
+            self._materialize()
+            return super().query(query, **kwargs)
+
+        if not self._ids or query.query_embedding is None:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        query_vec = np.asarray(query.query_embedding, dtype=np.float32)
+        query_unit = query_vec / max(float(np.linalg.norm(query_vec)), 1e-12)
+        top_k = min(query.similarity_top_k, len(self._ids))
+
+        approx = self._approx_scores(self._codes, self._scales, query_unit)
+        n_candidates = min(len(self._ids), top_k * self._rescore_factor)
+        candidates = np.argpartition(-approx, n_candidates - 1)[:n_candidates]
+        candidates.sort()
+
+        exact = self._exact_scores(self._full[candidates], query_vec)
+        order = np.argsort(-exact)[:top_k]
+
+        return VectorStoreQueryResult(
+            similarities=[float(exact[i]) for i in order],
+            ids=[self._ids[candidates[i]] for i in order]
+        )
@@ -0,0 +1,96 @@
+import re
+from typing import List
+
+_TOKEN_PATTERN = re.compile(r"[~/]?\w[\w\-./:\\]*", re.UNICODE)
+
+# sentence punctuation glued to a word, "love." or "path:", is not part of it
+_EDGE_PUNCTUATION = ".,:;-"
+
+# "love.Please" where a sentence ends without a space before the next one
+_SENTENCE_JOIN = re.compile(r"\.(?=[A-Z][a-z])")
+
+_SNAKE_CASE = re.compile(r"^\w+_\w+$", re.UNICODE)
+_DOTTED_NAME = re.compile(r"^\w+(\.\w+)+$", re.UNICODE)
+_PATH = re.compile(r"^(~?/|[A-Za-z]:\\|\w+://)|[/\\].*[/\\.]", re.UNICODE)
+
+_STOPWORDS = frozenset("""
+a an and are as at be been but by can could did do does for from had has have how i if in into is it its
+me my of on or please should so tell than that the their them then there these they this to was we
+were what when where which who whom why will with would you your about explain describe give show
+""".split())
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase and collapse whitespace so trivially different questions share cache keys"""
+    return " ".join(query.lower().split())
+
+
+def tokenize(query: str) -> List[str]:
+    """Words of the query, with surrounding punctuation and run-on sentence joins removed"""
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(query):
+        token = token.strip(_EDGE_PUNCTUATION)
+        parts = [token] if is_identifier(token) else _SENTENCE_JOIN.split(token)
+        tokens.extend(part.strip(_EDGE_PUNCTUATION) for part in parts)
+    return [token for token in tokens if token]
+
+
+def _keywords(tokens: List[str]) -> List[str]:
+    return [t for t in tokens if t.lower() not in _STOPWORDS]
+
+
+def _is_dotted_name(token: str) -> bool:
+    # os.path.join, config.yaml, java.util.List, but not "love.Please" from a missing space
+    if not _DOTTED_NAME.match(token):
+        return False
+    parts = token.split(".")
+    return len(parts) > 2 or token == token.lower()
+
+
+def is_identifier(token: str) -> bool:
+    """Error codes, versions, snake_case and dotted names, paths and ALLCAPS acronyms"""
+    return (
+            any(c.isdigit() for c in token)
+            or bool(_SNAKE_CASE.match(token))
+            or _is_dotted_name(token)
+            or bool(_PATH.search(token))
+            or (token.isupper() and len(token) > 1)
+    )
+
+
+def _identifiers(tokens: List[str]) -> List[str]:
+    return [t for t in tokens if is_identifier(t)]
+
+
+def is_keyword_query(query: str, max_keywords: int = 6) -> bool:
+    """Short queries carrying an id, error code, version or path, best answered by the sparse index"""
+    tokens = tokenize(query)
+    return 0 < len(_keywords(tokens)) <= max_keywords and len(_identifiers(tokens)) > 0
+
+
+def expand_query(query: str, num_queries: int) -> List[str]:
+    """
+    Cheap local query expansion without the LLM
+    Args:
+        query: original user query
+        num_queries: maximum number of extra queries
+    Returns: keyword and identifier variants of the query, never the original itself
+    """
+    tokens = tokenize(query)
+    variants = []
+
+    keywords = _keywords(tokens)
+    if keywords:
+        variants.append(" ".join(keywords))
+
+    # error codes, ids, versions and paths are matched far better on their own
+    identifiers = _identifiers(tokens)
+    if identifiers:
+        variants.append(" ".join(identifiers))
+
+    normalized = normalize_query(query)
+    expanded = []
+    for variant in variants:
+        if normalize_query(variant) != normalized and variant not in expanded:
+            expanded.append(variant)
+    return expanded[:num_queries]
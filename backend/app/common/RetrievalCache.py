@@ -0,0 +1,158 @@
+import gc
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.storage.docstore.types import BaseDocumentStore
+
+from app.common.QueryExpansion import normalize_query
+from app.setting import settings
+
+logger = logging.getLogger(__name__)
+
+
+class _LRU:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def evict(self, predicate: Callable[[Hashable], bool]) -> int:
+        with self._lock:
+            stale = [key for key in self._items if predicate(key)]
+            for key in stale:
+                del self._items[key]
+            return len(stale)
+
+
+class RetrievalResultCache(_LRU):
+    """
+    Bounded LRU of retrieval results, (normalized query, retriever namespace, index version) -> [(node id, score)]
+
+    Only ids and scores are kept, nodes are resolved from the docstore of the loaded index on a hit.
+    A reindex changes the version so stale results are never returned and age out of the LRU.
+    """
+
+
+class LoadedIndexCache(_LRU):
+    """
+    Bounded LRU of indexes loaded from disk, keyed by (index dir, variant) and checked against the index version
+    """
+
+    def get_or_load(self, key: Hashable, version: float, loader: Callable[[], Any]) -> Any:
+        cached = self.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        value = loader()
+        self.put(key, (version, value))
+        return value
+
+
+class KeyedLocks:
+    """
+    One lock per key, e.g. per index directory, so building or persisting the same index never overlaps
+    """
+
+    def __init__(self):
+        self._locks: Dict[Hashable, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def lock(self, key: Hashable) -> threading.Lock:
+        with self._guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+
+retrieval_cache = RetrievalResultCache(max_size=settings.retrieval_cache_size)
+loaded_index_cache = LoadedIndexCache(max_size=settings.index_cache_size)
+index_build_locks = KeyedLocks()
+
+
+def release_index_dir(index_dir: str) -> None:
+    """
+    Drop the loaded indexes and cached results of an index directory before it is deleted or persisted again,
+    so the cache holds no memory-mapped vector file of it
+    Args:
+        index_dir: vector dir of a file or note, its basename is the source id
+    """
+    index_dir = os.path.normpath(index_dir)
+    source_id = os.path.basename(index_dir)
+    loaded_index_cache.evict(lambda key: os.path.normpath(key[0]) == index_dir)
+    retrieval_cache.evict(lambda key: key[1].split(":", 1)[0] == source_id)
+    # the mapping is closed once the last reference to the store goes, cycles included
+    gc.collect()
+
+
+class CachedRetriever(BaseRetriever):
+    """
+    Retriever consulting the retrieval result cache before the wrapped retriever touches the vector or BM25 store
+    """
+
+    def __init__(
+            self,
+            retriever: BaseRetriever,
+            docstore: BaseDocumentStore,
+            namespace: str,
+            version: float,
+            cache: Optional[RetrievalResultCache] = None
+    ):
+        self._retriever = retriever
+        self._docstore = docstore
+        self._namespace = namespace
+        self._version = version
+        self._cache = cache or retrieval_cache
+        super().__init__()
+
+    def _key(self, query_bundle: QueryBundle) -> Tuple[str, str, float]:
+        return normalize_query(query_bundle.query_str), self._namespace, self._version
+
+    def _from_cache(self, key: Tuple[str, str, float]) -> Optional[List[NodeWithScore]]:
+        hit = self._cache.get(key)
+        if hit is None:
+            return None
+        nodes = []
+        for node_id, score in hit:
+            node = self._docstore.get_node(node_id, raise_error=False)
+            if node is None:
+                return None
+            nodes.append(NodeWithScore(node=node, score=score))
+        logger.debug(f"Retrieval cache hit for {self._namespace}")
+        return nodes
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        key = self._key(query_bundle)
+        nodes = self._from_cache(key)
+        if nodes is None:
+            nodes = self._retriever.retrieve(query_bundle)
+            self._cache.put(key, [(n.node.node_id, n.score) for n in nodes])
+        return nodes
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        key = self._key(query_bundle)
+        nodes = self._from_cache(key)
+        if nodes is None:
+            nodes = await self._retriever.aretrieve(query_bundle)
+            self._cache.put(key, [(n.node.node_id, n.score) for n in nodes])
+        return nodes
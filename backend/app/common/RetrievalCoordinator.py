@@ -0,0 +1,193 @@
+import asyncio
+import contextvars
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from app.setting import settings
+
+logger = logging.getLogger(__name__)
+
+# shared by every conversation, retrieval is CPU bound (embedding, vector scan, BM25) and releases the GIL in numpy/torch
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=settings.retrieval_max_workers,
+    thread_name_prefix="klee-retrieval"
+)
+
+# (result key, source id, retriever, query)
+RetrievalTask = Tuple[Hashable, str, Any, QueryBundle]
+
+
+@dataclass
+class RetrievalReport:
+    """
+    Outcome of one fan-out: results that arrived before the deadline and the sources that did not
+    """
+    results: Dict[Hashable, List[NodeWithScore]] = field(default_factory=dict)
+    timed_out: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+    elapsed: float = 0.0
+
+
+class _FanOut:
+    """
+    Progress of one fan-out: at most `max_concurrency` tasks on the pool, the rest waiting their turn
+
+    A running task has `deadline` seconds from the moment a worker picks it up, so time spent queued
+    behind other requests is not held against its source. Tasks that have not started within
+    `deadline` of the fan-out start are cancelled and never take a worker.
+    """
+
+    def __init__(self, coordinator: "RetrievalCoordinator", tasks: List[RetrievalTask]):
+        self.coordinator = coordinator
+        self.tasks = tasks
+        self.started = time.perf_counter()
+        self.report = RetrievalReport()
+        self._pending = list(range(len(tasks)))
+        self._in_flight: Dict[int, Any] = {}
+        # task index -> when a worker started it, written by the worker thread
+        self._run_started: Dict[int, float] = {}
+
+    def _run(self, index: int, retriever: Any, query: QueryBundle) -> List[NodeWithScore]:
+        self._run_started[index] = time.perf_counter()
+        return retriever.retrieve(query)
+
+    def _submit(self, index: int):
+        _, _, retriever, query = self.tasks[index]
+        # callbacks and instrumentation keep their span stack in context variables
+        ctx = contextvars.copy_context()
+        return self.coordinator.executor.submit(ctx.run, self._run, index, retriever, query)
+
+    def _task_deadline(self, index: int) -> float:
+        run_started = self._run_started.get(index)
+        return (run_started if run_started is not None else self.started) + self.coordinator.deadline
+
+    def _timed_out(self, index: int) -> None:
+        source_id = self.tasks[index][1]
+        if source_id not in self.report.timed_out:
+            self.report.timed_out.append(source_id)
+
+    def _collect(self, index: int, future: Any) -> None:
+        key, source_id, _, _ = self.tasks[index]
+        exc = future.exception()
+        if exc is not None:
+            logger.error(f"Retrieval from source {source_id} failed: {exc}")
+            if source_id not in self.report.failed:
+                self.report.failed.append(source_id)
+            return
+        self.report.results[key] = future.result()
+
+    def advance(self) -> None:
+        """Collect finished tasks, give up on late ones and start waiting ones in their place"""
+        now = time.perf_counter()
+        for index, future in list(self._in_flight.items()):
+            if future.done():
+                del self._in_flight[index]
+                if not future.cancelled():
+                    self._collect(index, future)
+            elif index not in self._run_started and now >= self.started + self.coordinator.deadline:
+                # still queued behind other requests: cancelled before it takes a worker,
+                # unless it is being picked up right now and gets its own deadline
+                if future.cancel():
+                    del self._in_flight[index]
+                    self._timed_out(index)
+                else:
+                    self._run_started.setdefault(index, now)
+            elif index in self._run_started and now >= self._task_deadline(index):
+                # a running retrieval cannot be interrupted, it finishes in the background and is dropped
+                del self._in_flight[index]
+                self._timed_out(index)
+
+        while self._pending and len(self._in_flight) < self.coordinator.max_concurrency:
+            index = self._pending.pop(0)
+            if now >= self.started + self.coordinator.deadline:
+                self._timed_out(index)
+                continue
+            self._in_flight[index] = self._submit(index)
+
+    def finished(self) -> bool:
+        return not self._pending and not self._in_flight
+
+    def in_flight(self) -> List[Any]:
+        return list(self._in_flight.values())
+
+    def timeout(self) -> float:
+        """Seconds until the next task reaches its deadline"""
+        now = time.perf_counter()
+        return max(0.0, min(self._task_deadline(index) - now for index in self._in_flight))
+
+    def cancel(self) -> None:
+        """Drop the tasks that have not started yet"""
+        for future in self._in_flight.values():
+            future.cancel()
+        self._pending.clear()
+
+    def finish(self) -> RetrievalReport:
+        self.report.elapsed = time.perf_counter() - self.started
+        if self.report.timed_out:
+            logger.warning(
+                f"Retrieval deadline of {self.coordinator.deadline}s exceeded by sources {self.report.timed_out}, "
+                f"continuing with {len(self.report.results)}/{len(self.tasks)} results"
+            )
+        return self.report
+
+
+class RetrievalCoordinator:
+    """
+    Query all sources concurrently on the retrieval thread pool and keep what arrives within the deadline
+
+    Each source gets `deadline` seconds once a worker runs it, and at most `max_concurrency` tasks of a
+    fan-out share the pool with other conversations. Sources that miss the deadline keep running in the
+    background and their results are dropped, sources still queued when it passes are cancelled.
+    """
+
+    def __init__(
+            self,
+            deadline: Optional[float] = None,
+            executor: Optional[ThreadPoolExecutor] = None,
+            max_concurrency: Optional[int] = None
+    ):
+        self.deadline = deadline if deadline is not None else settings.retrieval_source_deadline
+        self.executor = executor or retrieval_executor
+        self.max_concurrency = max(1, max_concurrency or settings.retrieval_request_max_concurrency)
+
+    def run(self, tasks: List[RetrievalTask]) -> RetrievalReport:
+        """
+        Fan out from synchronous code
+        Args:
+            tasks: (result key, source id, retriever, query) tuples
+        Returns: RetrievalReport
+        """
+        fan_out = _FanOut(self, tasks)
+        fan_out.advance()
+        while not fan_out.finished():
+            wait(fan_out.in_flight(), timeout=fan_out.timeout(), return_when=FIRST_COMPLETED)
+            fan_out.advance()
+        return fan_out.finish()
+
+    async def arun(self, tasks: List[RetrievalTask]) -> RetrievalReport:
+        """
+        Fan out from the event loop without blocking it
+        Args:
+            tasks: (result key, source id, retriever, query) tuples
+        Returns: RetrievalReport
+        """
+        fan_out = _FanOut(self, tasks)
+        fan_out.advance()
+        try:
+            while not fan_out.finished():
+                await asyncio.wait(
+                    [asyncio.wrap_future(f) for f in fan_out.in_flight()],
+                    timeout=fan_out.timeout(),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                fan_out.advance()
+        except asyncio.CancelledError:
+            # the client went away, drop the sources that have not started yet
+            fan_out.cancel()
+            raise
+        return fan_out.finish()
@@ -0,0 +1,52 @@
+import json
+from typing import Any, Dict, Optional
+
+from starlette.requests import Request
+
+from app.setting import settings
+
+# request header a client sends to opt into a newer streaming protocol
+STREAM_VERSION_HEADER = "X-Klee-Stream-Version"
+
+STREAM_VERSION_FULL = 1
+STREAM_VERSION_DELTA = 2
+
+
+def negotiate_stream_version(request: Optional[Request]) -> int:
+    """Streaming protocol requested by the client, the full message protocol when the header is absent"""
+    if not isinstance(request, Request):
+        return STREAM_VERSION_FULL
+    version = request.headers.get(STREAM_VERSION_HEADER, "")
+    return STREAM_VERSION_DELTA if version.strip() == str(STREAM_VERSION_DELTA) else STREAM_VERSION_FULL
+
+
+class PendingEventEncoder:
+    """
+    Encode the pending SSE events of a streamed assistant message
+
+    version 1: every pending event carries the whole message, as existing clients expect
+    version 2: pending events carry {id, offset, delta}, the offset counting the Unicode code points already
+               sent; every `snapshot_interval` events a `snapshot` event with the whole message is sent instead
+               so a client can resync
+    """
+
+    def __init__(self, version: int = STREAM_VERSION_FULL, snapshot_interval: Optional[int] = None):
+        self.version = version
+        self.snapshot_interval = max(1, snapshot_interval or settings.stream_snapshot_interval)
+        self._events = 0
+
+    def encode(self, message: Dict[str, Any], delta: str) -> str:
+        """
+        Encode one pending event
+        Args:
+            message: assistant message whose content already ends with delta
+            delta: text appended since the previous event
+        Returns: SSE event text
+        """
+        self._events += 1
+        if self.version == STREAM_VERSION_FULL:
+            return f"event: pending\ndata: {json.dumps(message)}\n\n"
+        if self._events % self.snapshot_interval == 0:
+            return f"event: snapshot\ndata: {json.dumps(message)}\n\n"
+        payload = {"id": message["id"], "offset": len(message["content"]) - len(delta), "delta": delta}
+        return f"event: pending\ndata: {json.dumps(payload)}\n\n"
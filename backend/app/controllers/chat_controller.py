@@ -1,3 +1,5 @@
+from typing import Optional
+
 from fastapi import APIRouter, Depends, Header, Request
 
 from langchain_community.chat_message_histories import ChatMessageHistory
@@ -96,9 +98,15 @@ class ChatController:
 
     async def llama_get_conversation_message(
             self,
-            conversation_id: str = None
+            conversation_id: str = None,
+            limit: Optional[int] = None,
+            cursor: Optional[str] = None
     ):
-        return await self.chat_service.llama_get_conversation_message(conversation_id=conversation_id)
+        return await self.chat_service.llama_get_conversation_message(
+            conversation_id=conversation_id,
+            limit=limit,
+            cursor=cursor
+        )
 
     async def get_conversation_detail(
             self,
@@ -186,9 +194,15 @@ async def update_conversation(
 @router.get("/conversations/{conversation_id}")
 async def llama_get_conversation_message(
         conversation_id: str = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
         conversation_controller: ChatController = Depends(ChatController)
 ):
-    return await conversation_controller.llama_get_conversation_message(conversation_id=conversation_id)
+    return await conversation_controller.llama_get_conversation_message(
+        conversation_id=conversation_id,
+        limit=limit,
+        cursor=cursor
+    )
 
 
 @router.get('/conversations')
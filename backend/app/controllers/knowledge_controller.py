@@ -5,9 +5,9 @@ from typing import Optional
 from fastapi import APIRouter, Depends
 
 from app.model.Response import ResponseContent
-from app.model.knowledge import KnowledgeCreate, KnowledgeResponse
+from app.model.knowledge import KnowledgeCreate, KnowledgeResponse, KnowledgeUpdate
 from app.services.llama_index_service import LlamaIndexService
-from app.model.LlamaRequest import LlamaFileList, LLamaFileImportRequest
+from app.model.LlamaRequest import LlamaFileList, LLamaFileImportRequest, KnowledgeSearchRequest
 
 from app.services.knowledge_service import KnowledgeService
 
@@ -38,7 +38,7 @@ class KnowledgeController:
     async def update_knowledge(
             self,
             knowledge_id: str,
-            knowledge: KnowledgeCreate
+            knowledge: KnowledgeUpdate
     ) -> KnowledgeResponse:
         return await self.knowledge_service.update_knowledge(knowledge_id, knowledge)
 
@@ -68,6 +68,12 @@ class KnowledgeController:
     ):
         return await self.knowledge_service.delete_file(file_id)
 
+    async def search(
+            self,
+            search_request: KnowledgeSearchRequest
+    ):
+        return await self.knowledge_service.search(search_request)
+
 @router.get('/')
 async def get_all_knowledge(
     keyword: Optional[str] = None,
@@ -96,6 +102,15 @@ async def get_all_files(
 ):
     return await service.get_all_files(knowledge_id)
 
+# 检索知识库和笔记, 不调用LLM
+@router.post('/search')
+async def search(
+        search_request: KnowledgeSearchRequest,
+        controller: KnowledgeController = Depends(KnowledgeController),
+):
+    return await controller.search(search_request)
+
+
 # 创建Knowledge知识库
 @router.post('/')
 async def create_knowledge(
@@ -125,7 +140,7 @@ async def write_file(
 @router.put('/{knowledge_id}', response_model=KnowledgeResponse)
 async def update_knowledge(
         knowledge_id: str,
-        knowledge: KnowledgeCreate,
+        knowledge: KnowledgeUpdate,
         controller: KnowledgeController = Depends(KnowledgeController),
 ) -> KnowledgeResponse:
     return await controller.update_knowledge(knowledge_id, knowledge)
@@ -4,6 +4,8 @@ from pydantic import BaseModel
 from typing import Optional, List
 from dataclasses import dataclass
 
+from app.common.LlamaEnum import RetrievalMode
+
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
@@ -71,6 +73,14 @@ class LlamaConversationRequest(BaseModel):
     language_id: Optional[str] = None
     system_prompt: Optional[str] = None
     language: Optional[str] = None
+    retrieval_mode: Optional[RetrievalMode] = None
+
+
+class KnowledgeSearchRequest(BaseModel):
+    query: str
+    knowledge_ids: List[str] = []
+    note_ids: List[str] = []
+    top_k: int = 10
 
 
 class LLamaFileRequest(BaseModel):
@@ -1,7 +1,7 @@
 import uuid
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, String, Float, Double, Boolean
+from sqlalchemy import Column, String, Float, Double, Boolean, Index
 from dataclasses import dataclass
 # from sqlalchemy.orm import declarative_base
 
@@ -11,6 +11,10 @@ Base = declarative_base()
 @dataclass
 class ChatMessage(Base):
     __tablename__ = 'llama_chat_message'
+    # message history pages are read newest first within a conversation
+    __table_args__ = (
+        Index('ix_llama_chat_message_conversation_time', 'conversation_id', 'create_time'),
+    )
     id: str = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()), index=True)
     role: str = Column(String, default="", nullable=False)
     content: str = Column(String, default="", nullable=False)
@@ -44,6 +48,7 @@ class Conversation(Base):
     language_id: str = Column(String, default="", nullable=False)
     system_prompt: str = Column(String, default="", nullable=False)
     model_path: str = Column(String, default="", nullable=False)
+    retrieval_mode: str = Column(String, default="expand", nullable=False)
     # 新加入
     create_at = Column(Double)
     delete_at = Column(Double)
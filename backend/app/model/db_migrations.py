@@ -0,0 +1,66 @@
+from dataclasses import dataclass, field
+from typing import List, Tuple, Union
+
+
+@dataclass(frozen=True)
+class AddColumn:
+    """Add a column to a table unless it already has it"""
+    table: str
+    column: str
+    definition: str
+
+
+@dataclass(frozen=True)
+class FtsIndex:
+    """FTS5 index over text columns of a table, kept in sync by triggers and backfilled once"""
+    table: str
+    columns: Tuple[str, ...]
+
+    @property
+    def name(self) -> str:
+        return f"{self.table}_fts"
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    steps: List[Union[str, AddColumn, FtsIndex]] = field(default_factory=list)
+
+
+# Applied in order after CREATE_TABLE_STATEMENTS, PRAGMA user_version holds the last applied version.
+# Steps must be idempotent, and released migrations are never edited: append a new one instead.
+MIGRATIONS: List[Migration] = [
+    Migration(
+        version=1,
+        description="columns added to existing databases before schema versioning",
+        steps=[
+            AddColumn("note", "local_mode", "INTEGER DEFAULT 1"),
+            AddColumn("knowledge", "local_mode", "INTEGER DEFAULT 1"),
+            AddColumn("knowledge", "vector_precision", "TEXT NOT NULL DEFAULT 'float32'"),
+            AddColumn("llama_chat_conversation", "retrieval_mode", "TEXT NOT NULL DEFAULT 'expand'"),
+        ]
+    ),
+    Migration(
+        version=2,
+        description="indexes of the hot query paths",
+        steps=[
+            "CREATE INDEX IF NOT EXISTS ix_llama_chat_message_conversation_time "
+            "ON llama_chat_message (conversation_id, create_time)",
+            "CREATE INDEX IF NOT EXISTS ix_llama_chat_conversation_create_time "
+            "ON llama_chat_conversation (create_time)",
+            "CREATE INDEX IF NOT EXISTS ix_file_knowledge_id ON file (knowledgeId)",
+            "CREATE INDEX IF NOT EXISTS ix_note_local_mode ON note (local_mode)",
+            "CREATE INDEX IF NOT EXISTS ix_knowledge_parent_local ON knowledge (parent_id, local_mode)",
+        ]
+    ),
+    Migration(
+        version=3,
+        description="full-text indexes of notes, conversation titles and messages",
+        steps=[
+            FtsIndex("note", ("title", "content")),
+            FtsIndex("llama_chat_conversation", ("title",)),
+            FtsIndex("llama_chat_message", ("content",)),
+        ]
+    ),
+]
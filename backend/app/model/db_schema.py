@@ -57,6 +57,7 @@ CREATE_TABLE_STATEMENTS = [
         system_prompt TEXT DEFAULT '',
         model_path TEXT DEFAULT '',
         model_name TEXT DEFAULT '',
+        retrieval_mode TEXT NOT NULL DEFAULT 'expand',
         create_at REAL,
         update_at REAL,
         delete_at REAL
@@ -90,7 +91,8 @@ CREATE_TABLE_STATEMENTS = [
         create_at REAL,
         update_at REAL,
         delete_at REAL,
-        local_mode INTEGER NOT NULL DEFAULT 1
+        local_mode INTEGER NOT NULL DEFAULT 1,
+        vector_precision TEXT NOT NULL DEFAULT 'float32'
     )
     """,
     """
@@ -4,6 +4,8 @@ from datetime import datetime
 from enum import Enum
 import hashlib
 import uuid
+from typing import Optional
+
 from sqlalchemy import Column, String, Integer, Double, Boolean
 from sqlalchemy import Enum as SQLAlchemyEnum
 
@@ -27,6 +29,15 @@ class EmbedStatus(Enum):
     EMBEDDED = "EMBEDDED"
 
 
+class VectorPrecision(Enum):
+    """
+    precision of the vectors kept in memory for a knowledge base
+    """
+    FLOAT32 = "float32"
+    FLOAT16 = "float16"
+    INT8 = "int8"
+
+
 class FilePathType(Enum):
     """
     文件路径类型
@@ -64,6 +75,9 @@ class Knowledge(Base):
     )  # embedding|embedded
     parent_id: str = Column(String, default="", nullable=True)
     local_mode: bool = Column(Boolean, default="", nullable=True)
+    vector_precision: str = Column(
+        String, default=VectorPrecision.FLOAT32.value, nullable=False
+    )  # float32|float16|int8
 
 @dataclass
 class File(Base):
@@ -115,6 +129,12 @@ class KnowledgeCreate(BaseModel):
     category: KnowledgeCat = KnowledgeCat.FILE
     isPin: bool = False
     folder_path: str = ""
+    vector_precision: VectorPrecision = VectorPrecision.FLOAT32
+
+
+class KnowledgeUpdate(KnowledgeCreate):
+    # None keeps the stored precision, the embedded vectors are encoded with it
+    vector_precision: Optional[VectorPrecision] = None
 
 
 class KnowledgeEmbedding(BaseModel):
@@ -132,6 +152,7 @@ class KnowledgeResponse(BaseModel):
     isPin: bool
     folder_path: str
     embed_status: EmbedStatus
+    vector_precision: VectorPrecision = VectorPrecision.FLOAT32
     create_at: float
     update_at: float
 
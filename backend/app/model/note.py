@@ -2,6 +2,7 @@ from sqlalchemy import Column, String, Boolean, Enum
 from sqlalchemy.types import Double
 from sqlalchemy.ext.declarative import declarative_base
 from enum import Enum as PyEnum
+from typing import Optional
 from pydantic import BaseModel
 from sqlalchemy import create_engine
 
@@ -85,3 +86,5 @@ class NoteResponse(BaseModel):
     delete_at: float
     html_content: str
     local_mode: bool
+    # matching text with the hits in <mark>, set by keyword search
+    snippet: Optional[str] = None
@@ -1,8 +1,8 @@
 from typing import Dict, Any
+import asyncio
 import datetime
 import json
 import logging
-import os
 import uuid
 from enum import Enum
 
@@ -12,12 +12,15 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from llama_index.core.settings import Settings
 
 from app.common.LlamaEnum import SystemTypeDiffModelType
+from app.common.LlmCache import llm_cache
+from app.common.LlmScheduler import llm_scheduler
+from app.common.OllamaResidency import ollama_residency
 from app.model.LlamaRequest import LlamaBaseSetting, LlamaConversationRequest
 from app.model.Response import ResponseContent
 from app.model.base_config import BaseConfig
 from app.model.chat_message import Conversation
 from app.model.global_settings import GlobalSettings
-from app.model.knowledge import File
+from app.model.knowledge import File, Knowledge
 from app.services.client_sqlite_service import db_transaction
 from app.services.llama_index_service import LlamaIndexService
 from app.model.klee_settings import Settings as KleeSettings
@@ -29,6 +32,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# running warm-ups by conversation id, also keeps the tasks referenced until they finish
+_warm_up_tasks: Dict[str, asyncio.Task] = {}
+
 class ErrorCode(Enum):
     SUCCESS = 0
     GENERAL_ERROR = -1
@@ -131,6 +137,8 @@ class BaseService:
             
             base_request.id = base_config.id
             session.add(base_config)
+            # clients built with the previous key or base url are stale
+            llm_cache.evict_provider(provider_id)
 
             return self._create_response(
                 ErrorCode.SUCCESS,
@@ -162,6 +170,7 @@ class BaseService:
 
             delete_stmt = delete(BaseConfig).where(BaseConfig.id == provider_id)
             await session.execute(delete_stmt)
+            llm_cache.evict_provider(provider_id)
 
             return self._create_response(
                 ErrorCode.SUCCESS,
@@ -219,11 +228,6 @@ class BaseService:
             result = await session.execute(stmt)
             conversation = result.scalars().first()
 
-            if conversation.model_id != llama_request.model_id:
-                self.llama_index_service.release_memory()
-            elif llama_request.model_path != conversation.model_path:
-                self.llama_index_service.release_memory()
-
             KleeSettings.local_mode = llama_request.local_mode
 
             conversation.knowledge_ids = json.dumps(llama_request.knowledge_ids, ensure_ascii=False)
@@ -236,6 +240,8 @@ class BaseService:
             conversation.system_prompt = llama_request.system_prompt
             conversation.model_name = llama_request.model_name
             conversation.model_path = llama_request.model_path
+            if llama_request.retrieval_mode is not None:
+                conversation.retrieval_mode = llama_request.retrieval_mode.value
             provider_id = llama_request.provider_id
             model_id = llama_request.model_id
             model_path = llama_request.model_path
@@ -245,14 +251,7 @@ class BaseService:
             result_global = await session.execute(stmt_global)
             global_settings = result_global.scalars().first()
 
-            if conversation.provider_id == SystemTypeDiffModelType.OLLAMA.value and conversation.model_id != global_settings.model_id:
-                if global_settings.provider_id == SystemTypeDiffModelType.OLLAMA.value:
-                    try:
-                        os.system(f"ollama stop {global_settings.model_id}")
-                    except Exception as e:
-                        logging.error(f"ollama stop {global_settings.model_id} failed, {str(e)}")
-                        pass
-
+            # the previous Ollama model stays resident, the residency manager unloads it under memory pressure
             if global_settings is not None:
                 if global_settings.provider_id != provider_id \
                         or global_settings.model_id != model_id \
@@ -270,11 +269,9 @@ class BaseService:
                     KleeSettings.model_path = model_path
                     KleeSettings.model_name = model_name
 
+                    # the next question picks the new model from the LLM cache, the old one stays cached
                     KleeSettings.un_load = True
-
-                    with self.llama_index_service.release_memory():
-                        Settings.llm = None
-                        self.llama_index_service.release_memory()
+                    Settings.llm = None
 
             session.add(conversation)
             await session.flush()
@@ -290,6 +287,23 @@ class BaseService:
                     if len(files) > 0:
                         file_infos[knowledge_id] = files
 
+            vector_precisions = {}
+            if len(file_infos) > 0:
+                stmt = select(Knowledge.id, Knowledge.vector_precision).where(Knowledge.id.in_(list(file_infos.keys())))
+                result = await session.execute(stmt)
+                vector_precisions = {row.id: row.vector_precision for row in result}
+
+            self._schedule_warm_up(
+                conversation.id,
+                note_ids=json.loads(conversation.note_ids),
+                file_infos=file_infos,
+                vector_precisions=vector_precisions,
+                provider_id=provider_id,
+                model_name=model_id,
+                local_mode=llama_request.local_mode is True,
+                model_path=model_path
+            )
+
             response_data = {
                 "id": conversation.id,
                 "knowledge_ids": conversation.knowledge_ids,
@@ -301,12 +315,47 @@ class BaseService:
                 "model_name": conversation.model_name,
                 "language_id": conversation.language_id,
                 "system_prompt": conversation.system_prompt,
-                "model_path": conversation.model_path
+                "model_path": conversation.model_path,
+                "retrieval_mode": conversation.retrieval_mode
             }
             return ResponseContent(error_code=0, message="Update successful", data=response_data)
         except Exception as e:
             logger.error(f"update_conversation_setting error: {e}")
             return ResponseContent(error_code=-1, message=f"Update failed: {str(e)}", data={})
 
+    def _schedule_warm_up(
+            self,
+            conversation_id: str,
+            **kwargs
+    ):
+        """
+        Start warming up a conversation in the background, cancelling its previous warm-up
+        Args:
+            conversation_id: ID of the conversation
+            kwargs: arguments of LlamaIndexService.warm_up
+        """
+        previous = _warm_up_tasks.pop(conversation_id, None)
+        if previous is not None and not previous.done():
+            previous.cancel()
+            logger.info(f"Cancelled outdated warm-up of conversation {conversation_id}")
+
+        async def run():
+            try:
+                await self.llama_index_service.warm_up(**kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Warm-up of conversation {conversation_id} failed: {str(e)}")
+
+        task = asyncio.create_task(run())
+        _warm_up_tasks[conversation_id] = task
+        task.add_done_callback(
+            lambda t: _warm_up_tasks.pop(conversation_id, None) if _warm_up_tasks.get(conversation_id) is t else None
+        )
+
     async def get_status(self):
-        return ResponseContent(error_code=0, message="Service is running", data={})
+        return ResponseContent(error_code=0, message="Service is running", data={
+            "llm_scheduler": llm_scheduler.stats(),
+            "ollama_residency": ollama_residency.stats(),
+            "llm_cache": llm_cache.stats()
+        })
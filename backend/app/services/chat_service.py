@@ -1,35 +1,47 @@
+import asyncio
 import json
-import os
 import uuid
 import re
 from dataclasses import asdict
 from datetime import datetime
+from typing import Dict, List, Optional
 
-import httpx
-import nest_asyncio
+import anyio
 import requests
 import logging
 
 from fastapi import Header, HTTPException
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, literal_column
 from starlette.requests import Request
 from starlette.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 
-from app.common.LlamaEnum import SystemTypeDiffModelType
+from app.common.LlamaEnum import SystemTypeDiffModelType, RetrievalMode, LlmPriority
 from app.model.Chat import ChatConversation
 from app.model.LlamaRequest import LlamaConversationRequest, LLamaChatRequest
 from app.model.Response import ResponseContent
 from app.model.base_config import BaseConfig
-from app.model.knowledge import File
+from app.model.knowledge import File, Knowledge
 from app.model.note import Note
 from app.services.client_sqlite_service import db_transaction
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.services.llama_index_service import LlamaIndexService
-from app.services.client_sqlite_service import async_session
-from app.model.klee_settings import Settings as KleeSettings
+from app.services.llama_index_service import LlamaIndexService, ModelLoadError
+from app.services.client_sqlite_service import async_session, fetch_message_page
 from app.model.chat_message import ChatMessage as Llama_chat_message, Conversation as Llama_conversation, ChatMessage
 from llama_index.core.base.llms.types import ChatMessage as LlmChatMessage, MessageRole
+from llama_index.core.base.response.schema import StreamingResponse as LlamaStreamingResponse
+from llama_index.core.llms import LLM, MockLLM
+from llama_index.core.schema import QueryBundle
+from llama_index.core.settings import Settings as llamaSettings
+from app.common.AnswerCache import AnswerCacheKey, answer_cache, context_digest
+from app.common.FullTextSearch import full_text_match
+from app.common.ClientDisconnect import ClientDisconnected, DisconnectWatch, cancel_on_disconnect, close_stream
+from app.common.HttpClients import SUPABASE, get_async_client
+from app.common.LlmScheduler import llm_scheduler
+from app.common.OllamaResidency import ollama_residency
+from app.common.StreamEncoder import PendingEventEncoder, negotiate_stream_version, STREAM_VERSION_FULL
+from app.setting import settings
 
 
 logging.basicConfig(level=logging.INFO,
@@ -37,6 +49,18 @@ logging.basicConfig(level=logging.INFO,
 logger = logging.getLogger(__name__)
 
 
+# characters of each message of the first exchange used to title a conversation
+_TITLE_CONTEXT_CHARS = 500
+
+# running title jobs by conversation id, also keeps the tasks referenced until they finish
+_title_tasks: Dict[str, asyncio.Task] = {}
+
+
+def _rag_query(question: str, instructions: str) -> QueryBundle:
+    """Prompt of a retrieval answer, the indexes only see the question without the instructions"""
+    return QueryBundle(query_str=question + instructions, custom_embedding_strs=[question])
+
+
 class ChatService:
     def __init__(self):
         self.llama_index_service = LlamaIndexService()
@@ -50,14 +74,14 @@ class ChatService:
             session=None
     ):
         """
-        Create or update conversation title
+        Schedule title generation for a conversation, the title is stored and returned by the next fetch
         Args:
             conversation_id: ID of the conversation
             Authorization: Authorization header
             request: Request object
             session: Database session
         Returns:
-            ResponseContent: Response containing conversation data
+            ResponseContent: Response containing the conversation as it is now
         """
         try:
             stmt = select(Llama_conversation).where(
@@ -68,111 +92,105 @@ class ChatService:
             if conversation is None:
                 return ResponseContent(error_code=-1, message=f"Conversation not found: {conversation_id}", data={})
 
-            msg_stmt = select(Llama_chat_message).order_by(Llama_chat_message.create_time.asc()).limit(2).where(
-                Llama_chat_message.conversation_id == conversation_id)
-            results = await session.execute(msg_stmt)
-            msg_list = results.scalars().all()
-
-            if not msg_list:
-                return ResponseContent(error_code=-1, message=f"Not enough messages in conversation: {conversation_id}")
-
-            msg_content = ""
-            for msg in msg_list:
-                if msg.role == "user":
-                    msg_content += f"Question:{msg.content}"
-                else:
-                    msg_content += f"Answer:{msg.content}"
+            environment = None
+            if isinstance(request, Request):
+                environment = request.headers.get("environment")
 
-            language = ""
-            if conversation.language_id == "zh":
-                language = "Generate title in Chinese"
-            elif conversation.language_id == "en":
-                language = "Generate title in English"
-            elif conversation.language_id == "auto":
-                language = ""
-
-            question = """
-            Generate a short and descriptive title in {language} for the following content, only in string:
-            {msg_content}
-            """.format(msg_content=msg_content, language=language)
-
-            if conversation.local_mode is True:
-                nest_asyncio.apply()
-                if conversation.provider_id == SystemTypeDiffModelType.OLLAMA.value:
-                    query_engine = await self.llama_index_service.combine_query(
-                        note_ids=json.loads(conversation.note_ids),
-                        file_infos={},
-                        streaming=False
-                    )
-                    response = query_engine.query(question)
+            running = _title_tasks.get(conversation_id)
+            if running is None or running.done():
+                task = asyncio.create_task(self._generate_title(conversation_id, Authorization, environment))
+                _title_tasks[conversation_id] = task
+                task.add_done_callback(lambda t: _title_tasks.pop(conversation_id, None) if _title_tasks.get(conversation_id) is t else None)
 
-                    conversation.title = re.sub(
-                        r'<think>.*?</think>', '', response.response, flags=re.DOTALL)
+            return ResponseContent(error_code=0, message="Title generation scheduled", data=conversation)
+        except Exception as e:
+            logger.error(f"create_conversation_title error:{str(e)}")
+            return ResponseContent(error_code=-1, message=f"Failed to generate title: {str(e)}", data={})
 
-                    session.add(conversation)
+    async def _generate_title(
+            self,
+            conversation_id: str,
+            Authorization: str = None,
+            environment: str = None
+    ):
+        """
+        Background job: title the conversation from its first exchange, without retrieval
+        Args:
+            conversation_id: ID of the conversation
+            Authorization: Authorization header for the cloud title service
+            environment: Environment header forwarded to the cloud title service
+        """
+        try:
+            async with async_session() as session:
+                stmt = select(Llama_conversation).where(
+                    Llama_conversation.id == conversation_id)
+                results = await session.execute(stmt)
+                conversation = results.scalars().one_or_none()
+                if conversation is None:
+                    return
+
+                msg_stmt = select(Llama_chat_message).order_by(
+                    Llama_chat_message.create_time.asc(),
+                    literal_column(f"{Llama_chat_message.__tablename__}.rowid").asc()
+                ).limit(2).where(Llama_chat_message.conversation_id == conversation_id)
+                results = await session.execute(msg_stmt)
+                msg_list = results.scalars().all()
+                if not msg_list:
+                    return
+
+                # the first exchange is enough for a title, long answers only slow the prompt down
+                msg_content = ""
+                for msg in msg_list:
+                    if msg.role == "user":
+                        msg_content += f"Question:{msg.content[:_TITLE_CONTEXT_CHARS]}\n"
+                    else:
+                        msg_content += f"Answer:{msg.content[:_TITLE_CONTEXT_CHARS]}\n"
 
-                    return ResponseContent(error_code=0, message="Generate title successfully", data=conversation)
-                else:
-                    query_engine = await self.llama_index_service.combine_query(
-                        note_ids=[],
-                        file_infos={},
-                        streaming=False
-                    )
-                    response = query_engine.query(question + language)
-                    conversation.title = response.response.replace(
-                        "\\n", "").strip()
-                    session.add(conversation)
-                    return ResponseContent(error_code=0, message="Generate title successfully", data=conversation)
-            else:
-                if conversation.provider_id == SystemTypeDiffModelType.OPENAI.value \
-                        or conversation.provider_id == SystemTypeDiffModelType.CLAUDE.value:
+                language = ""
+                if conversation.language_id == "zh":
+                    language = " in Chinese"
+                elif conversation.language_id == "en":
+                    language = " in English"
+
+                question = (
+                    f"Write a short title{language}, at most eight words, for the following conversation. "
+                    f"Reply with the title only.\n{msg_content}"
+                )
+
+                cloud_relay = conversation.local_mode is not True and conversation.provider_id in (
+                    SystemTypeDiffModelType.OPENAI.value,
+                    SystemTypeDiffModelType.CLAUDE.value
+                )
+                if cloud_relay:
                     url = f"https://xltwffswqvowersvchkj.supabase.co/functions/v1/chatService-generateConversationTitle"
                     headers = {
                         "Content-Type": "application/json",
                         "Authorization": f"Bearer {Authorization}"
                     }
-
-                    for key, value in request.headers.items():
-                        if key == "environment":
-                            headers["Environment"] = value
-                            break
-
-                    os.environ["IS_TESTING"] = "True"
-
-                    del os.environ["IS_TESTING"]
-                    messages_list = [{
-                        "role": "user",
-                        "content": question
-                    }]
-                    model_name = ""
+                    if environment is not None:
+                        headers["Environment"] = environment
 
                     request_data = {
                         "provider": str(conversation.provider_id).upper(),
-                        "messages": messages_list,
-                        "model": model_name
+                        "messages": [{"role": "user", "content": question}],
+                        "model": ""
                     }
-
-                    with requests.post(url, headers=headers, json=request_data, stream=False) as response:
-                        response.raise_for_status()  # 如果响应状态不是200，将引发异常
-                        conversation.title = response.text
-                        session.add(conversation)
-
-                    return ResponseContent(error_code=0, message="Generate title successfully", data=conversation)
+                    response = await get_async_client(SUPABASE).post(url, headers=headers, json=request_data)
+                    response.raise_for_status()
+                    title = response.text
                 else:
-                    query_engine = await self.llama_index_service.combine_query(
-                        note_ids=json.loads(conversation.note_ids),
-                        file_infos={},
-                        streaming=False
-                    )
-                    response = query_engine.query(question)
-                    conversation.title = response.response
-                    session.add(conversation)
-
-                    return ResponseContent(error_code=0, message="Generate title successfully", data=conversation)
-
+                    llm = await self._conversation_llm(conversation, session) or llamaSettings.llm
+                    async with llm_scheduler.slot(llm, LlmPriority.BACKGROUND):
+                        completion = await llm.acomplete(question)
+                    title = completion.text
+
+                title = re.sub(r'<think>.*?</think>', '', title, flags=re.DOTALL)
+                conversation.title = title.replace("\\n", "").strip().strip('"').strip()
+                session.add(conversation)
+                await session.commit()
+                logger.info(f"Generated title for conversation {conversation_id}")
         except Exception as e:
-            logger.error(f"create_conversation_title error:{str(e)}")
-            return ResponseContent(error_code=-1, message=f"Failed to generate title: {str(e)}", data={})
+            logger.error(f"Title generation for conversation {conversation_id} failed: {str(e)}")
 
     @db_transaction
     async def create_conversation(
@@ -196,7 +214,8 @@ class ChatService:
                 language_id=llama_request.language_id,
                 model_path=llama_request.model_path,
                 model_name=llama_request.model_name,
-                model_id=llama_request.model_id
+                model_id=llama_request.model_id,
+                retrieval_mode=(llama_request.retrieval_mode or RetrievalMode.EXPAND).value
             )
 
             if chat_conversation.provider_id == SystemTypeDiffModelType.OLLAMA.value \
@@ -222,6 +241,7 @@ class ChatService:
                 "system_prompt": chat_conversation.model_path,
                 "model_path": chat_conversation.model_path,
                 "model_name": chat_conversation.model_name,
+                "retrieval_mode": chat_conversation.retrieval_mode,
                 "create_at": chat_conversation.create_at,
                 "update_at": chat_conversation.update_at
             }
@@ -342,8 +362,22 @@ class ChatService:
     async def llama_get_conversation_message(
             self,
             conversation_id: str = None,
+            limit: Optional[int] = None,
+            cursor: Optional[str] = None,
             session=None
     ):
+        """
+        Conversation settings and its messages, in chronological order
+        With a limit or cursor only one page is read: the newest messages older than the cursor,
+        found through the (conversation_id, create_time) index.
+        Args:
+            conversation_id: ID of the conversation
+            limit: page size, every message is returned when neither limit nor cursor is given
+            cursor: next_cursor of the previous page, for older messages
+            session: Database session
+        Returns:
+            ResponseContent with the conversation, the messages and next_cursor, None on the oldest page
+        """
         try:
             stmt = select(Llama_conversation).where(
                 Llama_conversation.id == conversation_id)
@@ -353,13 +387,24 @@ class ChatService:
             if conversation is None:
                 return ResponseContent(error_code=-1, message="conversation not found", data={})
 
-            if conversation.provider_id == SystemTypeDiffModelType.OLLAMA.value:
-                os.system(f"ollama stop {conversation.model_id}")
+            # opening the conversation loads its model, scrolling back through older pages does not
+            if cursor is None and conversation.provider_id == SystemTypeDiffModelType.OLLAMA.value:
+                ollama_residency.ensure_resident_in_background(conversation.model_id)
 
-            stmt = select(Llama_chat_message).where(
-                Llama_chat_message.conversation_id == conversation_id)
-            result_messages = await session.execute(stmt)
-            message_list = result_messages.scalars().all()
+            next_cursor = None
+            if limit is None and cursor is None:
+                # messages written together share create_time, the rowid keeps their insertion order
+                rowid = literal_column(f"{Llama_chat_message.__tablename__}.rowid")
+                stmt = select(Llama_chat_message).where(
+                    Llama_chat_message.conversation_id == conversation_id
+                ).order_by(Llama_chat_message.create_time, rowid)
+                message_list = (await session.execute(stmt)).scalars().all()
+            else:
+                page_size = min(max(1, limit or settings.message_page_size), settings.message_page_max_size)
+                try:
+                    message_list, next_cursor = await fetch_message_page(session, conversation_id, page_size, cursor)
+                except ValueError:
+                    return ResponseContent(error_code=-1, message="invalid cursor", data={})
 
             conversation_info = {
                 "id": conversation.id,
@@ -374,6 +419,7 @@ class ChatService:
                 "language_id": conversation.language_id,
                 "system_prompt": conversation.system_prompt,
                 "model_path": conversation.model_path,
+                "retrieval_mode": conversation.retrieval_mode,
                 "create_at": conversation.create_at,
                 "update_at": conversation.update_at
             }
@@ -394,12 +440,72 @@ class ChatService:
                     for message in message_list
                 ]
             return ResponseContent(error_code=0, message="",
-                                   data={"conversation": conversation_info, "messages": message_infos})
+                                   data={"conversation": conversation_info, "messages": message_infos,
+                                         "next_cursor": next_cursor})
 
         except Exception as e:
             logger.error(f"get_conversation_message error:{str(e)}")
             raise Exception("Get conversation message failed")
 
+    @staticmethod
+    async def _search_conversations(session, keyword: str) -> Optional[Dict[str, str]]:
+        """
+        Conversations whose title or messages match the keyword, through the full-text indexes
+        Title hits come first, then conversations ranked by their best matching message, at most
+        settings.search_result_limit conversations in all.
+        Args:
+            session: database session
+            keyword: search keyword
+        Returns: conversation id -> snippet in rank order, None when the indexes cannot serve the keyword
+        """
+        title_match = await full_text_match(session, Llama_conversation.__tablename__, keyword)
+        message_match = await full_text_match(session, Llama_chat_message.__tablename__, keyword)
+        if title_match is None or message_match is None:
+            return None
+
+        limit = settings.search_result_limit
+        conversation_rowid = literal_column(f"{Llama_conversation.__tablename__}.rowid")
+        result = await session.execute(
+            select(Llama_conversation.id, title_match.snippet)
+            .join(title_match.table, title_match.table.c.rowid == conversation_rowid)
+            .filter(title_match.condition)
+            .order_by(title_match.rank)
+            .limit(limit)
+        )
+        snippets: Dict[str, str] = {conversation_id: snippet for conversation_id, snippet in result}
+        if len(snippets) >= limit:
+            return snippets
+
+        # the limit counts conversations, not messages, so one long conversation cannot fill it
+        message_rowid = literal_column(f"{Llama_chat_message.__tablename__}.rowid")
+        stmt = (
+            select(Llama_chat_message.conversation_id)
+            .join(message_match.table, message_match.table.c.rowid == message_rowid)
+            .filter(message_match.condition)
+            .group_by(Llama_chat_message.conversation_id)
+            .order_by(message_match.best_rank)
+            .limit(limit - len(snippets))
+        )
+        if snippets:
+            stmt = stmt.filter(Llama_chat_message.conversation_id.notin_(list(snippets)))
+        result = await session.execute(stmt)
+        ranked = [conversation_id for conversation_id, in result]
+        if not ranked:
+            return snippets
+
+        result = await session.execute(
+            select(Llama_chat_message.conversation_id, message_match.snippet)
+            .join(message_match.table, message_match.table.c.rowid == message_rowid)
+            .filter(message_match.condition, Llama_chat_message.conversation_id.in_(ranked))
+            .order_by(message_match.rank)
+        )
+        best_snippets: Dict[str, str] = {}
+        for conversation_id, snippet in result:
+            best_snippets.setdefault(conversation_id, snippet)
+        for conversation_id in ranked:
+            snippets[conversation_id] = best_snippets.get(conversation_id, "")
+        return snippets
+
     @db_transaction
     async def get_all_chat_conversations(
             self,
@@ -407,14 +513,23 @@ class ChatService:
             keyword: str = None
     ):
         try:
-            stmt = select(Llama_conversation).filter(Llama_conversation.title.like(f"%{keyword}%")).order_by(
-                Llama_conversation.create_time.desc())
+            snippets = await self._search_conversations(session, keyword) if keyword else None
+            stmt = select(Llama_conversation)
+            if snippets is not None:
+                stmt = stmt.filter(Llama_conversation.id.in_(list(snippets)))
+            elif keyword:
+                stmt = stmt.filter(Llama_conversation.title.like(f"%{keyword}%"))
+            stmt = stmt.order_by(Llama_conversation.create_time.desc())
             result = await session.execute(stmt)
             conversations = result.scalars().all()
 
             if len(conversations) < 0:
                 return ResponseContent(error_code=0, message="Get all conversations successfully", data=[])
 
+            if snippets is not None:
+                rank = {conversation_id: position for position, conversation_id in enumerate(snippets)}
+                conversations = sorted(conversations, key=lambda cv: rank[cv.id])
+
             conversations_list = [
                 {
                     "id": cv.id,
@@ -424,7 +539,8 @@ class ChatService:
                     "update_at": cv.update_at,
                     "is_pin": cv.is_pin,
                     "knowledge_ids": json.loads(cv.knowledge_ids),
-                    "note_ids": json.loads(cv.note_ids)
+                    "note_ids": json.loads(cv.note_ids),
+                    **({"snippet": snippets[cv.id]} if snippets is not None else {})
                 }
                 for cv in conversations
             ]
@@ -452,7 +568,7 @@ class ChatService:
                     return ResponseContent(error_code=1, message="Conversation not found", data=None)
 
                 if conversation.provider_id == SystemTypeDiffModelType.OLLAMA.value:
-                    os.system(f"ollama stop {conversation.model_id}")
+                    ollama_residency.ensure_resident_in_background(conversation.model_id)
 
                 # 构造返回的数据结构
                 conversation_detail = {
@@ -510,6 +626,59 @@ class ChatService:
             logger.error(f"Get all conversation messages failed: {str(e)}")
             return ResponseContent(error_code=1, message=f"Get all conversation messages failed: {str(e)}", data=None)
 
+    async def _conversation_llm(
+            self,
+            conversation: Llama_conversation,
+            session
+    ) -> Optional[LLM]:
+        """
+        LLM client of a conversation's model, taken from the LLM cache
+        Credentials of custom providers are handed to the client, nothing is written to the environment.
+        Args:
+            conversation: the conversation
+            session: Database session, custom provider settings are read from it
+        Returns: LLM, None for the cloud relay and models without a client
+        """
+        provider_id = conversation.provider_id
+        model_name = conversation.model_id
+        api_type = None
+        api_base_url = None
+        api_key = None
+        if conversation.local_mode is True:
+            model_name = self.llama_index_service.local_model_name(provider_id, model_name, conversation.model_path)
+        elif provider_id not in [SystemTypeDiffModelType.OPENAI.value, SystemTypeDiffModelType.CLAUDE.value]:
+            stmt = select(BaseConfig).where(BaseConfig.id == provider_id)
+            result = await session.execute(stmt)
+            config_data = result.scalars().one_or_none()
+            if config_data is None:
+                return None
+            model_name = conversation.model_name
+            api_key = config_data.apiKey
+            if not str(model_name).find("claude") == -1:
+                api_type = SystemTypeDiffModelType.CLAUDE.value
+            elif not str(model_name).find("gpt") == -1:
+                api_type = SystemTypeDiffModelType.OPENAI.value
+            elif not str(model_name).find("deepseek") == -1:
+                api_type = SystemTypeDiffModelType.DEEPSEEK.value
+                if config_data.baseUrl and config_data.baseUrl.find("luchentech") != -1:
+                    api_base_url = "https://cloud.luchentech.com/api/maas"
+
+        if not model_name:
+            return None
+        try:
+            return await run_in_threadpool(
+                self.llama_index_service.resolve_llm,
+                provider_id=provider_id,
+                model_name=model_name,
+                local_mode=conversation.local_mode is True,
+                api_type=api_type,
+                api_base_url=api_base_url,
+                api_key=api_key
+            )
+        except Exception as e:
+            logger.error(f"Failed to load LLM {provider_id} - {model_name}: {str(e)}")
+            raise ModelLoadError(f"Failed to load model {model_name}: {str(e)}")
+
     @db_transaction
     async def rot_chat(
             self,
@@ -524,57 +693,20 @@ class ChatService:
             result = await session.execute(stmt)
             a_conversation = result.scalar_one_or_none()
 
+            # a question and its answer share create_time, the rowid keeps the question first
             stmt = select(Llama_chat_message).where(
                 Llama_chat_message.conversation_id == chat_request.conversation_id).order_by(
-                Llama_chat_message.create_time.desc()).limit(4)
+                Llama_chat_message.create_time.desc(),
+                literal_column(f"{Llama_chat_message.__tablename__}.rowid").desc()).limit(4)
             results = await session.execute(stmt)
 
-            provider_id = a_conversation.provider_id
-            model_id = a_conversation.model_id
-            model_path = a_conversation.model_path
-
-            # 释放内存
-            if KleeSettings.un_load is True:
-                # try_release()
-                self.llama_index_service.release_memory()
-
-                if a_conversation.provider_id is None or a_conversation.provider_id == "":
-                    return ResponseContent(error_code=-1, message="Please select a chatbot model", data={})
-
-                api_type = None
-                if KleeSettings.local_mode is True:
-                    if provider_id == SystemTypeDiffModelType.OLLAMA.value and model_id is not None and not model_id == "":
-                        await self.llama_index_service.load_llm(provider_id=provider_id, model_name=model_id)
-                    elif provider_id == SystemTypeDiffModelType.KLEE.value and model_id is not None and not model_id == "":
-                        model_path = f"{KleeSettings.llm_path}{str(model_id).lower()}.gguf"
-                        await self.llama_index_service.load_llm(provider_id=provider_id, model_name=model_path)
-                    elif provider_id == SystemTypeDiffModelType.LOCAL.value:
-                        await self.llama_index_service.load_llm(provider_id=provider_id, model_name=model_path)
-                else:
-                    api_base_url = None
-                    if not provider_id == SystemTypeDiffModelType.OPENAI.value and not provider_id == SystemTypeDiffModelType.CLAUDE.value:
-                        diy_stmt = select(BaseConfig).where(
-                            BaseConfig.id == provider_id)
-                        result = await session.execute(diy_stmt)
-                        config_data = result.scalars().one_or_none()
-                        if not str(a_conversation.model_name).find("claude") == -1:
-                            os.environ["ANTHROPIC_API_KEY"] = config_data.apiKey
-                            api_type = "anthropic"
-                            model_id = a_conversation.model_name
-                        elif not str(a_conversation.model_name).find("gpt") == -1:
-                            os.environ["OPENAI_API_KEY"] = config_data.apiKey
-                            api_type = "openai"
-                            model_id = a_conversation.model_name
-                        elif not str(a_conversation.model_name).find("deepseek") == -1:
-                            os.environ["DEEPSEEK_API_KEY"] = config_data.apiKey
-                            api_type = "deepseek"
-                            model_id = a_conversation.model_name
-
-                            if config_data.baseUrl.find("luchentech") != -1:
-                                api_base_url = "https://cloud.luchentech.com/api/maas"
-
-                    await self.llama_index_service.load_llm(provider_id=provider_id, model_name=model_id, api_type=api_type,
-                                                            api_base_url=api_base_url)
+            stream_version = negotiate_stream_version(request)
+
+            if a_conversation.provider_id is None or a_conversation.provider_id == "":
+                return ResponseContent(error_code=-1, message="Please select a chatbot model", data={})
+
+            # the conversation's own model, conversations on other models keep theirs and run side by side
+            llm = await self._conversation_llm(a_conversation, session)
 
             chat_messages = results.scalars().all()
 
@@ -600,6 +732,12 @@ class ChatService:
                         file_infos[knowledge_id] = files
                         knowledge_list.append(files)
 
+            vector_precisions = {}
+            if len(file_infos) > 0:
+                stmt = select(Knowledge.id, Knowledge.vector_precision).where(Knowledge.id.in_(list(file_infos.keys())))
+                result = await session.execute(stmt)
+                vector_precisions = {row.id: row.vector_precision for row in result}
+
             note_list = []
             # 这里加入查找note笔记的内容
             note_ids = json.loads(a_conversation.note_ids)
@@ -611,24 +749,91 @@ class ChatService:
                     if note is not None:
                         note_list.append(note)
 
-            nest_asyncio.apply()
+            answer_cache_key = None
+            source_ids = [file.id for files in file_infos.values() for file in files] + [note.id for note in note_list]
+            # only opening questions over sources are replayed, a follow-up such as "why?" depends on its history
+            if settings.answer_cache_enabled and source_ids and not chat_messages:
+                answer_cache_key = AnswerCacheKey(
+                    embedding=await run_in_threadpool(llamaSettings.embed_model.get_query_embedding, question),
+                    version=self.llama_index_service.source_set_version(source_ids),
+                    model_id=f"{a_conversation.provider_id}:{a_conversation.model_name or a_conversation.model_id}",
+                    language=a_conversation.language_id or "",
+                    source_ids=source_ids,
+                    context=context_digest(a_conversation.system_prompt)
+                )
+                cached_answer = answer_cache.lookup(answer_cache_key)
+                if cached_answer is not None:
+                    return StreamingResponse(
+                        self.generate_data(
+                            session=session,
+                            response=LlamaStreamingResponse(response_gen=iter([cached_answer.answer])),
+                            question=question,
+                            conversation_id=chat_request.conversation_id,
+                            sources=cached_answer.sources,
+                            stream_version=stream_version,
+                            request=request,
+                            llm_priority=None),
+                        media_type="text/event-stream"
+                    )
+
+            # plain chats skip retrieval and query fusion entirely, the cloud relay keeps its own protocol
+            cloud_relay = a_conversation.local_mode is not True and a_conversation.provider_id in (
+                SystemTypeDiffModelType.OPENAI.value,
+                SystemTypeDiffModelType.CLAUDE.value,
+                SystemTypeDiffModelType.DEEPSEEK.value
+            )
+            if len(file_infos) == 0 and len(note_list) == 0 and not cloud_relay:
+                chat_history = [
+                    LlmChatMessage(
+                        role=MessageRole.USER if item.role == "user" else MessageRole.ASSISTANT,
+                        content=item.content
+                    )
+                    for item in reversed(chat_messages)
+                    if item.content
+                ]
+                chat_history.append(LlmChatMessage(role=MessageRole.USER, content=question + language))
+                return StreamingResponse(
+                    self.generate_data(
+                        session=session,
+                        response=await self.llama_index_service.direct_chat(
+                            chat_history,
+                            llm=llm,
+                            conversation_id=a_conversation.id
+                        ),
+                        question=question,
+                        conversation_id=chat_request.conversation_id,
+                        answer_cache_key=answer_cache_key,
+                        stream_version=stream_version,
+                        request=request,
+                        llm=llm),
+                    media_type="text/event-stream"
+                )
 
             # 本地模式
             if a_conversation.local_mode is True:
                 if a_conversation.provider_id == SystemTypeDiffModelType.OLLAMA.value:
                     query_engine = await self.llama_index_service.combine_query(
                         note_ids=json.loads(a_conversation.note_ids),
-                        file_infos=file_infos
+                        file_infos=file_infos,
+                        vector_precisions=vector_precisions,
+                        retrieval_mode=a_conversation.retrieval_mode,
+                        conversation_id=a_conversation.id,
+                        llm=llm
                     )
 
-                    response = query_engine.query(question + language)
+                    response = await cancel_on_disconnect(request, query_engine.aquery(_rag_query(question, language)))
 
                     return StreamingResponse(
                         self.generate_data(
                             session=session,
                             response=response,
                             question=question,
-                            conversation_id=chat_request.conversation_id),
+                            conversation_id=chat_request.conversation_id,
+                            timed_out_sources=query_engine.retriever.last_report.timed_out,
+                            answer_cache_key=answer_cache_key,
+                            stream_version=stream_version,
+                            request=request,
+                            llm=llm),
                         media_type="text/event-stream"
                     )
                 else:
@@ -655,18 +860,27 @@ class ChatService:
 
                     query_engine = await self.llama_index_service.combine_query(
                         note_ids=json.loads(a_conversation.note_ids),
-                        file_infos=file_infos
+                        file_infos=file_infos,
+                        vector_precisions=vector_precisions,
+                        retrieval_mode=a_conversation.retrieval_mode,
+                        conversation_id=a_conversation.id,
+                        llm=llm
                     )
 
-                    real_question = question + language
+                    instructions = language
 
-                    real_question += """.If the answer is unrelated to the question, you can freely express yourself. \n"
+                    instructions += """.If the answer is unrelated to the question, you can freely express yourself. \n"
                                    f".Do not directly output the provided text content. \n"
                                    f".If no text is provided, please provide your own response and organize the answer. \n"""
 
-                    response = query_engine.query(real_question)
+                    response = await cancel_on_disconnect(request, query_engine.aquery(_rag_query(question, instructions)))
                     response_coroutine = self.generate_data(
-                        response=response, question=question, conversation_id=chat_request.conversation_id)
+                        response=response, question=question, conversation_id=chat_request.conversation_id,
+                        timed_out_sources=query_engine.retriever.last_report.timed_out,
+                        answer_cache_key=answer_cache_key,
+                        stream_version=stream_version,
+                        request=request,
+                        llm=llm)
                     return StreamingResponse(response_coroutine,
                                              media_type="text/event-stream")
             else:
@@ -684,19 +898,20 @@ class ChatService:
                             headers["Environment"] = value
                             break
 
-                    nest_asyncio.apply()
-                    os.environ["IS_TESTING"] = "True"
+                    # the relay answers, the engine only retrieves, so it gets a mock model
                     query_engine = await self.llama_index_service.combine_query(
                         note_ids=json.loads(a_conversation.note_ids),
-                        file_infos=file_infos
+                        file_infos=file_infos,
+                        vector_precisions=vector_precisions,
+                        retrieval_mode=a_conversation.retrieval_mode,
+                        conversation_id=a_conversation.id,
+                        llm=MockLLM()
                     )
 
                     content = await self.llama_index_service.get_retrieve_notes_content(question=question + language,
                                                                                         query_engine=query_engine)
                     context = content
 
-                    del os.environ["IS_TESTING"]
-
                     messages_list = []
                     for item in chat_messages:
                         role = None
@@ -728,16 +943,27 @@ class ChatService:
 
                     return StreamingResponse(
                         self.generate_data_2(url, headers, request_data, conversation_id=a_conversation.id,
-                                             question=question),
+                                             question=question, stream_version=stream_version, request=request),
                         media_type="text/event-stream")
                 else:
                     query_engine = await self.llama_index_service.combine_query(
                         note_ids=json.loads(a_conversation.note_ids),
-                        file_infos=file_infos
+                        file_infos=file_infos,
+                        vector_precisions=vector_precisions,
+                        retrieval_mode=a_conversation.retrieval_mode,
+                        conversation_id=a_conversation.id,
+                        llm=llm
                     )
-                    response = query_engine.query(question + language)
-                    return StreamingResponse(self.generate_data(response=response, question=question, conversation_id=chat_request.conversation_id),
+                    response = await cancel_on_disconnect(request, query_engine.aquery(_rag_query(question, language)))
+                    return StreamingResponse(self.generate_data(response=response, question=question, conversation_id=chat_request.conversation_id,
+                                                                timed_out_sources=query_engine.retriever.last_report.timed_out,
+                                                                answer_cache_key=answer_cache_key,
+                                                                stream_version=stream_version,
+                                                                request=request,
+                                                                llm=llm),
                                              media_type="text/event-stream")
+        except ClientDisconnected:
+            return ResponseContent(error_code=-1, message="Client disconnected", data={})
         except requests.RequestException as e:
             logger.error(f"Error: {e.response.status_code}- {e.response.text}")
 
@@ -746,7 +972,14 @@ class ChatService:
             session,
             response,
             question: str,
-            conversation_id: str = None
+            conversation_id: str = None,
+            timed_out_sources: List[str] = None,
+            answer_cache_key: AnswerCacheKey = None,
+            sources: Optional[List[Dict]] = None,
+            stream_version: int = STREAM_VERSION_FULL,
+            request: Request = None,
+            llm_priority: Optional[LlmPriority] = LlmPriority.INTERACTIVE,
+            llm: Optional[LLM] = None
     ):
         """
         Generate streaming response data for chat messages
@@ -756,10 +989,18 @@ class ChatService:
             response: Response from LLM
             question: User's question
             conversation_id: ID of the conversation
+            timed_out_sources: Sources left out of the answer because they missed the retrieval deadline
+            answer_cache_key: Key the completed answer is cached under, None when caching is off
+            sources: Source nodes of a replayed answer, taken from the response when None
+            stream_version: Streaming protocol negotiated with the client, see PendingEventEncoder
+            request: Incoming request, generation stops and the partial answer is kept when its client disconnects
+            llm_priority: Scheduling priority of the token stream, None when no LLM produces it
+            llm: Model producing the token stream, the global one when None
 
         Yields:
             Server-sent events containing chat message data
         """
+        response_gen = None
         try:
             message_id = str(uuid.uuid4())
             create_at = datetime.now().timestamp()
@@ -806,24 +1047,30 @@ class ChatService:
             yield "event: sending\n"
             yield f"data: {json.dumps({'userMessage': message_json_obj, 'botMessage': message_json_rob_obj, 'conversation_id': conversation_id})}\n\n"
 
+            pending_encoder = PendingEventEncoder(version=stream_version)
+
             # Process streaming response
             async def process_stream(stream):
                 async for item in stream:
                     rot_message.content += item
                     message_json_rob_obj['content'] += item
-                    yield "event: pending\n"
-                    yield f"data: {json.dumps(message_json_rob_obj)}\n\n"
-
-            # Handle both async and sync iterators
-            if hasattr(response.response_gen, '__aiter__'):
-                async for data in process_stream(response.response_gen):
-                    yield data
-            else:
-                for item in response.response_gen:
-                    rot_message.content += item
-                    message_json_rob_obj['content'] += item
-                    yield "event: pending\n"
-                    yield f"data: {json.dumps(message_json_rob_obj)}\n\n"
+                    yield pending_encoder.encode(message_json_rob_obj, item)
+
+            # Handle both async and sync iterators, sync ones are pulled on the thread pool so tokens never block the loop
+            response_gen = response.response_gen
+            if not hasattr(response_gen, '__aiter__'):
+                response_gen = iterate_in_threadpool(response_gen)
+            if llm_priority is not None:
+                response_gen = llm_scheduler.scheduled_stream(llm or llamaSettings.llm, llm_priority, response_gen)
+            disconnect_watch = DisconnectWatch(request)
+            async for data in process_stream(response_gen):
+                yield data
+                if await disconnect_watch.disconnected():
+                    # stop pulling tokens so the model is freed for other chats
+                    await close_stream(response_gen)
+                    await close_stream(response.response_gen)
+                    await self._save_cancelled_message(rot_message)
+                    return
 
             # Update message status on completion
             rot_message.status = "success"
@@ -836,11 +1083,38 @@ class ChatService:
                 db_rot_message.status = "success"
                 await new_session.commit()
 
+            if sources is None:
+                sources = [
+                    {"node_id": n.node.node_id, "score": n.score, "metadata": n.node.metadata}
+                    for n in getattr(response, "source_nodes", None) or []
+                ]
+
+            # answers missing sources are partial and must not be replayed
+            if answer_cache_key is not None and not timed_out_sources:
+                answer_cache.put(
+                    answer_cache_key,
+                    question=question,
+                    answer=rot_message.content,
+                    sources=sources
+                )
+
             # Send success event
             message_json_rob_obj['status'] = "success"
+            success_data = {'userMessage': message_json_obj, 'botMessage': message_json_rob_obj, 'conversation_id': conversation_id}
+            if sources:
+                success_data['sources'] = sources
+            if timed_out_sources:
+                success_data['timed_out_sources'] = timed_out_sources
             yield "event: success\n"
-            yield f"data: {json.dumps({'userMessage': message_json_obj, 'botMessage': message_json_rob_obj, 'conversation_id': conversation_id})}\n\n"
-
+            yield f"data: {json.dumps(success_data, default=str)}\n\n"
+
+        except (asyncio.CancelledError, GeneratorExit):
+            # the server cancelled the stream after a disconnect, the writes must not be cancelled with it
+            with anyio.CancelScope(shield=True):
+                await close_stream(response_gen)
+                await close_stream(response.response_gen)
+                await self._save_cancelled_message(rot_message)
+            raise
         except Exception as e:
             logger.error(f"Error generating chat response: {str(e)}")
             # Handle error case
@@ -865,15 +1139,39 @@ class ChatService:
             yield "event: error\n"
             yield f"data: {json.dumps({'userMessage': message_json_obj, 'botMessage': message_json_rob_obj, 'conversation_id': conversation_id})}\n\n"
 
+    async def _save_cancelled_message(
+            self,
+            rot_message: Llama_chat_message
+    ):
+        """
+        Persist the partial answer of a stream the client abandoned
+        Args:
+            rot_message: assistant message holding the content streamed so far
+        """
+        logger.info(f"Client disconnected, keeping {len(rot_message.content)} characters of message {rot_message.id}")
+        async with async_session() as cancel_session:
+            stmt = select(Llama_chat_message).where(
+                Llama_chat_message.id == rot_message.id)
+            result = await cancel_session.execute(stmt)
+            db_rot_message = result.scalar_one_or_none()
+            if db_rot_message is not None:
+                db_rot_message.content = rot_message.content
+                db_rot_message.status = "cancelled"
+                await cancel_session.commit()
+
     async def generate_data_2(
             self,
             url: str,
             headers,
             request_data,
             question: str,
-            conversation_id: str = None):
+            conversation_id: str = None,
+            stream_version: int = STREAM_VERSION_FULL,
+            request: Request = None):
 
         session = get_db_session()
+        pending_encoder = PendingEventEncoder(version=stream_version)
+        disconnect_watch = DisconnectWatch(request)
 
         message_id = str(uuid.uuid4())
 
@@ -938,53 +1236,58 @@ class ChatService:
                 message_json_obj) + ", \"botMessage\": " + json.dumps(
                 message_json_rob_obj) + ", \"conversation_id\": \"" + conversation_id + "\" }\n\n"
 
-            async with httpx.AsyncClient() as client:
-                async with client.stream(method="POST", url=url, headers=headers, json=request_data) as response:
+            async with get_async_client(SUPABASE).stream(method="POST", url=url, headers=headers, json=request_data) as response:
 
-                    if response.status_code != 200:
-                        error_content = ""
-                        async for item in response.aiter_bytes():
-                            error_content += item.decode(encoding="utf-8")
+                if response.status_code != 200:
+                    error_content = ""
+                    async for item in response.aiter_bytes():
+                        error_content += item.decode(encoding="utf-8")
 
-                        error_content = json.loads(error_content)
-                        message_json_rob_obj["content"] = rot_message.content
-                        message_json_rob_obj['status'] = "error"
-                        message_json_rob_obj['error_code'] = error_content['code']
-                        message_json_rob_obj['error_message'] = error_content['code']
+                    error_content = json.loads(error_content)
+                    message_json_rob_obj["content"] = rot_message.content
+                    message_json_rob_obj['status'] = "error"
+                    message_json_rob_obj['error_code'] = error_content['code']
+                    message_json_rob_obj['error_message'] = error_content['code']
 
-                        rot_message.status = "error"
-                        rot_message.error_code = error_content['code']
-                        rot_message.error_message = error_content['code']
+                    rot_message.status = "error"
+                    rot_message.error_code = error_content['code']
+                    rot_message.error_message = error_content['code']
 
-                        yield "event: error\n"
-                        yield "data: {\"userMessage\":" + json.dumps(
-                            message_json_obj) + ", \"botMessage\": " + json.dumps(
-                            message_json_rob_obj) + ", \"conversation_id\": \"" + conversation_id + "\" }\n\n"
+                    yield "event: error\n"
+                    yield "data: {\"userMessage\":" + json.dumps(
+                        message_json_obj) + ", \"botMessage\": " + json.dumps(
+                        message_json_rob_obj) + ", \"conversation_id\": \"" + conversation_id + "\" }\n\n"
 
-                        session.add(user_message)
-                        session.add(rot_message)
+                    session.add(user_message)
+                    session.add(rot_message)
 
-                        await session.commit()
-                    else:
-                        async for item in response.aiter_bytes():
-                            rot_message.content += item.decode(
-                                encoding="utf-8")
-                            message_json_rob_obj['content'] += item.decode(
-                                encoding="utf-8")
-                            data = "data: " + \
-                                json.dumps(message_json_rob_obj) + "\n\n"
-                            yield "event: pending\n"
-                            yield f"{data}"
-                        rot_message.status = "success"
-                        message_json_rob_obj['status'] = "success"
-                        message_list_json.append(message_json_rob_obj)
-                        message_json_rob_obj["content"] = rot_message.content
-
-                        yield "event: success\n"
-                        yield "data: {\"userMessage\":" + json.dumps(
-                            message_json_obj) + ", \"botMessage\": " + json.dumps(
-                            message_json_rob_obj) + ", \"conversation_id\": \"" + conversation_id + "\" }\n\n"
-                        await session.commit()
+                    await session.commit()
+                else:
+                    async for item in response.aiter_bytes():
+                        delta = item.decode(encoding="utf-8")
+                        rot_message.content += delta
+                        message_json_rob_obj['content'] += delta
+                        yield pending_encoder.encode(message_json_rob_obj, delta)
+                        if await disconnect_watch.disconnected():
+                            # leaving the stream context closes the upstream connection
+                            rot_message.status = "cancelled"
+                            await session.commit()
+                            return
+                    rot_message.status = "success"
+                    message_json_rob_obj['status'] = "success"
+                    message_list_json.append(message_json_rob_obj)
+                    message_json_rob_obj["content"] = rot_message.content
+
+                    yield "event: success\n"
+                    yield "data: {\"userMessage\":" + json.dumps(
+                        message_json_obj) + ", \"botMessage\": " + json.dumps(
+                        message_json_rob_obj) + ", \"conversation_id\": \"" + conversation_id + "\" }\n\n"
+                    await session.commit()
+        except (asyncio.CancelledError, GeneratorExit):
+            with anyio.CancelScope(shield=True):
+                rot_message.status = "cancelled"
+                await session.commit()
+            raise
         except Exception as e:
             rot_message.status = "error"
 
@@ -1,25 +1,31 @@
 import asyncio
+import base64
+import json
 import os
 import logging
 import platform
 
 from functools import wraps
-from typing import Type
+from typing import List, Optional, Tuple, Type
 
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import select, update, MetaData, text
+from sqlalchemy import select, update, text, event, and_, or_, literal_column
 from app.model.BackgroundTask import BackgroundTask, TaskStatus, TaskType
 import time
 import aiosqlite
 from app.model.Chat import ChatMessage, ChatConversation
-from sqlalchemy.exc import SQLAlchemyError
+from app.model.chat_message import ChatMessage as LlamaChatMessage
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
 
-from app.model.knowledge import Knowledge
+from app.common.FullTextSearch import FTS_TOKENIZERS
+from app.model.db_migrations import MIGRATIONS, AddColumn, FtsIndex
 from app.model.note import Note
 from sqlalchemy.ext.asyncio import AsyncEngine
 
+from app.setting import settings
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 logger = logging.getLogger(__name__)
@@ -36,6 +42,29 @@ if os.name == "posix":
 DATABASE_URL = f"sqlite+aiosqlite:///{DATABASE_PATH}"
 
 engine = create_async_engine(DATABASE_URL, echo=False)
+
+
+def sqlite_pragma_statements() -> list:
+    """PRAGMA statements of the configured SQLite performance profile"""
+    return [
+        f"PRAGMA journal_mode={settings.sqlite_journal_mode}",
+        f"PRAGMA synchronous={settings.sqlite_synchronous}",
+        f"PRAGMA mmap_size={settings.sqlite_mmap_size}",
+        f"PRAGMA cache_size={settings.sqlite_cache_size}",
+        f"PRAGMA temp_store={settings.sqlite_temp_store}",
+        f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}",
+    ]
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for statement in sqlite_pragma_statements():
+            cursor.execute(statement)
+    finally:
+        cursor.close()
+
 Base = declarative_base()
 
 async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
@@ -214,6 +243,57 @@ async def fetch_conversation_history_messages(conversation_id: str):
         return messages
 
 
+def encode_message_cursor(create_time: float, rowid: int) -> str:
+    """Opaque cursor of a message history page, the position of its oldest message"""
+    return base64.urlsafe_b64encode(json.dumps([create_time, rowid]).encode("utf-8")).decode("ascii")
+
+
+def decode_message_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        create_time, rowid = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(create_time), int(rowid)
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {cursor}") from e
+
+
+async def fetch_message_page(
+        session,
+        conversation_id: str,
+        page_size: int,
+        cursor: Optional[str] = None
+) -> Tuple[List[LlamaChatMessage], Optional[str]]:
+    """
+    One page of a conversation's history: the newest messages older than the cursor, found through
+    the (conversation_id, create_time) index
+    Messages written together share create_time, the rowid keeps their insertion order and breaks the tie.
+    Args:
+        session: database session
+        conversation_id: ID of the conversation
+        page_size: messages per page
+        cursor: next_cursor of the previous page, None for the newest page
+    Returns: (messages in chronological order, cursor of the next older page or None on the oldest page)
+    Raises:
+        ValueError: the cursor is not one this function returned
+    """
+    rowid = literal_column(f"{LlamaChatMessage.__tablename__}.rowid")
+    stmt = select(LlamaChatMessage, rowid).where(LlamaChatMessage.conversation_id == conversation_id)
+    if cursor is not None:
+        before_time, before_rowid = decode_message_cursor(cursor)
+        stmt = stmt.where(or_(
+            LlamaChatMessage.create_time < before_time,
+            and_(LlamaChatMessage.create_time == before_time, rowid < before_rowid)
+        ))
+    stmt = stmt.order_by(LlamaChatMessage.create_time.desc(), rowid.desc()).limit(page_size + 1)
+    rows = (await session.execute(stmt)).all()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_message_cursor(rows[-1][0].create_time, rows[-1][1])
+    rows.reverse()
+    return [row[0] for row in rows], next_cursor
+
+
 async def fetch_conversation_info(conversation_id: str) -> ChatConversation:
     async with async_session() as session:
         stmt = (
@@ -258,35 +338,92 @@ async def init_db(engine: AsyncEngine):
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
 
-    # 只有在数据库已经存在的情况下才更新表结构
-    if db_exists:
-        await update_table_columns(Note.__tablename__)
-        await update_table_columns(Knowledge.__tablename__)
 
-
-async def update_table_columns(table_name: str):
-    # 创建元数据对象并反射现有表结构
-    metadata = MetaData()
-
-    # 使用 run_sync 将异步引擎转换为同步引擎
+async def migrate_db(engine: AsyncEngine):
+    """
+    Apply the schema migrations newer than the database's PRAGMA user_version, in order
+    A current schema costs a single PRAGMA read. Steps are idempotent, so a migration interrupted
+    part way is simply run again on the next startup.
+    """
     async with engine.begin() as conn:
-        await conn.run_sync(metadata.reflect)
+        current_version = (await conn.execute(text("PRAGMA user_version"))).scalar() or 0
 
-    # 检查表是否存在
-    if table_name in metadata.tables:
-        # 获取表对象
-        table = metadata.tables[table_name]
+    pending = [migration for migration in MIGRATIONS if migration.version > current_version]
+    if not pending:
+        logger.info(f"Database schema is current at version {current_version}")
+        return
 
-        # 检查列是否已经存在
-        if 'local_mode' not in table.columns:
-            # 使用 ALTER TABLE 添加新列
-            async with engine.begin() as conn:
-                # 使用 text() 包装 SQL 语句
-                stmt = text(f'ALTER TABLE {table_name} ADD COLUMN local_mode INTEGER DEFAULT 1')
-                await conn.execute(stmt)
+    for migration in pending:
+        async with engine.begin() as conn:
+            for step in migration.steps:
+                if isinstance(step, AddColumn):
+                    await add_column_if_missing(conn, step)
+                elif isinstance(step, FtsIndex):
+                    await create_fts_index(conn, step)
+                else:
+                    await conn.execute(text(step))
+            await conn.execute(text(f"PRAGMA user_version = {int(migration.version)}"))
+        logger.info(f"Database migrated to version {migration.version}: {migration.description}")
+
+
+async def add_column_if_missing(conn, step: AddColumn):
+    """
+    Add a column unless the table already has it, skipped while the table does not exist
+    Args:
+        conn: connection of the running migration
+        step: AddColumn step
+    """
+    result = await conn.execute(text(f"PRAGMA table_info({step.table})"))
+    columns = {row[1] for row in result}
+    if not columns or step.column in columns:
+        return
+    await conn.execute(text(f"ALTER TABLE {step.table} ADD COLUMN {step.column} {step.definition}"))
+    logger.info(f"Column '{step.column}' added to table '{step.table}'.")
 
-            logger.info(f"Column 'local_mode' added to table '{table_name}'.")
-        else:
-            logger.info(f"Column 'local_mode' already exists in table '{table_name}'.")
 
+async def create_fts_index(conn, step: FtsIndex):
+    """
+    Create an external content FTS5 index, its sync triggers, and index the existing rows
+    The index stores no copy of the text, rows are joined back on rowid. Skipped while the table
+    does not exist and, with a warning, when this SQLite build has no FTS5: search then keeps
+    using ilike.
+    Args:
+        conn: connection of the running migration
+        step: FtsIndex step
+    """
+    result = await conn.execute(text(f"PRAGMA table_info({step.table})"))
+    if not result.fetchall():
+        return
+
+    columns = ", ".join(step.columns)
+    for tokenizer in FTS_TOKENIZERS:
+        try:
+            await conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {step.name} USING fts5("
+                f"{columns}, content='{step.table}', content_rowid='rowid', tokenize='{tokenizer}')"
+            ))
+            break
+        except OperationalError as e:
+            logger.warning(f"FTS5 tokenizer '{tokenizer}' unavailable for {step.name}: {str(e)}")
+    else:
+        logger.warning(f"Full-text index {step.name} not created, search on {step.table} uses ilike")
+        return
 
+    new_values = ", ".join(f"new.{column}" for column in step.columns)
+    old_values = ", ".join(f"old.{column}" for column in step.columns)
+    delete_old = (
+        f"INSERT INTO {step.name}({step.name}, rowid, {columns}) VALUES ('delete', old.rowid, {old_values});"
+    )
+    insert_new = f"INSERT INTO {step.name}(rowid, {columns}) VALUES (new.rowid, {new_values});"
+    await conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {step.name}_ai AFTER INSERT ON {step.table} BEGIN {insert_new} END"
+    ))
+    await conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {step.name}_ad AFTER DELETE ON {step.table} BEGIN {delete_old} END"
+    ))
+    await conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {step.name}_au AFTER UPDATE OF {columns} ON {step.table} "
+        f"BEGIN {delete_old} {insert_new} END"
+    ))
+    await conn.execute(text(f"INSERT INTO {step.name}({step.name}) VALUES ('rebuild')"))
+    logger.info(f"Full-text index {step.name} created on {step.table} ({columns})")
@@ -13,10 +13,11 @@ from starlette import status
 from starlette.exceptions import HTTPException
 
 from app.common.LlamaEnum import SystemTypeDiff
+from app.common.RetrievalCache import release_index_dir
 from app.model.Response import ResponseContent
-from app.model.knowledge import File, Knowledge, KnowledgeCreate, EmbedStatus, KnowledgeResponse
+from app.model.knowledge import File, Knowledge, KnowledgeCreate, KnowledgeUpdate, EmbedStatus, KnowledgeResponse
 from app.services.client_sqlite_service import db_transaction
-from app.model.LlamaRequest import LlamaKnowledge, LlamaFileList, LLamaFileImportRequest
+from app.model.LlamaRequest import LlamaKnowledge, LlamaFileList, LLamaFileImportRequest, KnowledgeSearchRequest
 from app.services.llama_cloud.llama_cloud_file_service import LlamaCloudFileService
 
 from app.services.llama_index_service import LlamaIndexService
@@ -170,7 +171,8 @@ class KnowledgeService:
                 embed_status=EmbedStatus.EMBEDDING.value,
                 create_at=datetime.now().timestamp(),
                 update_at=datetime.now().timestamp(),
-                local_mode=KleeSettings.local_mode
+                local_mode=KleeSettings.local_mode,
+                vector_precision=knowledge.vector_precision.value
             )
             session.add(new_knowledge)
 
@@ -196,7 +198,7 @@ class KnowledgeService:
     async def update_knowledge(
             self,
             knowledge_id: str,
-            knowledge: KnowledgeCreate,
+            knowledge: KnowledgeUpdate,
             session=None
     ) -> KnowledgeResponse:
         try:
@@ -207,22 +209,37 @@ class KnowledgeService:
             if not existing_knowledge:
                 raise HTTPException(status_code=404, detail="Database knowledge not found")
 
+            values = dict(
+                title=knowledge.title,
+                icon=knowledge.icon,
+                description=knowledge.description,
+                category=knowledge.category,
+                isPin=knowledge.isPin,
+                folder_path=knowledge.folder_path
+            )
+            if knowledge.vector_precision is not None \
+                    and knowledge.vector_precision.value != existing_knowledge.vector_precision:
+                # the stored vectors stay encoded with the old precision, only an empty knowledge base may switch
+                result = await session.execute(select(File.id).where(File.knowledgeId == knowledge_id).limit(1))
+                if result.first() is not None:
+                    raise HTTPException(
+                        status_code=status.HTTP_409_CONFLICT,
+                        detail="Vector precision cannot change once files are embedded, "
+                               "create a new knowledge base instead"
+                    )
+                values["vector_precision"] = knowledge.vector_precision.value
+
             update_stmt = (
                 update(Knowledge)
                 .where(Knowledge.id == knowledge_id)
-                .values(
-                    title=knowledge.title,
-                    icon=knowledge.icon,
-                    description=knowledge.description,
-                    category=knowledge.category,
-                    isPin=knowledge.isPin,
-                    folder_path=knowledge.folder_path
-                )
+                .values(**values)
                 .returning(Knowledge)
             )
             result = await session.execute(update_stmt)
             updated_knowledge = result.scalar_one()
             return KnowledgeResponse.from_orm(updated_knowledge)
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Update knowledge database failed: {str(e)}")
 
@@ -355,6 +372,7 @@ class KnowledgeService:
 
             for i in delete_file_id:
                 vector_url = f"{KleeSettings.vector_url}{i}"
+                release_index_dir(vector_url)
                 shutil.rmtree(vector_url)
 
             await session.execute(delete_stmt)
@@ -390,6 +408,7 @@ class KnowledgeService:
                     if os.path.exists(f"{KleeSettings.temp_file_url}{file.id}"):
                         shutil.rmtree(f"{KleeSettings.temp_file_url}{file.id}")
                     if os.path.exists(f"{KleeSettings.vector_url}{file.id}"):
+                        release_index_dir(f"{KleeSettings.vector_url}{file.id}")
                         shutil.rmtree(f"{KleeSettings.vector_url}{file.id}")
 
                 delete_stmt = delete(File).where(File.knowledgeId == knowledge_id)
@@ -486,6 +505,7 @@ class KnowledgeService:
                 temp_url = f"{KleeSettings.temp_file_url}{file_id}"
 
                 if os.path.exists(vector_url):
+                    release_index_dir(vector_url)
                     shutil.rmtree(vector_url)
                 if os.path.exists(temp_url):
                     shutil.rmtree(temp_url)
@@ -497,6 +517,50 @@ class KnowledgeService:
         except Exception as e:
             return ResponseContent(error_code=-1, message=f"Delete file failed, {str(e)}", data={})
 
+    @db_transaction
+    async def search(
+            self,
+            search_request: KnowledgeSearchRequest,
+            session=None
+    ):
+        """
+        Retrieval only search across knowledge bases and notes
+        Args:
+            search_request: query, knowledge and note ids, number of chunks
+            session: Database session
+        Returns:
+            ResponseContent: Response containing ranked chunks and the sources that timed out
+        """
+        try:
+            file_infos = {}
+            vector_precisions = {}
+            if search_request.knowledge_ids:
+                stmt = select(File).where(File.knowledgeId.in_(search_request.knowledge_ids))
+                result = await session.execute(stmt)
+                # files still being embedded have no index yet and are skipped rather than built here
+                for file in result.scalars().all():
+                    if os.path.exists(f"{KleeSettings.vector_url}{file.id}"):
+                        file_infos.setdefault(file.knowledgeId, []).append(file)
+
+                stmt = select(Knowledge.id, Knowledge.vector_precision).where(
+                    Knowledge.id.in_(search_request.knowledge_ids))
+                result = await session.execute(stmt)
+                vector_precisions = {row.id: row.vector_precision for row in result}
+
+            note_ids = [n for n in search_request.note_ids or [] if os.path.exists(f"{KleeSettings.vector_url}{n}")]
+
+            data = await self.llama_index_service.search(
+                query=search_request.query,
+                note_ids=note_ids,
+                file_infos=file_infos,
+                vector_precisions=vector_precisions,
+                top_k=search_request.top_k
+            )
+            return ResponseContent(error_code=0, message="Search successfully", data=data)
+        except Exception as e:
+            logger.error(f"Search failed: {str(e)}")
+            return ResponseContent(error_code=-1, message=f"Search failed, {str(e)}", data={})
+
     async def llama_add(
             self,
             knowledge_id: str,
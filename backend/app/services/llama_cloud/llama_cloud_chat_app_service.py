@@ -6,6 +6,8 @@ from dotenv import load_dotenv
 from llama_cloud import PresetCompositeRetrievalParams, CompositeRetrievalMode, LlmParameters, SupportedLlmModelNames
 from llama_cloud.client import AsyncLlamaCloud
 
+from app.common.HttpClients import LLAMA_CLOUD, get_async_client
+
 from app.services.llama_cloud.llama_cloud_retrievers_service import LlamaCloudRetrieversService
 
 logging.basicConfig(
@@ -18,7 +20,7 @@ logger = logging.getLogger(__name__)
 class LlamaCloudChatAppService:
     def __init__(self):
         load_dotenv(f".env")
-        self.async_client = AsyncLlamaCloud(token=os.getenv("LLAMA_CLOUD_API_KEY"))
+        self.async_client = AsyncLlamaCloud(token=os.getenv("LLAMA_CLOUD_API_KEY"), httpx_client=get_async_client(LLAMA_CLOUD))
         self.retrievers_service = LlamaCloudRetrieversService()
 
     async def create_chat_app_func(
@@ -6,6 +6,8 @@ import os
 
 from dotenv import load_dotenv
 
+from app.common.HttpClients import LLAMA_CLOUD, get_async_client
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -28,19 +30,20 @@ class ChatCloudService:
             knowledge_base_ids: List[str]
     ):
         logger.info(f"Sending message to Llama Cloud: {message}")
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(
-                url=self.api_url,
-                headers=self.headers,
-                json= {
-                    "query": message,
-                    "knowledge_bases": knowledge_base_ids,
-                    "max_tokens": 1000,
-                    "max_retries": 5,
-                    "temperature": 0.5,
-                    "top_k": 5
-                }
-            )
-            response.raise_for_status()
-            logger.info(f"Async response from Llama Cloud: {response.json()}")
-            return response.json()
+        client = get_async_client(LLAMA_CLOUD)
+        response = await client.post(
+            url=self.api_url,
+            headers=self.headers,
+            timeout=self.timeout,
+            json= {
+                "query": message,
+                "knowledge_bases": knowledge_base_ids,
+                "max_tokens": 1000,
+                "max_retries": 5,
+                "temperature": 0.5,
+                "top_k": 5
+            }
+        )
+        response.raise_for_status()
+        logger.info(f"Async response from Llama Cloud: {response.json()}")
+        return response.json()
@@ -4,6 +4,8 @@ import os
 from dotenv import load_dotenv
 from llama_cloud.client import AsyncLlamaCloud
 
+from app.common.HttpClients import LLAMA_CLOUD, get_async_client
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -13,7 +15,7 @@ logger = logging.getLogger(__name__)
 class LlamaCloudDataSinkService:
     def __init__(self):
         load_dotenv(f".env")
-        self.async_client = AsyncLlamaCloud(token=os.getenv("LLAMA_CLOUD_API_KEY"))
+        self.async_client = AsyncLlamaCloud(token=os.getenv("LLAMA_CLOUD_API_KEY"), httpx_client=get_async_client(LLAMA_CLOUD))
 
     async def list_data_sources(self):
         response = await self.async_client.data_sources.list_data_sources()
@@ -7,6 +7,8 @@ from llama_cloud import EmbeddingModelConfigCreateEmbeddingConfig, EmbeddingMode
 from llama_cloud.client import AsyncLlamaCloud
 from pydantic import BaseModel
 
+from app.common.HttpClients import LLAMA_CLOUD, get_async_client
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -23,7 +25,7 @@ class LlamaCloudEmbeddingConfigRequest(BaseModel):
 class LlamaCloudEmbeddingService:
     def __init__(self):
         load_dotenv(f".env")
-        self.async_client = AsyncLlamaCloud(token=os.getenv("LLAMA_CLOUD_API_KEY"))
+        self.async_client = AsyncLlamaCloud(token=os.getenv("LLAMA_CLOUD_API_KEY"), httpx_client=get_async_client(LLAMA_CLOUD))
         self.openai_api_key = os.getenv("OPENAI_KEY")
         logger.info(f"Llama Cloud API Key: {os.getenv('LLAMA_CLOUD_API_KEY')}")
         logger.info(f"OpenAI API Key: {self.openai_api_key}")
@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 from llama_cloud.client import AsyncLlamaCloud
 from pydantic import BaseModel
 
+from app.common.HttpClients import LLAMA_CLOUD, get_async_client
 from app.config.env_config import config
 
 logging.basicConfig(level=logging.INFO)
@@ -20,7 +21,7 @@ class KnowledgeCloudService:
     Used to instead of the knowledge service in the chat service.
     """
     def __init__(self):
-        self.async_client = AsyncLlamaCloud(token=config.llama_cloud_api_key)
+        self.async_client = AsyncLlamaCloud(token=config.llama_cloud_api_key, httpx_client=get_async_client(LLAMA_CLOUD))
 
     async def create_knowledge_base(
             self,
@@ -5,6 +5,8 @@ from dotenv import load_dotenv
 from llama_cloud import PipelineCreate
 from llama_cloud.client import AsyncLlamaCloud
 
+from app.common.HttpClients import LLAMA_CLOUD, get_async_client
+
 from app.services.llama_cloud.llama_cloud_embedding_service import LlamaCloudEmbeddingService
 from app.model.klee_settings import Settings as KleeSettings
 
@@ -17,7 +19,7 @@ logger = logging.getLogger(__name__)
 class LlamaCloudPipelinesService:
     def __init__(self):
         load_dotenv(f".env")
-        self.async_client = AsyncLlamaCloud(token=os.getenv("LLAMA_CLOUD_API_KEY"))
+        self.async_client = AsyncLlamaCloud(token=os.getenv("LLAMA_CLOUD_API_KEY"), httpx_client=get_async_client(LLAMA_CLOUD))
         self.llama_cloud_embedding_service = LlamaCloudEmbeddingService()
 
     async def create_pipeline(
@@ -5,6 +5,8 @@ from dotenv import load_dotenv
 from llama_cloud import RetrieverCreate
 from llama_cloud.client import AsyncLlamaCloud
 
+from app.common.HttpClients import LLAMA_CLOUD, get_async_client
+
 from app.services.llama_cloud.llama_cloud_pipelines_service import LlamaCloudPipelinesService
 
 logging.basicConfig(
@@ -17,7 +19,7 @@ logger = logging.getLogger(__name__)
 class LlamaCloudRetrieversService:
     def __init__(self):
         load_dotenv(f".env")
-        self.async_client = AsyncLlamaCloud(token=os.getenv("LLAMA_CLOUD_API_KEY"))
+        self.async_client = AsyncLlamaCloud(token=os.getenv("LLAMA_CLOUD_API_KEY"), httpx_client=get_async_client(LLAMA_CLOUD))
         self.pipelines_service = LlamaCloudPipelinesService()
 
     async def create_retriever(
@@ -1,9 +1,13 @@
 # os module
+import asyncio
+import json
 import os
 import platform
 import shutil
 import contextlib
 import logging
+import threading
+import time
 
 import yaml
 
@@ -25,6 +29,10 @@ from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_s
 from llama_index.core.storage.docstore import SimpleDocumentStore
 from llama_index.core.retrievers import AutoMergingRetriever
 from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.llms import LLM, MockLLM
+from llama_index.core.base.llms.types import ChatMessage as LlmChatMessage, MessageRole
+from llama_index.core.base.response.schema import AsyncStreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 from llama_index.core.settings import Settings as llamaSettings
 
@@ -53,7 +61,6 @@ from sqlalchemy import select
 
 from app.model.klee_settings import Settings as KleeSettings
 
-from llama_index.core.retrievers import QueryFusionRetriever
 from typing import List, Dict, Optional, Any, Union
 
 from llama_index.core.agent import AgentRunner
@@ -61,6 +68,20 @@ from llama_index.core.tools.query_engine import QueryEngineTool
 
 from app.model.note import Note
 from app.model.global_settings import GlobalSettings
+from app.model.knowledge import VectorPrecision
+from app.common.QuantizedVectorStore import QuantizedVectorStore
+from app.common.KleeQueryFusionRetriever import KleeQueryFusionRetriever
+from app.common.ContextPacker import ContextPacker
+from app.common.AnswerCache import answer_cache, index_version, source_set_version
+from app.common.RetrievalCache import CachedRetriever, index_build_locks, loaded_index_cache, release_index_dir
+from app.common.OllamaResidency import ollama_residency
+from app.common.HttpClients import OLLAMA, get_async_client
+from app.common.PromptCache import ollama_context_cache
+from app.common.LlmCache import LlmKey, credentials_hash, llm_cache
+from app.common.LlamaCppLLM import LlamaCppLLM
+from app.common.BM25Retriever import BM25Index, BM25Retriever, BM25_INDEX_FNAME, load_or_build_bm25_index
+from app.common.LlamaEnum import RetrievalMode
+from app.setting import settings
 
 # 配置日志记录
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -68,6 +89,16 @@ logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(leve
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# providers whose GGUF models run in process on llama.cpp
+_IN_PROCESS_PROVIDERS = (SystemTypeDiffModelType.KLEE.value, SystemTypeDiffModelType.LOCAL.value)
+
+# environment variables the cloud LLM clients read their API key from
+_API_KEY_ENV = {
+    SystemTypeDiffModelType.OPENAI.value: "OPENAI_API_KEY",
+    SystemTypeDiffModelType.CLAUDE.value: "ANTHROPIC_API_KEY",
+    SystemTypeDiffModelType.DEEPSEEK.value: "DEEPSEEK_API_KEY",
+}
+
 
 class LlamaIndexError(Exception):
     """Base exception class for LlamaIndex service errors"""
@@ -301,58 +332,92 @@ class LlamaIndexService:
             import gc
             gc.collect()
 
-    async def load_llm(
+    def resolve_llm(
             self,
-            provider_id: Optional[str] = None,
-            model_name: Optional[str] = None,
+            provider_id: Optional[str],
+            model_name: Optional[str],
+            local_mode: bool = True,
             api_type: Optional[str] = None,
-            api_base_url: str = "https://api.deepseek.com",
-    ) -> None:
-        """Load language model based on provider and configuration
-        
+            api_base_url: Optional[str] = None,
+            api_key: Optional[str] = None
+    ):
+        """LLM client of a model, taken from the LLM cache without touching the global settings
+
         Args:
             provider_id: Provider identifier
-            model_name: Name of the model to load
-            api_type: Type of API to use
+            model_name: Name of the model
+            local_mode: Whether the model runs on this machine
+            api_type: Type of API of custom cloud providers
             api_base_url: Base URL for API calls
-            
-        Raises:
-            ModelLoadError: If model loading fails
+            api_key: API key of custom providers, the client's environment variable when None
+
+        Returns:
+            Language model instance, None for the cloud relay and providers without a client
         """
-        try:
-            with self.release_memory():
-                llamaSettings.llm = None
-                self.release_memory()
-
-            if not KleeSettings.local_mode:
-                if provider_id not in [SystemTypeDiffModelType.OPENAI.value, SystemTypeDiffModelType.CLAUDE.value]:
-                    llm = self._get_cloud_llm(api_type, model_name, api_base_url)
-                    if llm:
-                        llamaSettings.llm = llm
-                        KleeSettings.un_load = False
-                else:
-                    KleeSettings.un_load = False
-            else:
-                if provider_id == SystemTypeDiffModelType.OLLAMA.value:
-                    os.environ["http_proxy"] = "http://localhost:11434"
-                    llamaSettings.llm = Ollama(
-                        model=model_name,
-                        request_timeout=60.0,
-                        base_url="http://localhost:11434"
-                    )
-                    KleeSettings.un_load = False
+        if not local_mode:
+            if provider_id in [SystemTypeDiffModelType.OPENAI.value, SystemTypeDiffModelType.CLAUDE.value]:
+                return None
+            key = LlmKey(
+                provider_id=provider_id,
+                model_name=model_name,
+                base_url=api_base_url or "",
+                credentials=credentials_hash(api_key or os.environ.get(_API_KEY_ENV.get(api_type, ""), ""))
+            )
+            return llm_cache.get_or_create(
+                key,
+                lambda: self._get_cloud_llm(api_type, model_name, api_base_url, api_key)
+            )
 
-            logger.info(f"Successfully loaded LLM: {provider_id} - {model_name}")
+        if provider_id == SystemTypeDiffModelType.OLLAMA.value:
+            return llm_cache.get_or_create(
+                LlmKey(provider_id=provider_id, model_name=model_name, base_url=settings.ollama_base_url),
+                lambda: Ollama(
+                    model=model_name,
+                    request_timeout=60.0,
+                    base_url=settings.ollama_base_url,
+                    keep_alive=settings.ollama_keep_alive
+                )
+            )
 
-        except Exception as e:
-            logger.error(f"Failed to load LLM: {str(e)}")
-            raise ModelLoadError(f"Failed to load model {model_name}: {str(e)}")
+        if provider_id in _IN_PROCESS_PROVIDERS and model_name:
+            key = LlmKey(provider_id=provider_id, model_name=model_name)
+            # in-process models hold their weights and KV cache, only the most recent ones stay loaded.
+            # Evicted outside the cache's creation lock, a model still answering is freed when it finishes.
+            llm_cache.evict(
+                lambda cached: cached.provider_id in _IN_PROCESS_PROVIDERS and cached != key,
+                keep=max(0, settings.llamacpp_max_models - 1)
+            )
+            return llm_cache.get_or_create(key, lambda: LlamaCppLLM.from_settings(model_name))
+        return None
+
+    @staticmethod
+    def local_model_name(
+            provider_id: Optional[str],
+            model_id: Optional[str],
+            model_path: Optional[str] = None
+    ) -> Optional[str]:
+        """Name resolve_llm expects for a local model: the Ollama tag, or the GGUF path of klee and local models
+
+        Args:
+            provider_id: Provider identifier
+            model_id: model id of the conversation
+            model_path: GGUF file of local models
+
+        Returns:
+            Model name or path, None when the conversation names no model
+        """
+        if provider_id == SystemTypeDiffModelType.KLEE.value and model_id:
+            return f"{KleeSettings.llm_path}{str(model_id).lower()}.gguf"
+        if provider_id == SystemTypeDiffModelType.LOCAL.value:
+            return model_path
+        return model_id
 
     def _get_cloud_llm(
             self,
             api_type: str,
             model_name: str,
-            api_base_url: str
+            api_base_url: Optional[str],
+            api_key: Optional[str] = None
     ):
         """Get cloud-based language model instance
         
@@ -360,30 +425,32 @@ class LlamaIndexService:
             api_type: Type of API
             model_name: Name of the model
             api_base_url: Base URL for API
+            api_key: API key, the client's environment variable when None
             
         Returns:
             Language model instance
         """
         if api_type == SystemTypeDiffModelType.OPENAI.value:
-            return OpenAI(model=model_name, temperature=0.5)
+            return OpenAI(model=model_name, temperature=0.5, api_key=api_key)
         elif api_type == SystemTypeDiffModelType.CLAUDE.value:
-            return Anthropic(model=model_name, temperature=0.5)
+            return Anthropic(model=model_name, temperature=0.5, api_key=api_key)
         elif api_type == SystemTypeDiffModelType.DEEPSEEK.value:
-            if "luchentech" in api_base_url:
+            if api_base_url and "luchentech" in api_base_url:
                 return DeepSeek(
                     model=model_name,
                     temperature=0.5,
-                    api_key=os.environ.get("DEEPSEEK_API_KEY"),
+                    api_key=api_key or os.environ.get("DEEPSEEK_API_KEY"),
                     api_base="https://cloud.luchentech.com/api/maas"
                 )
-            return DeepSeek(model=model_name, temperature=0.5)
+            return DeepSeek(model=model_name, temperature=0.5, api_key=api_key)
         return None
 
     def build_auto_merging_index(
             self,
             documents,
             save_dir="F:/auto_merge_data",
-            chunk_sizes=None
+            chunk_sizes=None,
+            precision: str = VectorPrecision.FLOAT32.value
     ) -> VectorStoreIndex:
         """
         Build auto merging index
@@ -391,6 +458,7 @@ class LlamaIndexService:
             documents: documents
             save_dir: save dir: the path to save the index
             chunk_sizes: chunk sizes
+            precision: vector precision kept in memory once the index is loaded, float32|float16|int8
         Returns: auto merging index
         """
         if not os.path.exists(save_dir):
@@ -406,15 +474,42 @@ class LlamaIndexService:
                 leaf_nodes, storage_context=store_context
             )
             auto_merging_index.storage_context.persist(persist_dir=save_dir)
+            BM25Index.from_nodes(leaf_nodes).persist(os.path.join(save_dir, BM25_INDEX_FNAME))
         else:
-            store_context_from_disk = StorageContext.from_defaults(persist_dir=save_dir)
-
-            auto_merging_index = load_index_from_storage(
-                store_context_from_disk
+            auto_merging_index = loaded_index_cache.get_or_load(
+                (save_dir, precision),
+                index_version(save_dir),
+                lambda: self._load_auto_merging_index(save_dir, precision)
             )
 
         return auto_merging_index
 
+    def _load_auto_merging_index(
+            self,
+            save_dir: str,
+            precision: str
+    ) -> VectorStoreIndex:
+        """
+        Load a persisted auto merging index
+        Args:
+            save_dir: the path the index was saved to
+            precision: vector precision kept in memory, float32|float16|int8
+        Returns: auto merging index
+        """
+        if precision != VectorPrecision.FLOAT32.value:
+            vector_store = QuantizedVectorStore.from_persist_dir(
+                save_dir,
+                precision=precision,
+                rescore_factor=settings.vector_rescore_factor
+            )
+            store_context_from_disk = StorageContext.from_defaults(persist_dir=save_dir, vector_store=vector_store)
+        else:
+            store_context_from_disk = StorageContext.from_defaults(persist_dir=save_dir)
+
+        return load_index_from_storage(
+            store_context_from_disk
+        )
+
     def get_auto_merging_query_engine(
             self,
             index: VectorStoreIndex,
@@ -577,7 +672,11 @@ class LlamaIndexService:
                 leaf_nodes, storage_context=store_context
             )
 
-            auto_merging_index.storage_context.persist(persist_dir=store_dir)
+            with index_build_locks.lock(store_dir):
+                release_index_dir(store_dir)
+                auto_merging_index.storage_context.persist(persist_dir=store_dir)
+                BM25Index.from_nodes(leaf_nodes).persist(os.path.join(store_dir, BM25_INDEX_FNAME))
+            answer_cache.invalidate_sources([os.path.basename(os.path.normpath(store_dir))])
         except Exception as e:
             raise Exception(e)
 
@@ -659,12 +758,199 @@ class LlamaIndexService:
                 "error"
             )
 
+    async def search(
+            self,
+            query: str,
+            note_ids: List[str] = None,
+            file_infos: dict = None,
+            vector_precisions: Dict[str, str] = None,
+            top_k: int = 10
+    ) -> Dict[str, Any]:
+        """
+        Retrieval only search over knowledge files and notes, no LLM is involved
+        Args:
+            query: search text
+            note_ids: list of note ids
+            file_infos: dict of knowledge id -> files
+            vector_precisions: knowledge id -> vector precision of its files
+            top_k: number of chunks returned
+        Returns: ranked chunks with scores and metadata, and the sources that missed the deadline
+        """
+        retrievers, sparse_retrievers, source_ids, sparse_source_ids = await run_in_threadpool(
+            self._collect_source_retrievers,
+            note_ids=note_ids,
+            file_infos=file_infos,
+            vector_precisions=vector_precisions
+        )
+        if len(retrievers) == 0:
+            return {"results": [], "timed_out_sources": []}
+
+        retriever = KleeQueryFusionRetriever(
+            retrievers,
+            retrieval_mode=RetrievalMode.NONE.value,
+            sparse_retrievers=sparse_retrievers,
+            keyword_top_k=top_k,
+            source_ids=source_ids,
+            sparse_source_ids=sparse_source_ids,
+            source_deadline=settings.search_source_deadline,
+            similarity_top_k=top_k,
+            use_async=True,
+            # only the original query is used, keeps the loaded chat model out of the search path
+            llm=MockLLM(),
+        )
+        nodes = await retriever.aretrieve(query)
+
+        known_sources = set(source_ids)
+        results = []
+        for node in nodes:
+            metadata = node.node.metadata
+            source_dir = os.path.basename(os.path.dirname(metadata.get("file_path", "")))
+            results.append({
+                "node_id": node.node.node_id,
+                "score": node.score,
+                "text": node.node.get_content(),
+                "source_id": source_dir if source_dir in known_sources else None,
+                "file_name": metadata.get("file_name"),
+                "file_path": metadata.get("file_path"),
+                "page_label": metadata.get("page_label")
+            })
+
+        return {"results": results, "timed_out_sources": retriever.last_report.timed_out}
+
+    async def warm_up(
+            self,
+            note_ids: List[str] = None,
+            file_infos: dict = None,
+            vector_precisions: Dict[str, str] = None,
+            provider_id: str = None,
+            model_name: str = None,
+            local_mode: bool = False,
+            model_path: str = None
+    ) -> None:
+        """
+        Pay the cold start costs of a conversation before its first question
+        Loads the embedding model and the source indexes into the index cache, assembles the
+        retrievers, and loads the conversation's local model: Ollama models are made resident,
+        klee and local GGUF models are loaded into the LLM cache. Cloud models have nothing to load.
+        Cancelling stops between steps and between sources, index builds are serialized per
+        directory with the ones of chats.
+        Args:
+            note_ids: list of note ids
+            file_infos: dict of knowledge id -> files
+            vector_precisions: knowledge id -> vector precision of its files
+            provider_id: provider of the conversation model
+            model_name: model id of the conversation
+            local_mode: whether the conversation runs its model on this machine
+            model_path: GGUF file of local models
+        """
+        started = time.perf_counter()
+        await run_in_threadpool(llamaSettings.embed_model.get_query_embedding, "warm up")
+        if note_ids or file_infos:
+            stop = threading.Event()
+            try:
+                await run_in_threadpool(
+                    self._collect_source_retrievers,
+                    note_ids=note_ids,
+                    file_infos=file_infos,
+                    vector_precisions=vector_precisions,
+                    stop=stop
+                )
+            except asyncio.CancelledError:
+                # the worker thread finishes the source it is on and builds no other
+                stop.set()
+                raise
+
+        model_name = self.local_model_name(provider_id, model_name, model_path) if local_mode else None
+        if model_name:
+            # loading GGUF weights blocks for seconds, it never runs on the event loop
+            llm = await run_in_threadpool(
+                self.resolve_llm,
+                provider_id=provider_id,
+                model_name=model_name,
+                local_mode=True
+            )
+            if isinstance(llm, Ollama):
+                await ollama_residency.ensure_resident(llm.model)
+
+        logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+
+    async def direct_chat(
+            self,
+            messages: List[LlmChatMessage],
+            llm: Optional[LLM] = None,
+            conversation_id: Optional[str] = None
+    ) -> AsyncStreamingResponse:
+        """
+        Stream an answer straight from the LLM, for conversations without knowledge or notes
+        Args:
+            messages: chat history in chronological order, ending with the user question
+            llm: model of the conversation, the global one when None
+            conversation_id: conversation whose Ollama context is reused for follow-up turns
+        Returns: streaming response shaped like the query engine's, without source nodes
+        """
+        llm = llm or llamaSettings.llm
+        if conversation_id and isinstance(llm, Ollama) and settings.ollama_context_cache_size > 0:
+            context = []
+            if len(messages) > 1:
+                previous = messages[-2]
+                context = ollama_context_cache.get(conversation_id, previous.content or "") \
+                    if previous.role == MessageRole.ASSISTANT else None
+            if context is not None:
+                return AsyncStreamingResponse(
+                    response_gen=self._ollama_context_stream(llm, conversation_id, messages[-1].content, context),
+                    source_nodes=[]
+                )
+
+        chat_stream = await llm.astream_chat(messages)
+        return AsyncStreamingResponse(
+            response_gen=(chunk.delta or "" async for chunk in chat_stream),
+            source_nodes=[]
+        )
+
+    async def _ollama_context_stream(
+            self,
+            llm: Ollama,
+            conversation_id: str,
+            question: str,
+            context: List[int]
+    ):
+        """
+        Answer a follow-up question on top of the conversation's Ollama context
+        Ollama only evaluates the new question, the previous turns are already in the context. The
+        context returned with the answer is kept for the next turn.
+        """
+        payload = {
+            "model": llm.model,
+            "prompt": question,
+            "context": context,
+            "stream": True,
+            "keep_alive": settings.ollama_keep_alive,
+            "options": {"temperature": llm.temperature}
+        }
+        answer = ""
+        async with get_async_client(OLLAMA).stream("POST", f"{llm.base_url}/api/generate", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                delta = chunk.get("response", "")
+                if delta:
+                    answer += delta
+                    yield delta
+                if chunk.get("done") and chunk.get("context"):
+                    ollama_context_cache.put(conversation_id, answer, chunk["context"])
+
     async def combine_query(
             self,
             knowledge_ids: List[str] = None,
             note_ids: List[str] = None,
             file_infos: dict = None,
-            streaming: bool = True
+            streaming: bool = True,
+            vector_precisions: Dict[str, str] = None,
+            retrieval_mode: str = RetrievalMode.EXPAND.value,
+            conversation_id: Optional[str] = None,
+            llm: Optional[LLM] = None
     ):
         """
         Use query engine to combine query from knowledge, note and file
@@ -673,58 +959,21 @@ class LlamaIndexService:
             note_ids: list of note ids
             file_infos: dict of file infos
             streaming: bool
+            vector_precisions: knowledge id -> vector precision of its files, float32 when missing
+            retrieval_mode: none|expand|cached, how sub-queries are produced before retrieval
+            conversation_id: conversation the generated sub-queries are cached for
+            llm: model generating sub-queries and the answer, the global one when None
         Returns: query engine
         """
-        retrievers = []
-        if knowledge_ids is not None and len(knowledge_ids) > 0:
-            for s in knowledge_ids:
-                documents = self.load_text_document(f"{KleeSettings.temp_file_url}{s}")
-                index = self.build_auto_merging_index(documents, save_dir=f"{KleeSettings.vector_url}{s}")
-                base_retriever = index.as_retriever(
-                    # streaming=True,
-                    similarity_top_k=6
-                )
-                retriever = AutoMergingRetriever(
-                    base_retriever,
-                    index.storage_context,
-                    simple_ratio_thresh=0.5,
-                    verbose=False,
-                )
-                retrievers.append(retriever)
-
-        if note_ids is not None and len(note_ids) > 0:
-            for n in note_ids:
-                documents = self.load_text_document(f"{KleeSettings.temp_file_url}{n}")
-                index = self.build_auto_merging_index(documents, save_dir=f"{KleeSettings.vector_url}{n}")
-                base_retriever = index.as_retriever(
-                    similarity_top_k=12
-                )
-                retriever = AutoMergingRetriever(
-                    base_retriever,
-                    index.storage_context,
-                    simple_ratio_thresh=0.2,
-                    verbose=False,
-                )
-
-                retrievers.append(retriever)
-
-        if file_infos is not None:
-            for key in file_infos:
-                knowledge_id = key
-                files = file_infos.get(knowledge_id)
-                for file in files:
-                    documents = self.load_text_document(source=f"{KleeSettings.temp_file_url}{file.id}")
-                    index = self.build_auto_merging_index(documents, save_dir=f"{KleeSettings.vector_url}{file.id}")
-                    base_retriever = index.as_retriever(
-                        similarity_top_k=6
-                    )
-                    retriever = AutoMergingRetriever(
-                        base_retriever,
-                        index.storage_context,
-                        simple_ratio_thresh=0.2,
-                        verbose=False,
-                    )
-                    retrievers.append(retriever)
+        llm = llm or llamaSettings.llm
+        # index loading and first time embedding are blocking, keep them off the event loop
+        retrievers, sparse_retrievers, source_ids, sparse_source_ids = await run_in_threadpool(
+            self._collect_source_retrievers,
+            knowledge_ids=knowledge_ids,
+            note_ids=note_ids,
+            file_infos=file_infos,
+            vector_precisions=vector_precisions
+        )
 
         # 文本问答模板
         text_qa_prompt = """
@@ -765,8 +1014,12 @@ class LlamaIndexService:
            """
 
         if len(retrievers) == 0:
-            documents = self.load_text_document_default(f"{KleeSettings.temp_file_url}default")
-            index = self.build_auto_merging_index(documents=documents, save_dir=f"{KleeSettings.vector_url}default")
+            documents = await run_in_threadpool(self.load_text_document_default, f"{KleeSettings.temp_file_url}default")
+            index = await run_in_threadpool(
+                self.build_auto_merging_index,
+                documents=documents,
+                save_dir=f"{KleeSettings.vector_url}default"
+            )
             base_retriever = index.as_retriever(
                 similarity_top_k=12
             )
@@ -777,6 +1030,7 @@ class LlamaIndexService:
                 verbose=False,
             )
             retrievers.append(retriever)
+            source_ids.append("default")
 
             # 设置问答模板不需要根据上下文内容
             text_qa_prompt = """
@@ -798,17 +1052,32 @@ class LlamaIndexService:
             "Queries:\n"
         )
 
-        qf_retriever = QueryFusionRetriever(
+        qf_retriever = KleeQueryFusionRetriever(
             retrievers,
+            retrieval_mode=retrieval_mode,
+            conversation_id=conversation_id,
+            sparse_retrievers=sparse_retrievers,
+            keyword_top_k=settings.keyword_top_k,
+            source_ids=source_ids,
+            sparse_source_ids=sparse_source_ids,
             similarity_top_k=12,
             num_queries=4,
             use_async=True,
             query_gen_prompt=QUERY_GEN_PROMPT,
+            llm=llm,
+        )
+
+        context_packer = ContextPacker.from_llm(
+            llm,
+            budget_ratio=settings.context_budget_ratio,
+            max_tokens=settings.context_max_tokens
         )
 
         auto_merging_engine = RetrieverQueryEngine.from_args(
             qf_retriever,
+            llm=llm,
             streaming=streaming,
+            node_postprocessors=[context_packer],
             # text_qa_template=PromptTemplate(text_qa_prompt),
             # refine_template=PromptTemplate(refine_prompt),
             # summary_template=PromptTemplate(summary_prompt),
@@ -818,6 +1087,149 @@ class LlamaIndexService:
 
         return auto_merging_engine
 
+    def _collect_source_retrievers(
+            self,
+            knowledge_ids: List[str] = None,
+            note_ids: List[str] = None,
+            file_infos: dict = None,
+            vector_precisions: Dict[str, str] = None,
+            stop: Optional[threading.Event] = None
+    ):
+        """
+        Build the retrievers of every knowledge, note and file source
+        Args:
+            knowledge_ids: list of knowledge ids
+            note_ids: list of note ids
+            file_infos: dict of knowledge id -> files
+            vector_precisions: knowledge id -> vector precision of its files, float32 when missing
+            stop: once set, no further source is built and the retrievers built so far are returned
+        Returns: (dense retrievers, sparse retrievers, dense source ids, sparse source ids)
+        """
+        vector_precisions = vector_precisions or {}
+        retrievers = []
+        sparse_retrievers = []
+        source_ids = []
+        sparse_source_ids = []
+        if stop is None:
+            stop = threading.Event()
+        if knowledge_ids is not None and len(knowledge_ids) > 0:
+            for s in knowledge_ids:
+                if stop.is_set():
+                    break
+                dense, sparse = self._build_source_retrievers(s, similarity_top_k=6, simple_ratio_thresh=0.5)
+                retrievers.append(dense)
+                sparse_retrievers.extend(sparse)
+                source_ids.append(s)
+                sparse_source_ids.extend(s for _ in sparse)
+
+        if note_ids is not None and len(note_ids) > 0:
+            for n in note_ids:
+                if stop.is_set():
+                    break
+                dense, sparse = self._build_source_retrievers(n, similarity_top_k=12, simple_ratio_thresh=0.2)
+                retrievers.append(dense)
+                sparse_retrievers.extend(sparse)
+                source_ids.append(n)
+                sparse_source_ids.extend(n for _ in sparse)
+
+        if file_infos is not None:
+            for key in file_infos:
+                knowledge_id = key
+                files = file_infos.get(knowledge_id)
+                precision = vector_precisions.get(knowledge_id, VectorPrecision.FLOAT32.value)
+                for file in files:
+                    if stop.is_set():
+                        break
+                    dense, sparse = self._build_source_retrievers(
+                        file.id,
+                        similarity_top_k=6,
+                        simple_ratio_thresh=0.2,
+                        precision=precision
+                    )
+                    retrievers.append(dense)
+                    sparse_retrievers.extend(sparse)
+                    source_ids.append(file.id)
+                    sparse_source_ids.extend(file.id for _ in sparse)
+        return retrievers, sparse_retrievers, source_ids, sparse_source_ids
+
+    def source_set_version(
+            self,
+            source_ids: List[str]
+    ) -> str:
+        """
+        Version of the indexes a conversation retrieves from
+        Args:
+            source_ids: file and note ids
+        Returns: digest changing whenever one of the sources is reindexed
+        """
+        return source_set_version({s: f"{KleeSettings.vector_url}{s}" for s in source_ids})
+
+    def _build_source_retrievers(
+            self,
+            source_id: str,
+            similarity_top_k: int,
+            simple_ratio_thresh: float,
+            precision: str = VectorPrecision.FLOAT32.value
+    ):
+        """
+        Build the retrievers of one knowledge file or note
+        Args:
+            source_id: file or note id, names both the temp file dir and the vector dir
+            similarity_top_k: top k of the dense and sparse retrievers
+            simple_ratio_thresh: auto merging threshold
+            precision: vector precision of the source
+        Returns: (cached auto merging dense retriever, list holding the cached auto merging BM25 retriever when hybrid is enabled)
+        """
+        save_dir = f"{KleeSettings.vector_url}{source_id}"
+        # a warm-up and a chat on the same source must not build or persist its index twice at once
+        with index_build_locks.lock(save_dir):
+            documents = None
+            if not os.path.exists(save_dir):
+                documents = self.load_text_document(f"{KleeSettings.temp_file_url}{source_id}")
+            index = self.build_auto_merging_index(documents, save_dir=save_dir, precision=precision)
+            version = index_version(save_dir)
+            bm25_index = None
+            if settings.hybrid_retrieval:
+                bm25_index = loaded_index_cache.get_or_load(
+                    (save_dir, "bm25"),
+                    version,
+                    lambda: load_or_build_bm25_index(
+                        save_dir,
+                        index.docstore,
+                        index.index_struct.nodes_dict.values()
+                    )
+                )
+        # results depend on the retriever configuration as well as on the query and the index
+        namespace = f"{source_id}:{similarity_top_k}:{simple_ratio_thresh}"
+
+        dense_retriever = CachedRetriever(
+            AutoMergingRetriever(
+                index.as_retriever(similarity_top_k=similarity_top_k),
+                index.storage_context,
+                simple_ratio_thresh=simple_ratio_thresh,
+                verbose=False,
+            ),
+            index.docstore,
+            namespace=f"{namespace}:dense:{precision}",
+            version=version
+        )
+
+        sparse_retrievers = []
+        if bm25_index is not None:
+            sparse_retrievers.append(CachedRetriever(
+                AutoMergingRetriever(
+                    BM25Retriever(bm25_index, index.docstore, similarity_top_k=similarity_top_k),
+                    index.storage_context,
+                    simple_ratio_thresh=simple_ratio_thresh,
+                    verbose=False,
+                ),
+                index.docstore,
+                namespace=f"{namespace}:bm25",
+                version=version
+            ))
+
+        return dense_retriever, sparse_retrievers
+
     async def has_files(
             self,
             path: str = None
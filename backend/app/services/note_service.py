@@ -4,13 +4,15 @@ import time
 import uuid
 from typing import List, Optional
 
-from sqlalchemy import select, or_, false, true
+from sqlalchemy import select, or_, false, true, literal_column
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.common.FullTextSearch import full_text_match
 from app.model.Response import ResponseContent
 from app.model.note import CreateNoteRequest, Note, NoteResponse
 from app.services.client_sqlite_service import db_transaction
 from app.model.klee_settings import Settings as KleeSettings
+from app.setting import settings
 from app.services.llama_cloud.llama_cloud_file_service import LlamaCloudFileService
 from app.services.llama_index_service import LlamaIndexService
 
@@ -143,7 +145,22 @@ class NoteService:
             NoteServiceException: If there's an error retrieving notes
         """
         try:
-            query = select(Note)
+            local_mode = Note.local_mode == (true() if KleeSettings.local_mode else false())
+            # title hits rank above content hits
+            match = await full_text_match(session, Note.__tablename__, keyword, weights=(10.0, 1.0)) if keyword else None
+            if match is not None:
+                rowid = literal_column(f"{Note.__tablename__}.rowid")
+                query = (
+                    select(Note, match.snippet)
+                    .join(match.table, match.table.c.rowid == rowid)
+                    .filter(match.condition, local_mode)
+                    .order_by(match.rank)
+                    .limit(settings.search_result_limit)
+                )
+                result = await session.execute(query)
+                return [NoteResponse(**note.__dict__, snippet=snippet) for note, snippet in result.all()]
+
+            query = select(Note).filter(local_mode)
             if keyword:
                 query = query.filter(
                     or_(
@@ -151,14 +168,9 @@ class NoteService:
                         Note.title.ilike(f"%{keyword}%")
                     )
                 )
-            
-            query = query.filter(
-                Note.local_mode == (true() if KleeSettings.local_mode else false())
-            )
 
             result = await session.execute(query)
-            notes = result.scalars().all()
-            return [NoteResponse(**note.__dict__) for note in notes]
+            return [NoteResponse(**note.__dict__) for note in result.scalars().all()]
         except Exception as e:
             logger.error(f"Error retrieving notes: {str(e)}")
             raise NoteServiceException(f"Failed to retrieve notes: {str(e)}") from e
@@ -47,6 +47,88 @@ def get_optimal_thread_count():
 class Settings(BaseSettings):
     port: int = 6190
     max_content_length: int = 6144
+    # candidates rescored with float32 vectors per result on float16/int8 knowledge bases
+    vector_rescore_factor: int = 4
+    # LLM generated sub-queries kept for the "cached" retrieval mode
+    query_cache_size: int = 256
+    # fuse BM25 results with vector results by reciprocal rank
+    hybrid_retrieval: bool = True
+    # results kept when a keyword-heavy query is answered from the BM25 index alone
+    keyword_top_k: int = 6
+    # seconds a single source may take before the answer continues without it
+    retrieval_source_deadline: float = 5.0
+    # threads shared by all concurrent retrievals
+    retrieval_max_workers: int = 8
+    # tasks one retrieval keeps on those threads at a time, so a single request cannot fill the pool
+    retrieval_request_max_concurrency: int = 4
+    # per-source deadline of the retrieval only search API
+    search_source_deadline: float = 1.0
+    # share of the model context window (minus the answer) that retrieved context may fill
+    context_budget_ratio: float = 0.6
+    # hard cap on retrieved context tokens, 0 derives it from the context window only
+    context_max_tokens: int = 0
+    # serve answers to near-identical questions over unchanged sources from memory
+    answer_cache_enabled: bool = False
+    # minimum cosine similarity between question embeddings for a cache hit
+    answer_cache_threshold: float = 0.95
+    answer_cache_size: int = 512
+    # retrieval results (node ids and scores) kept per (query, source, index version), 0 disables
+    retrieval_cache_size: int = 1024
+    # loaded source indexes kept in memory between questions
+    index_cache_size: int = 16
+    # pending events between full message snapshots in the delta streaming protocol
+    stream_snapshot_interval: int = 64
+    # pooled upstream http clients (supabase, llama cloud, ollama)
+    http_max_connections: int = 20
+    http_max_keepalive_connections: int = 10
+    http_keepalive_expiry: float = 60.0
+    http_timeout: float = 60.0
+    http_connect_timeout: float = 10.0
+    # used only when the h2 package is installed
+    http2: bool = True
+    # seconds between client disconnect checks while streaming
+    disconnect_poll_interval: float = 0.25
+    # LLM requests running at once per backend and model, queued by priority beyond that
+    llm_local_concurrency: int = 1
+    llm_cloud_concurrency: int = 8
+    # constructed LLM clients kept for switching back to a model without rebuilding it
+    llm_cache_size: int = 4
+    # in-process llama.cpp models (klee and local providers), threads 0 sizes them from the CPU
+    llamacpp_max_models: int = 1
+    llamacpp_context_window: int = 4096
+    llamacpp_max_new_tokens: int = 1024
+    llamacpp_n_threads: int = 0
+    llamacpp_n_threads_batch: int = 0
+    llamacpp_n_batch: int = 512
+    llamacpp_n_gpu_layers: int = 0
+    llamacpp_use_mlock: bool = False
+    # on-disk prompt state cache per llama.cpp model, reused by follow-up turns, 0 disables
+    llamacpp_prompt_cache_gb: float = 2.0
+    # a cached state is restored only when the prompt shares this many tokens and this share of the state with it
+    llamacpp_prompt_cache_min_prefix: int = 64
+    llamacpp_prompt_cache_min_prefix_ratio: float = 0.25
+    # defaults to ~/.cache/klee/prompt_cache
+    prompt_cache_dir: str = ""
+    ollama_base_url: str = "http://localhost:11434"
+    # how long Ollama keeps a model loaded after a warm-up or request
+    ollama_keep_alive: str = "10m"
+    # memory resident Ollama models may use together, 0 for half the physical memory
+    ollama_memory_budget_gb: float = 0
+    # conversations whose Ollama context is kept so follow-up turns skip the history prefill, 0 disables
+    ollama_context_cache_size: int = 64
+    # pragmas applied to every SQLite connection, WAL lets list endpoints read while chats commit
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+    # negative values are KiB, positive values pages
+    sqlite_cache_size: int = -64 * 1024
+    sqlite_temp_store: str = "MEMORY"
+    sqlite_busy_timeout_ms: int = 5000
+    # messages returned per page when opening a conversation
+    message_page_size: int = 50
+    message_page_max_size: int = 500
+    # rows a full-text search returns at most per table
+    search_result_limit: int = 200
 
 
 settings = Settings()
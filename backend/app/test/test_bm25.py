@@ -0,0 +1,59 @@
+from llama_index.core.schema import TextNode
+
+from app.common.BM25Retriever import BM25Index, tokenize
+
+
+def _index(texts):
+    return BM25Index.from_nodes([TextNode(id_=node_id, text=text) for node_id, text in texts.items()])
+
+
+def test_tokenize_keeps_compound_identifiers_and_their_parts():
+    assert tokenize("Error ERR-1042 in v1.2.3") == ["error", "err-1042", "err", "1042", "in", "v1.2.3", "v1", "2", "3"]
+
+
+def test_tokenize_indexes_cjk_unigrams_and_bigrams():
+    assert tokenize("检索增强") == ["检", "索", "增", "强", "检索", "索增", "增强"]
+
+
+def test_search_only_returns_documents_with_a_query_term():
+    index = _index({"a": "the import job failed", "b": "the export job finished", "c": "nothing related"})
+    assert [node_id for node_id, _ in index.search("import", 10)] == ["a"]
+    assert index.search("missing", 10) == []
+
+
+def test_rare_terms_outweigh_common_ones():
+    index = _index({
+        "a": "job failed with E1234",
+        "b": "job failed again",
+        "c": "job finished",
+        "d": "job queued",
+    })
+    results = index.search("job E1234", 10)
+    assert results[0][0] == "a"
+    assert results[0][1] > results[1][1]
+
+
+def test_shorter_documents_rank_higher_for_the_same_term_frequency():
+    index = _index({
+        "short": "timeout error",
+        "long": "timeout error while the nightly import job was reading a very large spreadsheet upload",
+    })
+    assert [node_id for node_id, _ in index.search("timeout", 10)] == ["short", "long"]
+
+
+def test_search_is_limited_to_top_k_best_first():
+    index = _index({str(i): "report " * (i + 1) for i in range(5)})
+    results = index.search("report", 2)
+    assert len(results) == 2
+    assert results[0][1] >= results[1][1]
+
+
+def test_persisted_index_scores_the_same(tmp_path):
+    index = _index({"a": "vector store quantization", "b": "sparse keyword index", "c": "keyword keyword"})
+    path = str(tmp_path / "bm25_index.json")
+    index.persist(path)
+    assert BM25Index.from_persist_path(path).search("keyword index", 10) == index.search("keyword index", 10)
+
+
+def test_empty_index_returns_nothing():
+    assert BM25Index().search("anything", 5) == []
@@ -0,0 +1,94 @@
+from llama_index.core.llms.mock import MockLLM
+from llama_index.core.schema import NodeRelationship, NodeWithScore, TextNode
+
+from app.common.ContextPacker import ContextPacker
+
+
+def _packer(token_budget):
+    # one token per word keeps the budgets readable
+    return ContextPacker(token_budget=token_budget, tokenizer=str.split)
+
+
+def _node(node_id, text, score, parent=None):
+    node = TextNode(id_=node_id, text=text)
+    if parent is not None:
+        node.relationships[NodeRelationship.PARENT] = parent.as_related_node_info()
+    return NodeWithScore(node=node, score=score)
+
+
+def _ids(nodes):
+    return [n.node.node_id for n in nodes]
+
+
+def test_repeated_node_is_kept_once_with_its_best_score():
+    packed = _packer(100).postprocess_nodes([
+        _node("a", "alpha beta", 0.4),
+        _node("b", "gamma delta", 0.6),
+        _node("a", "alpha beta", 0.9),
+    ])
+    assert _ids(packed) == ["a", "b"]
+    assert packed[0].score == 0.9
+
+
+def test_child_of_a_kept_parent_is_dropped():
+    parent = TextNode(id_="parent", text="one two three four")
+    packed = _packer(100).postprocess_nodes([
+        NodeWithScore(node=parent, score=0.9),
+        _node("child", "an unrelated chunk of the same section", 0.5, parent=parent),
+    ])
+    assert _ids(packed) == ["parent"]
+
+
+def test_text_contained_in_a_kept_node_is_dropped():
+    packed = _packer(100).postprocess_nodes([
+        _node("long", "the import job failed with error E1234 at midnight", 0.8),
+        _node("overlap", "failed with error E1234", 0.7),
+        _node("other", "the export job finished", 0.6),
+    ])
+    assert _ids(packed) == ["long", "other"]
+
+
+def test_parent_ranked_below_its_children_replaces_them_at_the_best_rank():
+    packed = _packer(100).postprocess_nodes([
+        _node("child-1", "first half", 0.9),
+        _node("other", "somewhere else", 0.8),
+        _node("child-2", "second half", 0.7),
+        _node("parent", "first half and second half", 0.5),
+    ])
+    assert _ids(packed) == ["parent", "other"]
+    assert packed[0].score == 0.9
+
+
+def test_nodes_are_packed_best_first_within_the_token_budget():
+    packer = _packer(8)
+    packed = packer.postprocess_nodes([
+        _node("small", "six seven", 0.5),
+        _node("best", "one two three four five", 0.9),
+        _node("large", "a b c d e f", 0.7),
+    ])
+    # the large node does not fit after the best one, the smaller one below it still does
+    assert _ids(packed) == ["best", "small"]
+    assert packer.last_stats == {
+        "nodes_in": 3,
+        "nodes_out": 2,
+        "tokens_in": 13,
+        "tokens_out": 7,
+        "tokens_saved": 6,
+        "token_budget": 8
+    }
+
+
+def test_best_node_is_kept_even_over_budget():
+    packed = _packer(3).postprocess_nodes([
+        _node("best", "one two three four five", 0.9),
+        _node("next", "six", 0.8),
+    ])
+    assert _ids(packed) == ["best"]
+
+
+def test_budget_follows_the_model_context_window():
+    llm = MockLLM(max_tokens=256)
+    window = llm.metadata.context_window
+    assert ContextPacker.from_llm(llm, budget_ratio=0.5).token_budget == int((window - 256) * 0.5)
+    assert ContextPacker.from_llm(llm, budget_ratio=0.5, max_tokens=300).token_budget == 300
+    assert ContextPacker.from_llm(llm, budget_ratio=0.01).token_budget == 256
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.model.db_migrations import MIGRATIONS
+from app.model.db_schema import CREATE_TABLE_STATEMENTS
+from app.services.client_sqlite_service import migrate_db
+
+_NOTE = (
+    "INSERT INTO note (id, folder_id, title, content, type, status, is_pin, create_at, update_at) "
+    "VALUES (:id, '', :title, :content, 'note', 'normal', 0, 0, 0)"
+)
+
+
+async def _schema(conn):
+    result = await conn.execute(text("SELECT type, name, sql FROM sqlite_master ORDER BY type, name"))
+    return result.all()
+
+
+def _run(db_path, work):
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+        try:
+            return await work(engine)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+
+async def _create_tables(engine):
+    async with engine.begin() as conn:
+        for statement in CREATE_TABLE_STATEMENTS:
+            await conn.execute(text(statement))
+        await conn.execute(text(_NOTE), {"id": "n1", "title": "Quarterly report", "content": "revenue grew"})
+
+
+async def _migrate(engine):
+    await migrate_db(engine)
+    async with engine.begin() as conn:
+        version = (await conn.execute(text("PRAGMA user_version"))).scalar()
+        return version, await _schema(conn)
+
+
+async def _reset_version(engine):
+    async with engine.begin() as conn:
+        await conn.execute(text("PRAGMA user_version = 0"))
+
+
+async def _note_matches(engine):
+    async with engine.begin() as conn:
+        result = await conn.execute(text("SELECT rowid FROM note_fts WHERE note_fts MATCH '\"report\"'"))
+        return len(result.all())
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "klee.sqlite")
+
+
+def test_migrations_bring_a_new_database_to_the_latest_version(db_path):
+    _run(db_path, _create_tables)
+    version, schema = _run(db_path, _migrate)
+
+    assert version == MIGRATIONS[-1].version
+    names = {name for _, name, _ in schema}
+    assert {"note_fts", "llama_chat_conversation_fts", "llama_chat_message_fts"} <= names
+    assert "ix_llama_chat_message_conversation_time" in names
+    assert _run(db_path, _note_matches) == 1
+
+
+def test_running_migrations_twice_changes_nothing(db_path):
+    _run(db_path, _create_tables)
+    first = _run(db_path, _migrate)
+    assert _run(db_path, _migrate) == first
+
+
+def test_migrations_rerun_from_version_zero_are_idempotent(db_path):
+    _run(db_path, _create_tables)
+    first = _run(db_path, _migrate)
+
+    # a migration interrupted before it recorded its version runs all of its steps again
+    _run(db_path, _reset_version)
+    assert _run(db_path, _migrate) == first
+    assert _run(db_path, _note_matches) == 1
+
+
+def test_columns_are_added_to_databases_created_before_them(db_path):
+    async def create_old_conversation_table(engine):
+        async with engine.begin() as conn:
+            # the table as released before conversations had a retrieval mode
+            await conn.execute(text(
+                "CREATE TABLE llama_chat_conversation (id TEXT PRIMARY KEY, title TEXT NOT NULL, create_time REAL NOT NULL)"
+            ))
+        # startup creates the missing tables and leaves the existing one as it is
+        await _create_tables(engine)
+
+    async def conversation_columns(engine):
+        async with engine.begin() as conn:
+            return {row[1] for row in await conn.execute(text("PRAGMA table_info(llama_chat_conversation)"))}
+
+    _run(db_path, create_old_conversation_table)
+    _run(db_path, _migrate)
+    assert "retrieval_mode" in _run(db_path, conversation_columns)
+
+    _run(db_path, _reset_version)
+    _run(db_path, _migrate)
+    assert "retrieval_mode" in _run(db_path, conversation_columns)
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.model.db_schema import CREATE_TABLE_STATEMENTS
+from app.services.client_sqlite_service import encode_message_cursor, fetch_message_page
+
+
+def _insert_messages(db_path, messages):
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+        async with engine.begin() as conn:
+            for statement in CREATE_TABLE_STATEMENTS:
+                await conn.execute(text(statement))
+            for message_id, conversation_id, create_time in messages:
+                await conn.execute(
+                    text(
+                        "INSERT INTO llama_chat_message (id, role, conversation_id, content, create_time, status) "
+                        "VALUES (:id, 'user', :conversation_id, :id, :create_time, 'success')"
+                    ),
+                    {"id": message_id, "conversation_id": conversation_id, "create_time": create_time}
+                )
+        await engine.dispose()
+
+    asyncio.run(run())
+
+
+def _read_pages(db_path, conversation_id, page_size):
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+        pages = []
+        cursor = None
+        async with AsyncSession(engine) as session:
+            while True:
+                messages, cursor = await fetch_message_page(session, conversation_id, page_size, cursor)
+                pages.append([m.id for m in messages])
+                if cursor is None:
+                    break
+        await engine.dispose()
+        return pages
+
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "klee.sqlite")
+
+
+def test_pages_split_messages_sharing_create_time(db_path):
+    # m1, m2 and m3 were written together, the page boundary falls between them
+    _insert_messages(db_path, [("m0", "c", 1.0), ("m1", "c", 2.0), ("m2", "c", 2.0), ("m3", "c", 2.0), ("m4", "c", 3.0)])
+    assert _read_pages(db_path, "c", 2) == [["m3", "m4"], ["m1", "m2"], ["m0"]]
+
+
+def test_pages_of_messages_all_sharing_create_time(db_path):
+    _insert_messages(db_path, [(f"m{i}", "c", 5.0) for i in range(4)])
+    assert _read_pages(db_path, "c", 1) == [["m3"], ["m2"], ["m1"], ["m0"]]
+
+
+def test_last_full_page_has_no_next_cursor(db_path):
+    _insert_messages(db_path, [("m0", "c", 1.0), ("m1", "c", 1.0), ("m2", "c", 2.0), ("m3", "c", 2.0)])
+    assert _read_pages(db_path, "c", 2) == [["m2", "m3"], ["m0", "m1"]]
+    assert _read_pages(db_path, "c", 4) == [["m0", "m1", "m2", "m3"]]
+
+
+def test_pages_only_hold_the_conversation_messages(db_path):
+    _insert_messages(db_path, [("a0", "a", 1.0), ("b0", "b", 1.0), ("a1", "a", 1.0), ("b1", "b", 2.0)])
+    assert _read_pages(db_path, "a", 1) == [["a1"], ["a0"]]
+    assert _read_pages(db_path, "empty", 10) == [[]]
+
+
+def test_cursor_past_the_oldest_message_returns_an_empty_page(db_path):
+    _insert_messages(db_path, [("m0", "c", 1.0)])
+
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+        async with AsyncSession(engine) as session:
+            result = await fetch_message_page(session, "c", 10, encode_message_cursor(1.0, 1))
+        await engine.dispose()
+        return result
+
+    assert asyncio.run(run()) == ([], None)
+
+
+def test_invalid_cursor_is_rejected(db_path):
+    _insert_messages(db_path, [])
+
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+        try:
+            async with AsyncSession(engine) as session:
+                await fetch_message_page(session, "c", 10, "not-a-cursor")
+        finally:
+            await engine.dispose()
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
@@ -0,0 +1,102 @@
+import os
+import time
+
+import numpy as np
+import pytest
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from app.common.QuantizedVectorStore import SIMPLE_VECTOR_STORE_FNAME, QuantizedVectorStore
+
+DIM = 64
+
+
+def _persist_source(persist_dir, vectors):
+    store = SimpleVectorStore()
+    store.data.embedding_dict = {f"node-{i}": v.tolist() for i, v in enumerate(vectors)}
+    store.data.text_id_to_ref_doc_id = {f"node-{i}": f"doc-{i % 7}" for i in range(len(vectors))}
+    store.persist(os.path.join(persist_dir, SIMPLE_VECTOR_STORE_FNAME))
+    return store
+
+
+def _sidecar_files(persist_dir):
+    return sorted(f for f in os.listdir(persist_dir) if f.endswith((".npy", ".npz")))
+
+
+def _query(store, vector, top_k=10):
+    return store.query(VectorStoreQuery(query_embedding=vector.tolist(), similarity_top_k=top_k))
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(1).standard_normal((500, DIM)).astype(np.float32)
+
+
+@pytest.mark.parametrize("precision", ["float16", "int8"])
+def test_quantized_query_matches_the_exact_top_k(tmp_path, vectors, precision):
+    source = _persist_source(str(tmp_path), vectors)
+    store = QuantizedVectorStore.from_persist_dir(str(tmp_path), precision=precision, rescore_factor=4)
+
+    for row in (3, 141, 377):
+        query = vectors[row] + 0.1 * np.random.default_rng(row).standard_normal(DIM).astype(np.float32)
+        expected = _query(source, query)
+        result = _query(store, query)
+        assert result.ids == expected.ids
+        assert result.similarities == pytest.approx(expected.similarities, abs=1e-5)
+
+
+@pytest.mark.parametrize("precision", ["float16", "int8"])
+def test_sampled_recall_of_the_compact_pass(vectors, precision):
+    codes, scales = QuantizedVectorStore._quantize(vectors, precision)
+    assert QuantizedVectorStore._sample_recall(vectors, codes, scales) >= 0.9
+
+
+def test_compact_codes_use_less_memory(tmp_path, vectors):
+    _persist_source(str(tmp_path), vectors)
+    float16 = QuantizedVectorStore.from_persist_dir(str(tmp_path), precision="float16").memory_stats()
+    int8 = QuantizedVectorStore.from_persist_dir(str(tmp_path), precision="int8").memory_stats()
+    assert float16["vectors"] == 500 and float16["dim"] == DIM
+    assert float16["ratio"] == pytest.approx(2.0, rel=0.01)
+    assert int8["ratio"] > 3.5
+
+
+def test_sidecar_is_reused_until_the_source_changes(tmp_path, vectors):
+    persist_dir = str(tmp_path)
+    _persist_source(persist_dir, vectors)
+    QuantizedVectorStore.from_persist_dir(persist_dir, precision="float16")
+    first = _sidecar_files(persist_dir)
+    mtimes = {f: os.path.getmtime(os.path.join(persist_dir, f)) for f in first}
+
+    QuantizedVectorStore.from_persist_dir(persist_dir, precision="int8")
+    both = _sidecar_files(persist_dir)
+    assert len(both) == 3
+    # the float32 matrix a loaded float16 store maps is shared, never rewritten
+    assert {f: os.path.getmtime(os.path.join(persist_dir, f)) for f in first} == mtimes
+
+    time.sleep(0.01)
+    _persist_source(persist_dir, vectors[:400])
+    store = QuantizedVectorStore.from_persist_dir(persist_dir, precision="float16")
+    rebuilt = _sidecar_files(persist_dir)
+    assert store.memory_stats()["vectors"] == 400
+    assert len(rebuilt) == 2
+    assert not set(rebuilt) & set(both)
+
+
+def test_persist_after_add_rebuilds_the_sidecar(tmp_path, vectors):
+    persist_dir = str(tmp_path)
+    _persist_source(persist_dir, vectors[:300])
+    store = QuantizedVectorStore.from_persist_dir(persist_dir, precision="int8")
+
+    store.delete("doc-0")
+    assert store.data.embedding_dict
+
+    time.sleep(0.01)
+    store.persist(os.path.join(persist_dir, SIMPLE_VECTOR_STORE_FNAME))
+    assert not store.data.embedding_dict
+    remaining = [f"node-{i}" for i in range(300) if i % 7 != 0]
+    assert store.memory_stats()["vectors"] == len(remaining)
+
+    result = _query(store, vectors[1])
+    assert result.ids[0] == "node-1"
+    assert "node-7" not in result.ids
+    assert QuantizedVectorStore.from_persist_dir(persist_dir, precision="int8").memory_stats()["vectors"] == len(remaining)
@@ -0,0 +1,54 @@
+import pytest
+
+from app.common.QueryExpansion import expand_query, is_identifier, is_keyword_query, tokenize
+
+
+@pytest.mark.parametrize("query", [
+    "what is love.Please reply in English.",
+    "what is love.",
+    "how do I write a good summary?",
+    "is this ok?",
+    "and/or",
+])
+def test_plain_questions_are_not_keyword_queries(query):
+    assert not is_keyword_query(query)
+
+
+@pytest.mark.parametrize("query", [
+    "why does error E1234 happen",
+    "what is snake_case_name",
+    "where is /etc/hosts.",
+    "os.path.join usage",
+    "config.yaml missing",
+    "HTTP status meaning",
+    "src/app.py fails",
+    "version 2.3.1 notes",
+    "tell me about java.util.List",
+])
+def test_identifier_questions_are_keyword_queries(query):
+    assert is_keyword_query(query)
+
+
+def test_long_questions_are_not_keyword_queries():
+    assert not is_keyword_query("why does the nightly import job fail with error E1234 on large spreadsheet uploads")
+
+
+def test_tokenize_strips_sentence_punctuation():
+    assert tokenize("what is love.Please reply in English.") == ["what", "is", "love", "Please", "reply", "in", "English"]
+    assert tokenize("see /etc/hosts, then v2.") == ["see", "/etc/hosts", "then", "v2"]
+
+
+def test_sentence_joins_are_not_identifiers():
+    assert not is_identifier("love.Please")
+    assert is_identifier("config.yaml")
+    assert is_identifier("java.util.List")
+
+
+def test_expand_query_has_no_punctuation_noise():
+    assert expand_query("what is love.", 3) == ["love"]
+    assert expand_query("why does error E1234 happen", 3) == ["error E1234 happen", "E1234"]
+
+
+def test_expand_query_never_repeats_the_query():
+    assert expand_query("E1234", 3) == []
+    assert expand_query("what is E1234 and E5678", 1) == ["E1234 E5678"]
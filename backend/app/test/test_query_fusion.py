@@ -0,0 +1,57 @@
+from llama_index.core.llms.mock import MockLLM
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+from app.common.KleeQueryFusionRetriever import KleeQueryFusionRetriever
+from app.common.LlamaEnum import RetrievalMode
+
+_NODES = {name: TextNode(id_=name, text=f"text of {name}") for name in "abcdef"}
+
+
+class FixedRetriever(BaseRetriever):
+    def __init__(self, ranked):
+        self._ranked = ranked
+        super().__init__()
+
+    def _retrieve(self, query_bundle: QueryBundle):
+        return [NodeWithScore(node=_NODES[name], score=score) for name, score in self._ranked]
+
+
+def _fusion(dense, sparse, similarity_top_k=3, keyword_top_k=6):
+    return KleeQueryFusionRetriever(
+        [FixedRetriever(dense)],
+        retrieval_mode=RetrievalMode.NONE.value,
+        sparse_retrievers=[FixedRetriever(sparse)],
+        similarity_top_k=similarity_top_k,
+        keyword_top_k=keyword_top_k,
+        llm=MockLLM(),
+        use_async=False
+    )
+
+
+def _ids(nodes):
+    return [n.node.node_id for n in nodes]
+
+
+def test_reciprocal_rank_fusion_puts_nodes_found_by_both_retrievers_first():
+    retriever = _fusion(dense=[("a", 0.9), ("b", 0.8), ("c", 0.7)], sparse=[("c", 12.0), ("d", 3.0)])
+    # c: 1/62 + 1/60, a: 1/60, b and d: 1/61 each, ties keep the dense retriever's order
+    assert _ids(retriever.retrieve("how are search results merged")) == ["c", "a", "b"]
+
+
+def test_reciprocal_rank_fusion_ignores_raw_score_scales():
+    retriever = _fusion(dense=[("a", 0.2), ("b", 0.1)], sparse=[("b", 50.0), ("c", 40.0)], similarity_top_k=4)
+    nodes = retriever.retrieve("how are search results merged")
+    assert _ids(nodes) == ["b", "a", "c"]
+    assert nodes[0].score > nodes[1].score > nodes[2].score
+
+
+def test_keyword_queries_are_answered_from_sparse_hits_alone():
+    retriever = _fusion(dense=[("a", 0.9)], sparse=[("e", 2.0), ("f", 7.0)], keyword_top_k=1)
+    assert _ids(retriever.retrieve("why does error E1234 happen")) == ["f"]
+    assert retriever.last_report.results.keys() == {0}
+
+
+def test_keyword_queries_without_sparse_hits_fall_back_to_fusion():
+    retriever = _fusion(dense=[("a", 0.9), ("b", 0.8)], sparse=[])
+    assert _ids(retriever.retrieve("why does error E1234 happen")) == ["a", "b"]
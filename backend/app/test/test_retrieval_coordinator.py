@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+from app.common.RetrievalCoordinator import RetrievalCoordinator
+
+
+class SleepingRetriever:
+    """Retriever taking `delay` seconds, recording how many of its kind run at once"""
+
+    running = 0
+    max_running = 0
+    _lock = threading.Lock()
+
+    def __init__(self, name: str, delay: float):
+        self.name = name
+        self.delay = delay
+        self.started = threading.Event()
+
+    def retrieve(self, query: QueryBundle):
+        self.started.set()
+        with SleepingRetriever._lock:
+            SleepingRetriever.running += 1
+            SleepingRetriever.max_running = max(SleepingRetriever.max_running, SleepingRetriever.running)
+        try:
+            time.sleep(self.delay)
+        finally:
+            with SleepingRetriever._lock:
+                SleepingRetriever.running -= 1
+        return [NodeWithScore(node=TextNode(id_=self.name, text=self.name), score=1.0)]
+
+
+@pytest.fixture
+def executor():
+    SleepingRetriever.running = SleepingRetriever.max_running = 0
+    pool = ThreadPoolExecutor(max_workers=8)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def _tasks(*retrievers):
+    return [(r.name, r.name, r, QueryBundle("q")) for r in retrievers]
+
+
+def test_slow_source_is_dropped_at_its_deadline(executor):
+    coordinator = RetrievalCoordinator(deadline=0.2, executor=executor, max_concurrency=4)
+    report = coordinator.run(_tasks(SleepingRetriever("fast", 0.01), SleepingRetriever("slow", 1.0)))
+
+    assert list(report.results) == ["fast"]
+    assert report.timed_out == ["slow"]
+    assert report.elapsed < 0.6
+
+
+def test_slow_source_is_dropped_at_its_deadline_on_the_event_loop(executor):
+    coordinator = RetrievalCoordinator(deadline=0.2, executor=executor, max_concurrency=4)
+    report = asyncio.run(coordinator.arun(_tasks(SleepingRetriever("fast", 0.01), SleepingRetriever("slow", 1.0))))
+
+    assert list(report.results) == ["fast"]
+    assert report.timed_out == ["slow"]
+
+
+def test_deadline_starts_when_a_worker_runs_the_source():
+    pool = ThreadPoolExecutor(max_workers=1)
+    try:
+        # another request holds the only worker for most of the deadline
+        pool.submit(time.sleep, 0.3)
+        coordinator = RetrievalCoordinator(deadline=0.4, executor=pool, max_concurrency=4)
+        report = coordinator.run(_tasks(SleepingRetriever("queued", 0.2)))
+    finally:
+        pool.shutdown(wait=True)
+
+    # finished 0.5s after the fan-out began but 0.2s after it started running
+    assert list(report.results) == ["queued"]
+    assert report.timed_out == []
+    assert report.elapsed >= 0.45
+
+
+def test_source_still_queued_at_the_deadline_never_runs():
+    pool = ThreadPoolExecutor(max_workers=1)
+    queued = SleepingRetriever("queued", 0.01)
+    try:
+        pool.submit(time.sleep, 0.5)
+        coordinator = RetrievalCoordinator(deadline=0.2, executor=pool, max_concurrency=4)
+        report = coordinator.run(_tasks(queued))
+    finally:
+        pool.shutdown(wait=True)
+
+    assert report.results == {}
+    assert report.timed_out == ["queued"]
+    assert not queued.started.is_set()
+
+
+def test_fan_out_is_capped_per_request(executor):
+    coordinator = RetrievalCoordinator(deadline=5.0, executor=executor, max_concurrency=2)
+    retrievers = [SleepingRetriever(f"source-{i}", 0.1) for i in range(5)]
+    report = coordinator.run(_tasks(*retrievers))
+
+    assert sorted(report.results) == sorted(r.name for r in retrievers)
+    assert SleepingRetriever.max_running == 2
+    # five 0.1s retrievals two at a time
+    assert report.elapsed >= 0.25
+
+
+def test_failed_source_is_reported_and_the_others_kept(executor):
+    class FailingRetriever(SleepingRetriever):
+        def retrieve(self, query):
+            raise RuntimeError("index missing")
+
+    coordinator = RetrievalCoordinator(deadline=1.0, executor=executor, max_concurrency=4)
+    report = coordinator.run(_tasks(SleepingRetriever("ok", 0.01), FailingRetriever("broken", 0.0)))
+
+    assert list(report.results) == ["ok"]
+    assert report.failed == ["broken"]
+    assert report.timed_out == []
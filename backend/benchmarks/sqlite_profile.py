@@ -0,0 +1,132 @@
+"""
+Concurrent read/write throughput of SQLite with and without the app's pragma profile
+
+Writers insert and update chat messages with a commit per statement, the way streaming answers
+are saved. Readers page through conversations at the same time, like the list endpoints.
+
+    cd backend && python -m benchmarks.sqlite_profile --seconds 5 --writers 2 --readers 4
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+from app.services.client_sqlite_service import sqlite_pragma_statements
+
+SCHEMA = """
+CREATE TABLE llama_chat_message (
+    id TEXT PRIMARY KEY,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    create_time REAL NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE INDEX ix_llama_chat_message_conversation_time ON llama_chat_message (conversation_id, create_time);
+"""
+
+
+def connect(path: str, pragmas: list) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+    for statement in pragmas:
+        connection.execute(statement)
+    return connection
+
+
+def seed(path: str, conversations: list, messages: int) -> None:
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    now = time.time()
+    connection.executemany(
+        "INSERT INTO llama_chat_message VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (str(uuid.uuid4()), "user" if i % 2 else "assistant", "x" * 400,
+             random.choice(conversations), now + i, "success")
+            for i in range(messages)
+        ]
+    )
+    connection.commit()
+    connection.close()
+
+
+def run(pragmas: list, seconds: float, writers: int, readers: int, messages: int) -> dict:
+    directory = tempfile.mkdtemp(prefix="klee-sqlite-bench-")
+    path = os.path.join(directory, "bench.sqlite")
+    conversations = [str(uuid.uuid4()) for _ in range(200)]
+    seed(path, conversations, messages)
+
+    counts = {"writes": 0, "reads": 0, "busy": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def count(key: str) -> None:
+        with lock:
+            counts[key] += 1
+
+    def writer() -> None:
+        connection = connect(path, pragmas)
+        while time.perf_counter() < deadline:
+            message_id = str(uuid.uuid4())
+            try:
+                connection.execute(
+                    "INSERT INTO llama_chat_message VALUES (?, 'assistant', '', ?, ?, 'pending')",
+                    (message_id, random.choice(conversations), time.time())
+                )
+                connection.commit()
+                connection.execute(
+                    "UPDATE llama_chat_message SET content = ?, status = 'success' WHERE id = ?",
+                    ("y" * 800, message_id)
+                )
+                connection.commit()
+                count("writes")
+            except sqlite3.OperationalError:
+                connection.rollback()
+                count("busy")
+        connection.close()
+
+    def reader() -> None:
+        connection = connect(path, pragmas)
+        while time.perf_counter() < deadline:
+            try:
+                connection.execute(
+                    "SELECT id, role, content, create_time FROM llama_chat_message "
+                    "WHERE conversation_id = ? ORDER BY create_time DESC LIMIT 50",
+                    (random.choice(conversations),)
+                ).fetchall()
+                count("reads")
+            except sqlite3.OperationalError:
+                count("busy")
+        connection.close()
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return {key: value / seconds if key != "busy" else value for key, value in counts.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=50000)
+    args = parser.parse_args()
+
+    for name, pragmas in (("default", []), ("tuned", sqlite_pragma_statements())):
+        result = run(pragmas, args.seconds, args.writers, args.readers, args.messages)
+        print(
+            f"{name:8} writes/s {result['writes']:9.1f}   reads/s {result['reads']:9.1f}   "
+            f"busy errors {result['busy']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
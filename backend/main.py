@@ -21,9 +21,10 @@ from app.controllers import (
     llama_cloud_controller,
     note_controller,
 )
+from app.common.HttpClients import LLAMA_CLOUD, close_async_clients, get_async_client
 from app.model.db_schema import CREATE_TABLE_STATEMENTS
 from app.model.klee_settings import Settings as KleeSettings
-from app.services.client_sqlite_service import DATABASE_PATH, engine, init_db
+from app.services.client_sqlite_service import DATABASE_PATH, engine, init_db, migrate_db
 from app.services.llama_index_service import LlamaIndexService
 from app.setting import settings
 
@@ -106,6 +107,7 @@ async def init_database():
     async with engine.begin() as conn:
         for statement in CREATE_TABLE_STATEMENTS:
             await conn.execute(text(statement))
+    await migrate_db(engine)
     
     logging.getLogger(__name__).info("Database initialized successfully")
 
@@ -122,6 +124,7 @@ def configure_app(app: FastAPI, llama_index_service: LlamaIndexService):
     app.add_event_handler("startup", init_database)
     app.add_event_handler("startup", llama_index_service.init_config)
     app.add_event_handler("startup", llama_index_service.init_global_model_settings)
+    app.add_event_handler("shutdown", close_async_clients)
 
 def parse_arguments() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Klee Service FastAPI Server")
@@ -140,7 +143,7 @@ def setup_llama_cloud(api_key: Optional[str]):
         None
     """
     if api_key:
-        KleeSettings.async_llama_cloud = AsyncLlamaCloud(token=api_key)
+        KleeSettings.async_llama_cloud = AsyncLlamaCloud(token=api_key, httpx_client=get_async_client(LLAMA_CLOUD))
     KleeSettings.local_mode = True
 
 def main():
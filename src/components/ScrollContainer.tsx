@@ -2,12 +2,21 @@ import { useState } from 'react'
 import { useScrollToBottom } from '@/hooks/use-scroll'
 import { ScrollArea } from '@/components/ui/scroll-area'
 
-export default function ScrollContainer({ children }: { children: React.ReactNode }) {
+export default function ScrollContainer({
+  children,
+  onReachTop,
+}: {
+  children: React.ReactNode
+  onReachTop?: (viewport: HTMLDivElement) => void
+}) {
   const { setAutoScroll } = useScrollToBottom()
   const [hitBottom, setHitBottom] = useState(false)
   const onBodyScroll = (e: HTMLDivElement) => {
     const isTouchBottom = e.scrollTop + e.clientHeight >= e.scrollHeight - 100
     setHitBottom(isTouchBottom)
+    if (onReachTop && e.scrollTop <= 100) {
+      onReachTop(e)
+    }
   }
 
   return (
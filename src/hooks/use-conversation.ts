@@ -5,7 +5,15 @@ import {
   updateConversationSettings,
   updateConversationTitle,
 } from '@/services'
-import { IConversation, IConversationSettings, ILlmModel, ILlmProvider, IModelLanguage, INote } from '@/types'
+import {
+  IConversation,
+  IConversationDetail,
+  IConversationSettings,
+  ILlmModel,
+  ILlmProvider,
+  IModelLanguage,
+  INote,
+} from '@/types'
 import { useMutation, useQuery, useQueryClient } from '@tanstack/react-query'
 import {
   useAllLlmModels,
@@ -116,6 +124,23 @@ export function useConversationDetailById({ id = '' }: { id?: IConversation['id'
   })
 }
 
+export function useLoadOlderMessages({ id = '' }: { id?: IConversation['id'] }) {
+  const queryClient = useQueryClient()
+  return useMutation({
+    mutationKey: ['loadOlderMessages', id],
+    mutationFn: async () => {
+      const current = queryClient.getQueryData<IConversationDetail>(['conversation', id])
+      if (!current?.next_cursor) return
+      const page = await getConversationWithMessages(id, { cursor: current.next_cursor })
+      queryClient.setQueryData(['conversation', id], (old: IConversationDetail) => ({
+        ...old,
+        messages: [...page.messages, ...(old?.messages || [])],
+        next_cursor: page.next_cursor,
+      }))
+    },
+  })
+}
+
 export function useConversationSettings() {
   const { conversationId = '' } = useParams()
   return useConversationSettingsById({ id: conversationId })
@@ -1,10 +1,11 @@
 import ChatMessageCard from '@/components/ChatMessageCard'
 import ChatInput from '@/components/ChatInput'
-import { useConversationDetailById } from '@/hooks/use-conversation'
+import { useConversationDetailById, useLoadOlderMessages } from '@/hooks/use-conversation'
 import LogoCard from '@/components/LogoCard'
 import { cn } from '@/lib/utils'
 import ScrollContainer from '@/components/ScrollContainer'
 import { useParams } from 'react-router-dom'
+import { useLayoutEffect, useRef } from 'react'
 
 export default function ConversationDetail() {
   const { conversationId } = useParams()
@@ -13,13 +14,32 @@ export default function ConversationDetail() {
 
   const hasMessages = messages.length > 0
 
+  // Older messages are loaded a page at a time when scrolling reaches the top
+  const { mutate: loadOlderMessages, isPending: isLoadingOlder } = useLoadOlderMessages({ id: conversationId })
+  const heightBeforeLoad = useRef<number | null>(null)
+  const onReachTop = (viewport: HTMLDivElement) => {
+    if (!conversationDetail?.next_cursor || isLoadingOlder) return
+    heightBeforeLoad.current = viewport.scrollHeight
+    loadOlderMessages()
+  }
+
+  // Keep the visible messages in place when an older page is prepended
+  const firstMessageId = messages[0]?.id
+  useLayoutEffect(() => {
+    const viewport = document.getElementById('__scroll_container')
+    if (viewport && heightBeforeLoad.current !== null) {
+      viewport.scrollTop += viewport.scrollHeight - heightBeforeLoad.current
+      heightBeforeLoad.current = null
+    }
+  }, [firstMessageId])
+
   // console.log('conversationDetail', conversationDetail)
   if (!conversationDetail || !conversationDetail.conversation) return null
 
   return (
     <div className={cn('mx-auto flex h-full flex-col', !hasMessages && 'items-center justify-center')}>
       {hasMessages && (
-        <ScrollContainer>
+        <ScrollContainer onReachTop={onReachTop}>
           <div className="mx-auto max-w-prose flex-1 px-4">
             {messages.map((message, index) => (
               <div key={message.id}>
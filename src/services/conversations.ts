@@ -5,8 +5,15 @@ export async function getConversations(params?: { keyword?: string }) {
   return localRequest.get('chat/conversations', { searchParams: params }).json<IConversation[]>()
 }
 
-export async function getConversationWithMessages(id: IConversation['id']) {
-  return localRequest.get(`chat/conversations/${id}`).json<IConversationDetail>()
+// Messages loaded per page, older pages are fetched with the previous page's next_cursor
+export const MESSAGE_PAGE_SIZE = 50
+
+export async function getConversationWithMessages(id: IConversation['id'], params?: { cursor?: string }) {
+  const searchParams: Record<string, string | number> = { limit: MESSAGE_PAGE_SIZE }
+  if (params?.cursor) {
+    searchParams.cursor = params.cursor
+  }
+  return localRequest.get(`chat/conversations/${id}`, { searchParams }).json<IConversationDetail>()
 }
 
 export async function createConversation(defaultConversation?: Partial<Omit<IConversation, keyof IBaseModel>>) {
@@ -228,6 +228,8 @@ export interface UserSubscription {
 export interface IConversationDetail {
   conversation: IConversation
   messages: IMessage[]
+  // cursor of the next older page of messages, null once the oldest message is loaded
+  next_cursor?: string | null
 }
 
 export type ISortBy = 'updated_at' | 'created_at'